@@ -0,0 +1,46 @@
+"""
+Authentication for the diagnostic admin endpoints.
+
+Everything here is keyed on ADMIN_TOKEN; without it the admin endpoints do not
+exist. Admin requests carry `Authorization: Bearer <ADMIN_TOKEN>`. Requests that
+ask for extra diagnostics (such as a profile) carry a short-lived signature instead
+of the token itself: `<unix time>.<hex HMAC-SHA256 of the time, keyed with ADMIN_TOKEN>`.
+"""
+import hashlib
+import hmac
+import os
+import time
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") or None
+
+# Signatures older (or further in the future) than this are rejected
+SIGNATURE_MAX_AGE = 300
+
+
+def is_admin(authorization):
+    """True if the Authorization header value carries the admin token."""
+    if ADMIN_TOKEN is None or not authorization or not authorization.startswith("Bearer "):
+        return False
+    return hmac.compare_digest(authorization[len("Bearer "):].strip().encode(), ADMIN_TOKEN.encode())
+
+
+def sign(timestamp=None):
+    """A signature for the current (or given) unix time."""
+    timestamp = str(int(timestamp if timestamp is not None else time.time()))
+    digest = hmac.new(ADMIN_TOKEN.encode(), timestamp.encode(), hashlib.sha256).hexdigest()
+    return f"{timestamp}.{digest}"
+
+
+def verify_signature(value, now=None):
+    """True if value is a current signature made with ADMIN_TOKEN."""
+    if ADMIN_TOKEN is None or not value or "." not in value:
+        return False
+    timestamp, _, digest = value.partition(".")
+    try:
+        age = abs((now if now is not None else time.time()) - int(timestamp))
+    except ValueError:
+        return False
+    if age > SIGNATURE_MAX_AGE:
+        return False
+    expected = hmac.new(ADMIN_TOKEN.encode(), timestamp.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(digest.encode(), expected.encode())
@@ -0,0 +1,355 @@
+"""
+ASGI entry point that sits next to the WSGI Flask `app`.
+
+POST /api/generate-plan is served natively on the event loop with the asyncio Gemini
+client, so one process can hold hundreds of concurrent upstream waits instead of one
+per worker thread. It goes through the same request telemetry as the Flask app (request
+ID, Server-Timing, metrics and tracing; see index.request_started). Every other route,
+streamed ones included, is bridged to the Flask app in worker threads (see wsgi_bridge).
+
+Run it with any ASGI server, e.g.:
+
+    uvicorn --app-dir api _asgi:app
+"""
+import asyncio
+import contextvars
+import io
+import json
+import os
+import ssl
+import sys
+import time
+
+from _async_client import AsyncHTTPError, get_async_client
+from _breaker import CircuitOpen
+from _plan_cache import MISS, STALE
+from _retry import RetryPolicy, is_retryable_status
+from _scheduler import UpstreamBusy
+from _singleflight import AsyncSingleFlight, SingleFlightTimeout
+from _timing import add_stage, stage_span
+from _tracing import CLIENT, current_span, trace_span
+
+import index
+
+
+# Coalesces identical in-flight requests on the event loop
+inflight_plans_async = AsyncSingleFlight()
+
+GENERATE_PLAN_ERROR = "Failed to generate plan from LLM. Check server logs for API errors or JSON parsing issues."
+
+# Reported under the same route and endpoint name as the Flask view it stands in for
+GENERATE_PLAN_ROUTE = "/api/generate-plan"
+GENERATE_PLAN_ENDPOINT = "generate_plan_endpoint"
+
+
+def classify_upstream_error_async(error):
+    """
+    Retry classification for the asyncio client, mirroring index.classify_upstream_error.
+    """
+    if isinstance(error, AsyncHTTPError):
+        response = error.response
+        return is_retryable_status(response.status), index.retry_after_seconds(response.headers.get('retry-after'), None)
+    if isinstance(error, ssl.SSLError):
+        return False, None
+    if isinstance(error, (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError)):
+        return True, None
+    return False, None
+
+
+def is_upstream_failure_async(error):
+    """
+    Circuit breaker classification for the asyncio client, mirroring index.is_upstream_failure.
+    """
+    if isinstance(error, AsyncHTTPError):
+        status = error.response.status
+        if status == 429:
+            return None
+        return status >= 500
+    if isinstance(error, (UpstreamBusy, CircuitOpen)):
+        return None
+    return True
+
+
+# Separate from index.retry_policy so the async path reports its own retry statistics
+retry_policy_async = RetryPolicy(classify_upstream_error_async)
+
+
+async def post_to_gemini_async(api_url, payload, deadline):
+    """
+    Async counterpart of index.post_to_gemini.
+    """
+    scheduler = index.upstream_scheduler
+    estimated_tokens = index.estimate_payload_tokens(payload)
+    with stage_span("queue"):
+        await scheduler.acquire_async(estimated_tokens, deadline)
+
+    client = get_async_client()
+    timeout = max(0.1, min(client.read_timeout, deadline - time.monotonic()))
+    status = "error"
+    index.upstream_in_flight.inc()
+    started = time.perf_counter()
+    try:
+        # The client buffers the whole answer, so waiting and downloading are one stage
+        with stage_span("download"):
+            response = await client.post_json(api_url, payload, timeout=timeout)
+        status = str(response.status)
+        if response.status == 429:
+            index.upstream_rate_limited.inc()
+            scheduler.backoff(index.retry_after_seconds(response.headers.get('retry-after')))
+        response.raise_for_status()
+
+        with stage_span("decode"):
+            response_json = response.json()
+    except Exception:
+        scheduler.release(estimated_tokens)
+        raise
+    finally:
+        index.upstream_in_flight.dec()
+        index.upstream_duration.observe(time.perf_counter() - started, "generateContent", status)
+        current_span().set("upstream.status", status)
+
+    index.record_token_usage(response_json.get('usageMetadata', {}), estimated_tokens)
+    return response_json
+
+
+async def call_gemini_async(api_url, payload, deadline):
+    """
+    post_to_gemini_async traced as one upstream attempt.
+    """
+    with trace_span("gemini.attempt", CLIENT, stream=False):
+        return await post_to_gemini_async(api_url, payload, deadline)
+
+
+async def generate_plan_with_llm_async(goal_text, prompt_template=None):
+    """
+    Async counterpart of index.generate_plan_with_llm.
+    """
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        index.llm_failures.inc("missing_api_key")
+        index.log.error("GEMINI_API_KEY is not set")
+        return None
+
+    api_url = index.gemini_api_url("generateContent", api_key)
+    payload = index.build_gemini_payload(goal_text, prompt_template)
+
+    try:
+        with stage_span("upstream"):
+            # Behind the shared breaker as one logical call, like index.call_gemini_with_retries
+            response_json = await index.circuit_breaker.call_async(
+                lambda: retry_policy_async.call_async(
+                    lambda deadline: index.hedger.call_async(lambda: call_gemini_async(api_url, payload, deadline))),
+                is_upstream_failure_async)
+        with stage_span("decode"):
+            return index.extract_plan(response_json)
+    except (UpstreamBusy, CircuitOpen):
+        raise
+    except AsyncHTTPError as http_err:
+        index.llm_failures.inc(f"http_{http_err.response.status}")
+        index.log.error("Gemini request failed", extra={"status": http_err.response.status, "error": str(http_err),
+                                                        "response": http_err.response.text})
+        index.raise_if_throttled(http_err.response.status, http_err.response.headers.get('retry-after'))
+        return None
+    except json.JSONDecodeError as json_err:
+        index.llm_failures.inc("invalid_json")
+        index.log.error("Gemini returned a plan that is not valid JSON", extra={"error": str(json_err)})
+        return None
+    except Exception as e:
+        index.llm_failures.inc(type(e).__name__)
+        index.log.error("Unexpected error while generating a plan", exc_info=True)
+        return None
+
+
+async def generate_plan_cached_async(goal_text, prompt_template=None):
+    """
+    Async counterpart of index.generate_plan_cached; shares the same plan cache.
+    """
+    with stage_span("cache"):
+        key = index.plan_cache_key(goal_text, prompt_template)
+        cached_plan, status = index.plan_cache.get(key)
+    if cached_plan is not None and status != STALE:
+        return cached_plan, status
+
+    async def generate():
+        plan = await generate_plan_with_llm_async(goal_text, prompt_template)
+        if plan:
+            index.plan_cache.set(key, plan, label=index.canonicalize_goal(goal_text))
+        return plan
+
+    started = time.perf_counter()
+    try:
+        plan, shared = await inflight_plans_async.do(key, generate, timeout=index.PLAN_COALESCE_TIMEOUT)
+        if shared:
+            add_stage("coalesce", time.perf_counter() - started)
+    except (UpstreamBusy, CircuitOpen):
+        if cached_plan is None:
+            raise
+        return cached_plan, STALE
+    if plan:
+        return plan, MISS
+    if cached_plan is not None:
+        return cached_plan, STALE
+    return None, MISS
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def _send_json(send, status, payload, extra_headers):
+    with stage_span("jsonify"):
+        body = json.dumps(payload).encode("utf-8")
+    headers = {
+        "content-type": "application/json",
+        "content-length": str(len(body)),
+        # Mirrors the Flask-CORS configuration of the WSGI app
+        "access-control-allow-origin": "*",
+        "access-control-expose-headers": ", ".join(index.EXPOSE_HEADERS),
+        **extra_headers,
+    }
+    headers.update(index.request_answered(GENERATE_PLAN_ENDPOINT, status))
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def generate_plan_endpoint_async(scope, receive, send):
+    """
+    Async version of index.generate_plan_endpoint.
+    """
+    headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope.get("headers", [])}
+    index.request_started(scope["method"], GENERATE_PLAN_ROUTE, GENERATE_PLAN_ENDPOINT, headers)
+    error = None
+    try:
+        status, payload, extra_headers = await _generate_plan_response(receive)
+        await _send_json(send, status, payload, extra_headers)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        index.request_finished(error)
+
+
+async def _generate_plan_response(receive):
+    """(status, JSON payload, extra headers) answering a plan request."""
+    with stage_span("parse"):
+        try:
+            data = json.loads(await _read_body(receive) or b"null")
+        except ValueError:
+            data = None
+    if not isinstance(data, dict) or not isinstance(data.get('goal'), str) or not data['goal'].strip():
+        return 400, {"error": "Missing 'goal' in request body"}, {}
+
+    try:
+        plan, cache_status = await generate_plan_cached_async(data['goal'])
+    except SingleFlightTimeout as e:
+        return 504, {"error": str(e)}, {}
+    except UpstreamBusy as e:
+        return 503, {"error": "The planner is busy right now. Please try again shortly."}, \
+            {"Retry-After": e.retry_after_header}
+    except CircuitOpen:
+        plan, source = index.degraded_plan(data['goal'])
+        return 200, plan, {"X-Plan-Degraded": source}
+
+    if plan:
+        return 200, plan, {"X-Plan-Cache": cache_status}
+    return 500, {"error": GENERATE_PLAN_ERROR}, {}
+
+
+def _wsgi_environ(scope, body):
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        # The body is buffered and no longer chunked, so its length is known for every upload
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ[name] = value
+        elif name in ("CONTENT_LENGTH", "TRANSFER_ENCODING"):
+            continue
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def wsgi_bridge(scope, receive, send):
+    """
+    Runs the Flask app for any other route in worker threads, forwarding chunks as
+    they are produced so streaming responses keep streaming.
+
+    The app call, every next() and close() run in one copied context: Flask keeps its
+    app and request contexts in ContextVars, and stream_with_context pushes them in one
+    of these calls and pops them in another, each possibly on a different pool thread.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    environ = _wsgi_environ(scope, await _read_body(receive))
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+    iterable = await loop.run_in_executor(None, context.run, index.app, environ, start_response)
+    chunks = iter(iterable)
+    done = object()
+    try:
+        await send({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+        while True:
+            chunk = await loop.run_in_executor(None, context.run, next, chunks, done)
+            if chunk is done:
+                break
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(iterable, "close"):
+            await loop.run_in_executor(None, context.run, iterable.close)
+
+
+async def app(scope, receive, send):
+    """
+    The ASGI application.
+    """
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+
+    if scope["path"] == "/api/generate-plan" and scope["method"] == "POST":
+        await generate_plan_endpoint_async(scope, receive, send)
+    else:
+        await wsgi_bridge(scope, receive, send)
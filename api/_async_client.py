@@ -0,0 +1,190 @@
+"""
+Asyncio-native HTTP/1.1 client for upstream Gemini calls.
+
+Built on asyncio streams so a single event loop can hold hundreds of concurrent
+upstream waits without tying up a thread each. Connections are kept alive and pooled
+per host, mirroring the pooled transport used by the synchronous path.
+"""
+import asyncio
+import json
+import ssl
+import threading
+from urllib.parse import urlsplit
+
+from _config import env_number
+
+
+DEFAULT_MAX_CONNECTIONS = 256
+
+
+class AsyncHTTPError(Exception):
+    """Raised for non-2xx upstream responses; carries the response."""
+
+    def __init__(self, response):
+        super().__init__(f"{response.status} {response.reason} for upstream request")
+        self.response = response
+
+
+class AsyncResponse:
+    __slots__ = ("status", "reason", "headers", "body")
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    @property
+    def text(self):
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.body)
+
+    def raise_for_status(self):
+        if not 200 <= self.status < 300:
+            raise AsyncHTTPError(self)
+
+
+class _HostPool:
+    def __init__(self, max_connections):
+        self.idle = []
+        self.slots = asyncio.Semaphore(max_connections)
+
+
+class AsyncGeminiClient:
+    """Pooled keep-alive HTTP client; one pool per (scheme, host, port)."""
+
+    def __init__(self, max_connections=None, connect_timeout=None, read_timeout=None):
+        self.max_connections = max_connections or env_number("GEMINI_ASYNC_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS, int)
+        self.connect_timeout = connect_timeout or env_number("GEMINI_CONNECT_TIMEOUT", 5.0)
+        self.read_timeout = read_timeout or env_number("GEMINI_READ_TIMEOUT", 60.0)
+        self._ssl_context = ssl.create_default_context()
+        self._pools = {}
+        self.requests = 0
+        self.new_connections = 0
+
+    def _pool(self, key):
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = _HostPool(self.max_connections)
+        return pool
+
+    async def post_json(self, url, payload, headers=None, timeout=None):
+        """POSTs `payload` as JSON and returns the buffered AsyncResponse."""
+        parts = urlsplit(url)
+        secure = parts.scheme == "https"
+        host = parts.hostname
+        port = parts.port or (443 if secure else 80)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+
+        body = json.dumps(payload).encode("utf-8")
+        lines = [
+            f"POST {target} HTTP/1.1",
+            f"Host: {parts.netloc}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            "Connection: keep-alive",
+        ]
+        for name, value in (headers or {}).items():
+            if name.lower() not in ("host", "content-type", "content-length", "connection"):
+                lines.append(f"{name}: {value}")
+        request_bytes = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+        pool = self._pool((parts.scheme, host, port))
+        self.requests += 1
+        async with pool.slots:
+            return await asyncio.wait_for(
+                self._exchange(pool, host, port, secure, request_bytes),
+                timeout or self.read_timeout,
+            )
+
+    async def _exchange(self, pool, host, port, secure, request_bytes):
+        while pool.idle:
+            reader, writer = pool.idle.pop()
+            if writer.is_closing() or reader.at_eof():
+                writer.close()
+                continue
+            try:
+                return await self._send(pool, reader, writer, request_bytes)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # The server closed the idle connection; retry on a fresh one
+                writer.close()
+
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=self._ssl_context if secure else None),
+            self.connect_timeout,
+        )
+        self.new_connections += 1
+        return await self._send(pool, reader, writer, request_bytes)
+
+    async def _send(self, pool, reader, writer, request_bytes):
+        try:
+            writer.write(request_bytes)
+            await writer.drain()
+            response, keep_alive = await _read_response(reader)
+        except BaseException:
+            writer.close()
+            raise
+        if keep_alive:
+            pool.idle.append((reader, writer))
+        else:
+            writer.close()
+        return response
+
+    def snapshot(self):
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "pool_hits": max(self.requests - self.new_connections, 0),
+            "idle_connections": sum(len(pool.idle) for pool in self._pools.values()),
+        }
+
+
+async def _read_response(reader):
+    status_line = await reader.readuntil(b"\r\n")
+    version, status, *reason = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        if line == b"\r\n":
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                # Skip optional trailers up to the terminating blank line
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b"".join(chunks)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        body = await reader.read()
+        keep_alive = False
+    return AsyncResponse(int(status), reason[0] if reason else "", headers, body), keep_alive
+
+
+# Connections belong to the event loop that opened them, so keep one client per loop
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_async_client():
+    """Returns the AsyncGeminiClient for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        with _clients_lock:
+            client = _clients.setdefault(loop, AsyncGeminiClient())
+    return client
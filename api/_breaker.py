@@ -0,0 +1,139 @@
+"""
+Circuit breaker around upstream Gemini calls.
+
+CLOSED: calls flow and their outcomes are recorded in a rolling window. When the
+window's failure rate or slow-call rate crosses its threshold, the breaker trips.
+OPEN: calls fail immediately with CircuitOpen until the open period has elapsed.
+HALF_OPEN: a limited number of probe calls go through; a success closes the breaker,
+a failure opens it again.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from _config import env_number
+
+log = logging.getLogger("metraplan.breaker")
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling the upstream while the breaker is open."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Upstream circuit is open; next probe in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Trips on error rate or latency; `is_failure(error)` may return None for neutral errors."""
+
+    def __init__(self, window=None, min_calls=None, failure_rate=None, slow_call_seconds=None,
+                 slow_call_rate=None, open_seconds=None, half_open_probes=None):
+        self.window = window or env_number("GEMINI_BREAKER_WINDOW", 20, int)
+        self.min_calls = min_calls or env_number("GEMINI_BREAKER_MIN_CALLS", 5, int)
+        self.failure_rate = failure_rate or env_number("GEMINI_BREAKER_FAILURE_RATE", 0.5)
+        self.slow_call_seconds = slow_call_seconds or env_number("GEMINI_BREAKER_SLOW_CALL", 20.0)
+        self.slow_call_rate = slow_call_rate or env_number("GEMINI_BREAKER_SLOW_RATE", 0.8)
+        self.open_seconds = open_seconds or env_number("GEMINI_BREAKER_OPEN_SECONDS", 30.0)
+        self.half_open_probes = half_open_probes or env_number("GEMINI_BREAKER_PROBES", 1, int)
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=self.window)   # (failed, slow) per call
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+
+        self.trips = 0
+        self.rejected = 0
+
+    def _transition(self, state, now):
+        self.state = state
+        if state == OPEN:
+            self._opened_at = now
+            self.trips += 1
+        self._outcomes.clear()
+        self._probes_in_flight = 0
+
+    def before_call(self):
+        """Admits a call or raises CircuitOpen."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                remaining = self._opened_at + self.open_seconds - now
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpen(remaining)
+                self._transition(HALF_OPEN, now)
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    self.rejected += 1
+                    raise CircuitOpen(self.open_seconds)
+                self._probes_in_flight += 1
+
+    def after_call(self, failed, latency):
+        """Records a call's outcome; failed=None means it says nothing about upstream health."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if failed is None:
+                    return
+                if failed or latency >= self.slow_call_seconds:
+                    self._transition(OPEN, now)
+                else:
+                    self._transition(CLOSED, now)
+                return
+            if failed is None or self.state != CLOSED:
+                return
+
+            self._outcomes.append((failed, latency >= self.slow_call_seconds))
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for f, _ in self._outcomes if f)
+            slow = sum(1 for _, s in self._outcomes if s)
+            if failures / calls >= self.failure_rate or slow / calls >= self.slow_call_rate:
+                log.warning("Upstream circuit opened", extra={"calls": calls, "failures": failures, "slow_calls": slow})
+                self._transition(OPEN, now)
+
+    def call(self, fn, is_failure):
+        """Runs fn() under the breaker, classifying any exception with is_failure(error)."""
+        self.before_call()
+        start = time.monotonic()
+        try:
+            result = fn()
+        except Exception as error:
+            self.after_call(is_failure(error), time.monotonic() - start)
+            raise
+        self.after_call(False, time.monotonic() - start)
+        return result
+
+    async def call_async(self, coro_fn, is_failure):
+        """asyncio form of call()."""
+        self.before_call()
+        start = time.monotonic()
+        try:
+            result = await coro_fn()
+        except BaseException as error:
+            # Cancellation (e.g. a hedge that lost) says nothing about upstream health
+            failed = is_failure(error) if isinstance(error, Exception) else None
+            self.after_call(failed, time.monotonic() - start)
+            raise
+        self.after_call(False, time.monotonic() - start)
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "window_calls": len(self._outcomes),
+                "window_failures": sum(1 for f, _ in self._outcomes if f),
+            }
@@ -0,0 +1,71 @@
+"""
+Goal canonicalization.
+
+Goals that only differ in Unicode form, case, spacing, punctuation or polite filler
+("please", "kindly", ...) map to the same canonical text, so they share one plan
+cache entry instead of each paying for a separate LLM call. Anything that may carry
+meaning is kept: greetings not set off by punctuation ("hello world app"), urgency
+("asap"), unbalanced quotes, and punctuation that starts a token (".NET", "-5 kg").
+"""
+import re
+import unicodedata
+
+
+# Typographic punctuation that NFKC leaves alone, folded to its ASCII equivalent
+_PUNCTUATION_MAP = str.maketrans({
+    "\u2018": "'", "\u2019": "'", "\u201a": "'", "\u201b": "'",
+    "\u201c": '"', "\u201d": '"', "\u201e": '"', "\u201f": '"',
+    "\u00ab": '"', "\u00bb": '"',
+    "\u2010": "-", "\u2011": "-", "\u2012": "-", "\u2013": "-", "\u2014": "-", "\u2015": "-",
+    "\u2212": "-",
+    "\u200b": "", "\u200c": "", "\u200d": "", "\ufeff": "",
+})
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_REPEATED_PUNCTUATION_RE = re.compile(r"([!?.,;:])\1+")
+# Only punctuation that ends a token, so ".NET" keeps its space
+_SPACE_BEFORE_PUNCTUATION_RE = re.compile(r"\s+([!?.,;:]+)(?=\s|$)")
+# A leading "." or "-" is kept when it starts a token (".net", "-5 kg"), an ellipsis is not
+_LEADING_PUNCTUATION_RE = re.compile(r"^(?:[\s,;:!?]|\.{2,}|\.(?!\w)|-(?!\d))+")
+_TRAILING_PUNCTUATION_RE = re.compile(r"[\s.,;:!?-]+$")
+_QUOTES = "\"'`"
+
+_LEADING_FILLER_RE = re.compile(
+    r"^(?:(?:please|pls|plz|kindly)[\s,]+"
+    r"|(?:hey|hi|hello)[,!.]+\s*"
+    r"|(?:can|could|would|will) you(?: please)?[\s,]+"
+    r"|i (?:want|need|would like) (?:you )?to[\s,]+"
+    r"|help me(?: to)?[\s,]+)+"
+)
+_TRAILING_FILLER_RE = re.compile(
+    r"(?:[\s,]+(?:please|pls|plz|thanks|thank you|thx))+$"
+)
+
+
+def canonicalize_goal(goal_text):
+    """
+    Returns the canonical form of a goal, used as its cache identity.
+
+    The steps are NFKC normalization, typographic punctuation folding, case folding,
+    whitespace collapsing, removal of polite filler, trimming of edge punctuation and
+    of quotes around the whole goal.
+    """
+    text = unicodedata.normalize("NFKC", goal_text).translate(_PUNCTUATION_MAP).casefold()
+    text = _WHITESPACE_RE.sub(" ", text).strip()
+    text = _SPACE_BEFORE_PUNCTUATION_RE.sub(r"\1", text)
+
+    # Filler and edge punctuation can hide each other ("Please, launch an app please!"),
+    # so strip them until the text stops changing.
+    previous = None
+    while text != previous:
+        previous = text
+        text = _LEADING_PUNCTUATION_RE.sub("", text)
+        text = _TRAILING_PUNCTUATION_RE.sub("", text)
+        if len(text) > 1 and text[0] in _QUOTES and text[-1] == text[0] and text.count(text[0]) == 2:
+            text = text[1:-1].strip()
+        text = _LEADING_FILLER_RE.sub("", text)
+        text = _TRAILING_FILLER_RE.sub("", text)
+    text = _REPEATED_PUNCTUATION_RE.sub(r"\1", text)
+
+    # Never reduce a goal to nothing just because it consisted solely of filler
+    return text or _WHITESPACE_RE.sub(" ", goal_text).strip().casefold()
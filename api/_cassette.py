@@ -0,0 +1,402 @@
+"""
+Record/replay of upstream Gemini traffic (GEMINI_CASSETTE_MODE=record|replay).
+
+In record mode the real transport is wrapped. Every upstream request is written to the
+cassette file GEMINI_CASSETTE along with its response: status, headers, the decoded
+body as timed chunks (one per line for streamed responses), the time to the response
+headers, and transport errors such as timeouts. Requests are identified by a
+fingerprint of the method, the URL without the API key, and the canonical JSON body.
+
+In replay mode no network is used. A request is answered with a recording that has
+the same fingerprint, delayed like the original and sped up by GEMINI_CASSETTE_SPEED
+(`2` is twice as fast, `0` answers at once). Read timeouts still apply. Requests with
+several recordings cycle through them in order. Requests that were never recorded get
+a 404.
+
+The cassette is a JSONL file with one interaction per line, appended to as responses
+complete. A sidecar `<cassette>.idx` maps fingerprints to the byte ranges of their
+lines, so a replay does not parse the whole file. An index that does not match the
+file (e.g. after a crash while recording) is rebuilt on open.
+"""
+import atexit
+import hashlib
+import http.client
+import json as jsonlib
+import logging
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from _config import env_number
+from _transport import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+
+log = logging.getLogger("metraplan.cassette")
+
+
+RECORD = "record"
+REPLAY = "replay"
+
+# Transport errors are recorded by name and raised again as the same kind on replay
+_ERROR_KINDS = ("SSLError", "Timeout", "ConnectionError", "ProtocolError")
+
+# Headers that describe the encoding on the wire; recorded bodies are stored decoded
+_WIRE_HEADERS = frozenset({"content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive"})
+
+# The index is rewritten after this many new recordings (and at exit)
+_INDEX_EVERY = 50
+
+
+def _public_url(url):
+    """The URL without its API key."""
+    parts = urlsplit(url)
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query) if k != "key"])
+    return parts._replace(query=query).geturl()
+
+
+def fingerprint(method, url, body):
+    parts = urlsplit(_public_url(url))
+    canonical = jsonlib.dumps({"method": method, "path": parts.path, "query": parts.query, "body": body},
+                              sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _error_kind(errors, error):
+    for kind in _ERROR_KINDS:
+        if isinstance(error, getattr(errors, kind)):
+            return kind
+    return None
+
+
+class Cassette:
+    """The cassette file and its fingerprint index."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self._lock = threading.Lock()
+        self._entries = {}      # fingerprint -> [(offset, length), ...] in recording order
+        self._cursor = {}       # fingerprint -> next recording to replay
+        self._records = {}      # offset -> parsed record, filled as replay reads them
+        self._unsaved = 0
+        self._load_index()
+
+    def _load_index(self):
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                index = jsonlib.load(f)
+            if index.get("size") == size:
+                self._entries = {fp: [tuple(span) for span in spans] for fp, spans in index["entries"].items()}
+                self._size = size
+                return
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+        self._rebuild_index(size)
+
+    def _rebuild_index(self, size):
+        self._entries = {}
+        offset = 0
+        if size:
+            with open(self.path, "rb") as f:
+                for line in f:
+                    try:
+                        fp = jsonlib.loads(line)["fingerprint"]
+                    except (ValueError, KeyError, TypeError):
+                        # A truncated last line from an interrupted recording
+                        log.warning("Skipping unreadable cassette line", extra={"path": self.path, "offset": offset})
+                    else:
+                        self._entries.setdefault(fp, []).append((offset, len(line)))
+                    offset += len(line)
+        self._size = offset
+        self._write_index()
+
+    def _write_index(self):
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                jsonlib.dump({"size": self._size, "entries": self._entries}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.index_path)
+            self._unsaved = 0
+        except OSError as e:
+            log.warning("Could not write cassette index", extra={"path": self.index_path, "error": str(e)})
+
+    def add(self, record):
+        line = (jsonlib.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(line)
+            self._entries.setdefault(record["fingerprint"], []).append((offset, len(line)))
+            self._size = offset + len(line)
+            self._unsaved += 1
+            if self._unsaved >= _INDEX_EVERY:
+                self._write_index()
+
+    def flush(self):
+        with self._lock:
+            if self._unsaved:
+                self._write_index()
+
+    def next(self, fp):
+        """The next recording for a fingerprint (cycling), or None if there is none."""
+        with self._lock:
+            spans = self._entries.get(fp)
+            if not spans:
+                return None
+            n = self._cursor.get(fp, 0)
+            self._cursor[fp] = n + 1
+            offset, length = spans[n % len(spans)]
+            record = self._records.get(offset)
+            if record is None:
+                with open(self.path, "rb") as f:
+                    f.seek(offset)
+                    record = self._records[offset] = jsonlib.loads(f.read(length))
+            return record
+
+    def __len__(self):
+        return sum(len(spans) for spans in self._entries.values())
+
+
+class RecordingResponse:
+    """Passes the wrapped response through and writes it to the cassette once its body is read."""
+
+    def __init__(self, response, cassette, record, started, errors):
+        self._response = response
+        self._cassette = cassette
+        self._errors = errors
+        self._record = record
+        self._started = started
+        self._saved = False
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = getattr(response, "url", None)
+        self.reason = getattr(response, "reason", None)
+
+    @property
+    def ok(self):
+        return self._response.ok
+
+    def _save(self, complete=True, body_error=None):
+        if not self._saved:
+            self._saved = True
+            self._record["complete"] = complete
+            if body_error:
+                self._record["body_error"] = body_error
+            self._cassette.add(self._record)
+
+    @property
+    def content(self):
+        if not self._saved:
+            content = self._response.content
+            self._record["chunks"].append([round(time.monotonic() - self._started, 6),
+                                           content.decode("utf-8", errors="replace")])
+            self._save()
+        return self._response.content
+
+    @property
+    def text(self):
+        _ = self.content
+        return self._response.text
+
+    def json(self):
+        _ = self.content
+        return self._response.json()
+
+    def raise_for_status(self):
+        self._response.raise_for_status()
+
+    def iter_lines(self, chunk_size=None):
+        chunks = self._record["chunks"]
+        try:
+            for line in self._response.iter_lines(chunk_size=chunk_size):
+                chunks.append([round(time.monotonic() - self._started, 6), line.decode("utf-8", errors="replace") + "\n"])
+                yield line
+        except Exception as e:
+            self._save(complete=False, body_error=_error_kind(self._errors, e) or "ProtocolError")
+            raise
+        self._save()
+
+    def close(self):
+        self._response.close()
+        # A body abandoned half way is kept as it was received
+        self._save(complete=False)
+
+
+class RecordingTransport:
+    """Wraps a real transport and records every request it sends."""
+
+    def __init__(self, transport, cassette):
+        self.transport = transport
+        self.cassette = cassette
+        self.errors = transport.errors
+        self.connect_timeout = transport.connect_timeout
+        self.read_timeout = transport.read_timeout
+        self.recorded = 0
+        atexit.register(cassette.flush)
+
+    def post(self, url, json=None, headers=None, timeout=None, stream=False):
+        record = {
+            "fingerprint": fingerprint("POST", url, json),
+            "method": "POST",
+            "url": _public_url(url),
+            "request": json,
+            "recorded_at": round(time.time(), 6),
+            "chunks": [],
+        }
+        started = time.monotonic()
+        try:
+            # Always streamed so the body's arrival can be timed
+            response = self.transport.post(url, json=json, headers=headers, timeout=timeout, stream=True)
+        except Exception as e:
+            kind = _error_kind(self.errors, e)
+            if kind is not None:
+                record.update(error=kind, ttfb=round(time.monotonic() - started, 6), complete=True)
+                self.cassette.add(record)
+                self.recorded += 1
+            raise
+        record.update(status=response.status_code, ttfb=round(time.monotonic() - started, 6),
+                      headers={k: v for k, v in response.headers.items() if k.lower() not in _WIRE_HEADERS})
+        recording = RecordingResponse(response, self.cassette, record, started, self.errors)
+        self.recorded += 1
+        if not stream:
+            _ = recording.content
+        return recording
+
+    def snapshot(self):
+        stats = self.transport.snapshot()
+        stats["cassette"] = {"mode": RECORD, "path": self.cassette.path, "recorded": self.recorded}
+        return stats
+
+    def close(self):
+        self.cassette.flush()
+        self.transport.close()
+
+
+class ReplayResponse:
+    """A recorded response, its body released on the recorded (scaled) schedule."""
+
+    def __init__(self, record, url, started, speed, errors):
+        self.status_code = record["status"]
+        self.reason = http.client.responses.get(self.status_code, "")
+        self.url = url
+        self.headers = http.client.HTTPMessage()
+        for name, value in record.get("headers", {}).items():
+            self.headers[name] = value
+        self._record = record
+        self._started = started
+        self._speed = speed
+        self._errors = errors
+        self._content = None
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def _wait_until(self, offset):
+        if self._speed > 0:
+            delay = self._started + offset / self._speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _body_error(self):
+        kind = self._record.get("body_error")
+        if kind:
+            raise getattr(self._errors, kind)(f"Replayed {kind} while reading the response body")
+
+    @property
+    def content(self):
+        if self._content is None:
+            chunks = self._record["chunks"]
+            if chunks:
+                self._wait_until(chunks[-1][0])
+            self._body_error()
+            self._content = "".join(text for _, text in chunks).encode("utf-8")
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return jsonlib.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            kind = "Client" if self.status_code < 500 else "Server"
+            raise self._errors.HTTPError(f"{self.status_code} {kind} Error: {self.reason} for url: "
+                                         f"{_public_url(self.url)}", response=self)
+
+    def iter_lines(self, chunk_size=None):
+        for offset, text in self._record["chunks"]:
+            self._wait_until(offset)
+            for line in text.splitlines():
+                yield line.encode("utf-8")
+        self._body_error()
+
+    def close(self):
+        pass
+
+
+class ReplayTransport:
+    """Answers upstream requests from a cassette; nothing goes over the network."""
+
+    def __init__(self, cassette, speed=None, connect_timeout=None, read_timeout=None):
+        # Imported here so record mode and normal runs do not need it
+        from _httpclient_transport import HTTPCLIENT_ERRORS
+
+        self.cassette = cassette
+        self.speed = speed if speed is not None else env_number("GEMINI_CASSETTE_SPEED", 1.0)
+        self.connect_timeout = connect_timeout or env_number("GEMINI_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)
+        self.read_timeout = read_timeout or env_number("GEMINI_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)
+        self.errors = HTTPCLIENT_ERRORS
+        self.replayed = 0
+        self.misses = 0
+
+    def post(self, url, json=None, headers=None, timeout=None, stream=False):
+        started = time.monotonic()
+        fp = fingerprint("POST", url, json)
+        record = self.cassette.next(fp)
+        if record is None:
+            self.misses += 1
+            log.warning("No recorded response for this request", extra={"fingerprint": fp, "url": _public_url(url)})
+            record = {"status": 404, "headers": {"Content-Type": "application/json"}, "chunks": [[0, jsonlib.dumps(
+                {"error": {"code": 404, "message": "Not in the cassette", "status": "NOT_FOUND"}})]]}
+            return ReplayResponse(record, url, started, 0, self.errors)
+        self.replayed += 1
+
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else (timeout or self.read_timeout)
+        ttfb = record["ttfb"] / self.speed if self.speed > 0 else 0.0
+        if ttfb > read_timeout:
+            time.sleep(read_timeout)
+            raise self.errors.Timeout(f"Replayed response took longer than the {read_timeout}s read timeout")
+        if ttfb > 0:
+            time.sleep(ttfb)
+        if record.get("error"):
+            raise getattr(self.errors, record["error"])(f"Replayed {record['error']}")
+
+        response = ReplayResponse(record, url, started, self.speed, self.errors)
+        if not stream:
+            _ = response.content
+        return response
+
+    def snapshot(self):
+        return {
+            "implementation": "cassette",
+            "requests": self.replayed + self.misses,
+            "new_connections": 0,
+            "pool_hits": 0,
+            "cassette": {"mode": REPLAY, "path": self.cassette.path, "recordings": len(self.cassette),
+                         "speed": self.speed, "replayed": self.replayed, "misses": self.misses},
+        }
+
+    def close(self):
+        pass
+
+
+def cassette_transport(mode, create_transport):
+    """The record or replay transport for GEMINI_CASSETTE; create_transport() builds the real one."""
+    cassette = Cassette(os.getenv("GEMINI_CASSETTE") or "gemini.cassette.jsonl")
+    if mode == REPLAY:
+        return ReplayTransport(cassette)
+    return RecordingTransport(create_transport(), cassette)
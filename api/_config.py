@@ -0,0 +1,19 @@
+"""
+Small helpers for reading numeric settings from the environment.
+"""
+import logging
+import os
+
+log = logging.getLogger("metraplan.config")
+
+
+def env_number(name, default, cast=float):
+    """Reads `name` from the environment as a number, falling back to `default`."""
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        log.warning("Ignoring invalid numeric setting", extra={"setting": name, "value": value})
+        return default
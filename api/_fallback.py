@@ -0,0 +1,56 @@
+"""
+Degraded-mode plans, served while the upstream circuit is open.
+
+The preferred fallback is the cached plan for the most similar goal; failing that,
+a generic plan is built locally from the goal text. Both are cheap enough to return
+in milliseconds and are flagged to the client as degraded.
+"""
+import re
+
+
+NEAREST_CACHE = "nearest-cache"
+LOCAL_TEMPLATE = "local-template"
+
+_WORD_RE = re.compile(r"\w+")
+
+# Words too common to say anything about whether two goals are alike
+_STOPWORDS = frozenset({
+    "a", "an", "the", "and", "or", "for", "to", "of", "in", "on", "my", "our", "your",
+    "by", "with", "at", "from", "into", "i", "we", "me", "us", "it", "is", "be",
+})
+
+
+def goal_similarity(a, b):
+    """Jaccard similarity of the significant words of two (canonical) goals."""
+    words_a = {w for w in _WORD_RE.findall(a) if w not in _STOPWORDS}
+    words_b = {w for w in _WORD_RE.findall(b) if w not in _STOPWORDS}
+    if not words_a or not words_b:
+        return 0.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+def local_fallback_plan(goal_text):
+    """A generic, dependency-ordered plan for any goal."""
+    goal = " ".join(goal_text.split()).rstrip(".!?")
+    steps = [
+        ("Define the outcome", f"Write down what success looks like for: {goal}.", "Day 1"),
+        ("Gather requirements and resources", "List the people, budget, tools and information you will need.", "Day 1-2"),
+        ("Break the work into milestones", "Split the goal into a few milestones with a rough deadline for each.", "Day 2-3"),
+        ("Identify risks", "Note what could block progress and a mitigation for each risk.", "Day 3"),
+        ("Execute the first milestone", "Start on the first milestone and track progress daily.", "Week 1-2"),
+        ("Review and adjust", "Compare progress against the milestones and adjust the plan.", "End of each milestone"),
+    ]
+    plan = []
+    for i, (name, description, timeline) in enumerate(steps, start=1):
+        dependencies = [i - 1] if i > 1 else []
+        if i == 5:
+            # Execution needs both the milestones and the risk review
+            dependencies = [3, 4]
+        plan.append({
+            "id": i,
+            "taskName": name,
+            "description": description,
+            "dependencies": dependencies,
+            "timeline": timeline,
+        })
+    return plan
@@ -0,0 +1,186 @@
+"""
+Hedged upstream requests.
+
+If a call has not answered by an adaptive threshold (a high quantile of recently
+observed upstream latencies), an identical second request is fired and whichever
+answers first wins; the other is ignored (threads) or cancelled (asyncio). Hedges are
+budgeted as a percentage of calls so they cannot blow through the upstream quota.
+"""
+import threading
+import time
+from collections import deque
+
+from _config import env_number
+
+
+class LatencyWindow:
+    """Rolling window of recent successful call latencies."""
+
+    def __init__(self, size):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def quantile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class Hedger:
+    """Runs calls with an optional hedge after the adaptive latency threshold."""
+
+    def __init__(self, enabled=None, quantile=None, max_percent=None, min_samples=None, min_delay=None,
+                 window=None, max_workers=None):
+        self.enabled = bool(enabled if enabled is not None else env_number("GEMINI_HEDGE", 0, int))
+        self.quantile = quantile or env_number("GEMINI_HEDGE_QUANTILE", 0.9)
+        self.max_percent = max_percent if max_percent is not None else env_number("GEMINI_HEDGE_MAX_PERCENT", 5.0)
+        self.min_samples = min_samples or env_number("GEMINI_HEDGE_MIN_SAMPLES", 20, int)
+        self.min_delay = min_delay if min_delay is not None else env_number("GEMINI_HEDGE_MIN_DELAY", 0.05)
+        self.max_workers = max_workers or env_number("GEMINI_HEDGE_WORKERS", 64, int)
+        self.latencies = LatencyWindow(window or 500)
+
+        self._lock = threading.Lock()
+        self._executor = None
+        # Each call earns max_percent/100 of a hedge; a hedge spends one whole credit
+        self._credit = 0.0
+        self._max_credit = 10.0
+
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.budget_denied = 0
+
+    def threshold(self):
+        """Delay before hedging, or None while there are too few samples."""
+        if len(self.latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, self.latencies.quantile(self.quantile))
+
+    def _take_budget(self):
+        with self._lock:
+            self.calls += 1
+            self._credit = min(self._max_credit, self._credit + self.max_percent / 100.0)
+
+    def _spend_budget(self):
+        with self._lock:
+            if self._credit >= 1.0:
+                self._credit -= 1.0
+                self.hedges += 1
+                return True
+            self.budget_denied += 1
+            return False
+
+    def _count_win(self, hedge_won):
+        with self._lock:
+            if hedge_won:
+                self.hedge_wins += 1
+            else:
+                self.primary_wins += 1
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="gemini-hedge")
+        return self._executor
+
+    def _timed(self, fn):
+        start = time.monotonic()
+        result = fn()
+        self.latencies.add(time.monotonic() - start)
+        return result
+
+    def call(self, fn):
+        """Calls fn(), hedging it with a second fn() if it is slower than the threshold."""
+        if not self.enabled:
+            return fn()
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        self._take_budget()
+        threshold = self.threshold()
+        if threshold is None:
+            return self._timed(fn)
+
+        primary = self._pool().submit(self._timed, fn)
+        done, _ = wait([primary], timeout=threshold)
+        if done or not self._spend_budget():
+            return primary.result()
+
+        hedge = self._pool().submit(self._timed, fn)
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The loser keeps running in the background and its result is ignored
+                    self._count_win(future is hedge)
+                    return future.result()
+                if first_error is None or future is primary:
+                    first_error = future.exception()
+        raise first_error
+
+    async def call_async(self, coro_fn):
+        """asyncio form of call(); the losing request is cancelled."""
+        if not self.enabled:
+            return await coro_fn()
+        import asyncio
+
+        self._take_budget()
+        threshold = self.threshold()
+
+        async def timed():
+            start = time.monotonic()
+            result = await coro_fn()
+            self.latencies.add(time.monotonic() - start)
+            return result
+
+        if threshold is None:
+            return await timed()
+
+        primary = asyncio.ensure_future(timed())
+        done, _ = await asyncio.wait({primary}, timeout=threshold)
+        if done or not self._spend_budget():
+            return await primary
+
+        hedge = asyncio.ensure_future(timed())
+        pending = {primary, hedge}
+        first_error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._count_win(task is hedge)
+                        return task.result()
+                    if first_error is None or task is primary:
+                        first_error = task.exception()
+            raise first_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def snapshot(self):
+        threshold = self.threshold() if self.enabled else None
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "threshold_seconds": round(threshold, 4) if threshold is not None else None,
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_rate": round(self.hedges / self.calls, 4) if self.calls else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "primary_wins": self.primary_wins,
+                "budget_denied": self.budget_denied,
+            }
@@ -0,0 +1,265 @@
+"""
+Stdlib upstream transport built on http.client (GEMINI_TRANSPORT=http.client).
+
+Idle keep-alive connections are kept in one small pool per host shared by all threads
+(like urllib3's), so thread-per-request servers reuse them too, and nothing beyond the
+standard library is imported. Responses may be gzip encoded (decoded on the fly, also
+while streaming) and chunked; streamed bodies are handed over as each chunk arrives.
+"""
+import http.client
+import json as jsonlib
+import socket
+import ssl
+import threading
+import zlib
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from _config import env_number
+from _timing import stage_span
+from _transport import (DEFAULT_CONNECT_TIMEOUT, DEFAULT_DNS_TTL, DEFAULT_POOL_SIZE, DEFAULT_READ_TIMEOUT, DNSCache,
+                        TransportErrors, TransportStats)
+
+
+class HTTPError(Exception):
+    """Raised by raise_for_status() for 4xx/5xx responses."""
+
+    def __init__(self, message, response):
+        super().__init__(message)
+        self.response = response
+
+
+class ProtocolError(http.client.HTTPException):
+    """The response body could not be decoded."""
+
+
+HTTPCLIENT_ERRORS = TransportErrors(
+    HTTPError=HTTPError,
+    ConnectionError=OSError,
+    Timeout=TimeoutError,
+    SSLError=ssl.SSLError,
+    ProtocolError=http.client.HTTPException,
+)
+
+# A reused keep-alive connection the server has meanwhile closed fails with one of these
+# before any response arrives; the request is then resent once on a fresh connection.
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+class HTTPClientResponse:
+    """The subset of requests.Response the app relies on, over an http.client response."""
+
+    def __init__(self, raw, url, release):
+        self.status_code = raw.status
+        self.reason = raw.reason
+        self.headers = raw.headers
+        self.url = url
+        self._raw = raw
+        self._release = release
+        self._content = None
+        self._decoder = None
+        if (raw.getheader("Content-Encoding") or "").lower() == "gzip":
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def _decode(self, data, final=False):
+        if self._decoder is None:
+            return data
+        try:
+            data = self._decoder.decompress(data)
+            return data + self._decoder.flush() if final else data
+        except zlib.error as e:
+            raise ProtocolError(f"Invalid gzip response body: {e}") from e
+
+    @property
+    def content(self):
+        if self._content is None:
+            try:
+                self._content = self._decode(self._raw.read(), final=True)
+            finally:
+                self.close()
+        return self._content
+
+    @property
+    def text(self):
+        charset = self.headers.get_content_charset() or "utf-8"
+        return self.content.decode(charset, errors="replace")
+
+    def json(self):
+        return jsonlib.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            kind = "Client" if self.status_code < 500 else "Server"
+            raise HTTPError(f"{self.status_code} {kind} Error: {self.reason} for url: {self.url}", response=self)
+
+    def iter_lines(self, chunk_size=None):
+        """Yields body lines as bytes, reading whatever has arrived instead of fixed-size blocks."""
+        pending = b""
+        try:
+            while True:
+                data = self._raw.read1(chunk_size or 65536)
+                if not data:
+                    break
+                lines = (pending + self._decode(data)).splitlines(keepends=True)
+                pending = lines.pop() if lines and not lines[-1].endswith((b"\n", b"\r")) else b""
+                for line in lines:
+                    yield line.rstrip(b"\r\n")
+            pending += self._decode(b"", final=True)
+            if pending:
+                yield pending
+        finally:
+            self.close()
+
+    def close(self):
+        """Returns the connection for reuse if the body was read completely, else drops it."""
+        if self._release is not None:
+            release, self._release = self._release, None
+            release(self._raw.isclosed() and not self._raw.will_close)
+
+
+class HTTPClientTransport:
+    """
+    Thread-safe transport with a shared, bounded pool of keep-alive connections per host.
+
+    A connection is owned by a single request until its response has been read, then
+    goes back to the pool; requests beyond the idle connections available open new
+    ones, and connections returned to a full pool are closed.
+    """
+
+    def __init__(self, connect_timeout=None, read_timeout=None, dns_ttl=None, pool_size=None):
+        self.connect_timeout = connect_timeout or env_number("GEMINI_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)
+        self.read_timeout = read_timeout or env_number("GEMINI_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)
+        if dns_ttl is None:
+            dns_ttl = env_number("GEMINI_DNS_TTL", DEFAULT_DNS_TTL)
+        self.pool_size = pool_size or env_number("GEMINI_POOL_SIZE", DEFAULT_POOL_SIZE, int)
+
+        self.errors = HTTPCLIENT_ERRORS
+        self.stats = TransportStats()
+        self.dns_cache = DNSCache(dns_ttl, self.stats)
+        self._ssl_context = ssl.create_default_context()
+        self._lock = threading.Lock()
+        self._idle = defaultdict(list)   # (scheme, host, port) -> idle connections, most recently used last
+        self._open = 0
+
+    def _create_connection(self, address, timeout=None, source_address=None):
+        """socket.create_connection() through the DNS cache, with TCP keep-alive."""
+        self.stats.incr("new_connections")
+        sock = None
+        if self.dns_cache.ttl > 0:
+            try:
+                sock = socket.create_connection(self.dns_cache.resolve(*address), timeout, source_address)
+            except OSError:
+                # The cached address may be stale; retry with a fresh lookup below
+                self.dns_cache.invalidate(*address)
+        if sock is None:
+            sock = socket.create_connection(address, timeout, source_address)
+        # TCP keep-alive stops idle sockets from being silently dropped by NAT
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30)
+        return sock
+
+    def _checkout(self, key, reuse=True):
+        """The most recently used idle connection for (scheme, host, port), or a new one."""
+        with self._lock:
+            idle = self._idle.get(key)
+            if reuse and idle:
+                return idle.pop(), True
+            self._open += 1
+        scheme, host, port = key
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(host, port, context=self._ssl_context)
+        else:
+            connection = http.client.HTTPConnection(host, port)
+        connection._create_connection = self._create_connection
+        return connection, False
+
+    def _checkin(self, key, connection):
+        """Returns a connection to the pool, closing it if the pool for the host is full."""
+        with self._lock:
+            idle = self._idle[key]
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        self._discard(connection)
+
+    def _discard(self, connection):
+        connection.close()
+        with self._lock:
+            self._open -= 1
+
+    def _send(self, connection, method, path, body, headers, timeout):
+        connect_timeout, read_timeout = timeout
+        if connection.sock is None:
+            connection.timeout = connect_timeout
+            with stage_span("connect"):
+                connection.connect()
+        connection.sock.settimeout(read_timeout)
+        connection.request(method, path, body=body, headers=headers)
+        return connection.getresponse()
+
+    def post(self, url, json=None, headers=None, timeout=None, stream=False):
+        """Sends a POST over a pooled keep-alive connection; timeout defaults to (connect, read)."""
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        elif not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+
+        parts = urlsplit(url)
+        scheme = parts.scheme or "https"
+        port = parts.port or (443 if scheme == "https" else 80)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        body = jsonlib.dumps(json).encode("utf-8") if json is not None else None
+        request_headers = {"Accept-Encoding": "gzip", "Content-Type": "application/json"}
+        request_headers.update(headers or {})
+
+        key = (scheme, parts.hostname, port)
+        connection, reused = self._checkout(key)
+        self.stats.incr("requests")
+        try:
+            raw = self._send(connection, "POST", path, body, request_headers, timeout)
+        except _STALE_CONNECTION_ERRORS:
+            self._discard(connection)
+            if not reused:
+                raise
+            connection, _ = self._checkout(key, reuse=False)
+            try:
+                raw = self._send(connection, "POST", path, body, request_headers, timeout)
+            except BaseException:
+                self._discard(connection)
+                raise
+        except BaseException:
+            self._discard(connection)
+            raise
+
+        def release(reusable):
+            if reusable:
+                self._checkin(key, connection)
+            else:
+                self._discard(connection)
+
+        response = HTTPClientResponse(raw, url, release)
+        if not stream:
+            # Read the body now so the connection goes back to the pool right away
+            _ = response.content
+        return response
+
+    def snapshot(self):
+        stats = self.stats.snapshot()
+        stats["implementation"] = "http.client"
+        with self._lock:
+            stats["open_connections"] = self._open
+            stats["idle_connections"] = sum(len(idle) for idle in self._idle.values())
+        return stats
+
+    def close(self):
+        """Closes the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, defaultdict(list)
+        for connections in idle.values():
+            for connection in connections:
+                self._discard(connection)
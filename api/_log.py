@@ -0,0 +1,200 @@
+"""
+Structured logging that never blocks the request thread.
+
+Records of the "metraplan" loggers go onto a bounded queue, and a background thread
+writes them to stdout as one JSON object per line. When the queue is full the record
+is dropped and counted; the caller never waits. On the request thread a record is
+only made self-contained. Its message is rendered, string fields are truncated to
+LOG_MAX_FIELD_CHARS, the Gemini API key is redacted and the request ID is attached.
+
+Warnings and errors that repeat are sampled. Each distinct message may be logged
+LOG_ERROR_BURST times per LOG_ERROR_WINDOW seconds. Further repeats are only
+counted, and the next one logged reports how many were suppressed. Log call sites
+pass a constant message plus `extra=` fields, so repeats can be recognized.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+from _config import env_number
+
+ROOT_LOGGER = "metraplan"
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+if not isinstance(logging.getLevelName(LOG_LEVEL), int):
+    LOG_LEVEL = "INFO"
+LOG_QUEUE_SIZE = env_number("LOG_QUEUE_SIZE", 10000, int)
+LOG_MAX_FIELD_CHARS = env_number("LOG_MAX_FIELD_CHARS", 2000, int)
+LOG_ERROR_BURST = env_number("LOG_ERROR_BURST", 10, int)
+LOG_ERROR_WINDOW = env_number("LOG_ERROR_WINDOW", 60.0)
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "request_id"}
+_API_KEY_PARAM = re.compile(r"([?&]key=)[^&\s'\"]+")
+_REQUEST_ID = re.compile(r"[A-Za-z0-9._:-]{1,128}")
+
+# A ContextVar rather than a thread-local, so requests sharing the ASGI event loop stay apart
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def new_request_id(incoming=None):
+    """The client's request ID if it looks sane, otherwise a fresh one."""
+    if incoming and _REQUEST_ID.fullmatch(incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+
+def set_request_id(request_id):
+    """Tags records logged by the current thread (or asyncio task) with request_id (None clears it)."""
+    _request_id.set(request_id)
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+def redact(text):
+    """Removes the Gemini API key from text, e.g. from upstream URLs in error messages."""
+    text = _API_KEY_PARAM.sub(r"\1REDACTED", text)
+    api_key = os.getenv("GEMINI_API_KEY")
+    if api_key and api_key in text:
+        text = text.replace(api_key, "REDACTED")
+    return text
+
+
+def truncate(text, limit=None):
+    limit = limit or LOG_MAX_FIELD_CHARS
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+class RepeatSampler(logging.Filter):
+    """Lets each distinct warning or error through `burst` times per `window` seconds."""
+
+    def __init__(self, burst, window, max_keys=1024):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.max_keys = max_keys
+        self.suppressed = 0
+        self._lock = threading.Lock()
+        self._seen = {}     # (logger, level, message template) -> [window start, logged, suppressed]
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or self.burst <= 0:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                if entry is None and len(self._seen) >= self.max_keys:
+                    self._seen = {k: e for k, e in self._seen.items() if now - e[0] < self.window}
+                entry = self._seen[key] = [now, 0, entry[2] if entry else 0]
+            if entry[1] >= self.burst:
+                entry[2] += 1
+                self.suppressed += 1
+                return False
+            entry[1] += 1
+            if entry[2]:
+                record.suppressed_repeats = entry[2]
+                entry[2] = 0
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of waiting when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Arguments and extra fields may change once the log call returns, so the
+        # record is rendered here; JSON encoding and writing happen on the writer thread
+        record.message = truncate(redact(record.getMessage()))
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            traceback_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_text = truncate(redact(traceback_text), 4 * LOG_MAX_FIELD_CHARS)
+            record.exc_info = None
+        record.request_id = get_request_id()
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRS and isinstance(value, str):
+                setattr(record, name, truncate(redact(value)))
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, request ID and extra fields."""
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRS:
+                entry[name] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _Writer(QueueListener):
+    def enqueue_sentinel(self):
+        # At shutdown waiting is fine: the writer thread is draining the queue
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """The queue, its handler on the "metraplan" logger and the writer thread."""
+
+    def __init__(self, stream=None, level=None, queue_size=None, burst=None, window=None):
+        self.queue = queue.Queue(queue_size or LOG_QUEUE_SIZE)
+        self.handler = NonBlockingQueueHandler(self.queue)
+        self.sampler = RepeatSampler(LOG_ERROR_BURST if burst is None else burst, window or LOG_ERROR_WINDOW)
+        self.handler.addFilter(self.sampler)
+
+        writer = logging.StreamHandler(stream or sys.stdout)
+        writer.setFormatter(JSONFormatter())
+        self.listener = _Writer(self.queue, writer)
+
+        logger = logging.getLogger(ROOT_LOGGER)
+        logger.setLevel(level or LOG_LEVEL)
+        logger.addHandler(self.handler)
+        logger.propagate = False
+        self.listener.start()
+        # Drains what is still queued when the process exits
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def snapshot(self):
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.handler.dropped,
+            "suppressed": self.sampler.suppressed,
+        }
@@ -0,0 +1,245 @@
+"""
+Memory instrumentation: tracemalloc diffs around request steps and a process report.
+
+With MEMORY_TRACKING=1, tracemalloc traces every allocation (at the cost of slower
+allocations and extra memory, so only for diagnosing). For each (route, step) wrapped
+in `measure()` the tracker adds up the net bytes the step left allocated and its peak,
+which also catches memory freed again before the step ended. The outermost measured
+step of a request also takes a snapshot on entry and exit (slow: it walks every traced
+block) and records the lines whose allocations grew; steps nested in it only read
+tracemalloc's counters. One request is measured at a time; steps of other requests
+running meanwhile are skipped, but their allocations still show up in the measured
+figures. MEMORY_SAMPLE_RATE (default 1%) measures only a share of requests.
+
+The request being measured is bound to the thread (or asyncio task) that called
+`begin()`; steps run elsewhere, such as on the hedging pool, are not measured.
+"""
+import contextvars
+import os
+import random
+import sys
+import threading
+import tracemalloc
+
+from _config import env_number
+
+# Allocations made by the instrumentation itself (including the CPU sampler's thread)
+IGNORED_FILES = (tracemalloc.__file__, __file__, os.path.join(os.path.dirname(__file__), "_sampler.py"))
+
+
+def _short_path(filename):
+    """Path relative to the sys.path entry it was imported from, e.g. 'flask/json/provider.py'."""
+    for root in sorted((p for p in sys.path if p), key=len, reverse=True):
+        if filename.startswith(root + os.sep):
+            return filename[len(root) + 1:]
+    return filename
+
+
+class _NoMeasurement:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_MEASUREMENT = _NoMeasurement()
+
+# (route, stack of open measurements) of the current request while it is sampled, else None
+_request = contextvars.ContextVar("memory_request", default=None)
+
+
+class _Measurement:
+    """
+    One measured step. The outermost step of a request diffs snapshots taken on entry
+    and exit; steps nested in it only read tracemalloc's counters, and are subtracted
+    out of the enclosing step's peak.
+    """
+
+    def __init__(self, tracker, step):
+        self.tracker = tracker
+        self.step = step
+        self.active = False
+        self.before = None
+
+    def __enter__(self):
+        tracker = self.tracker
+        stack = tracker._stack()
+        if not stack and not tracker._claim():
+            return self
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, peak)
+        stack.append(self)
+        self.active = True
+        if len(stack) == 1:
+            self.before = tracemalloc.take_snapshot().filter_traces(tracker.filters)
+        # The snapshot itself is traced; count from after it was taken
+        self.baseline = tracemalloc.get_traced_memory()[0]
+        self.snapshot_bytes = self.baseline - current
+        self.peak = self.baseline
+        tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.active:
+            return False
+        tracker = self.tracker
+        stack = tracker._stack()
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, self.peak)
+        try:
+            if self.before is not None:
+                after = tracemalloc.take_snapshot().filter_traces(tracker.filters)
+                diff = after.compare_to(self.before, "lineno")
+                tracker._record(self.step, sum(stat.size_diff for stat in diff), peak - self.baseline, diff)
+            else:
+                tracker._record(self.step, current - self.baseline, peak - self.baseline)
+        finally:
+            after = self.before = None
+            self.active = False
+            stack.pop()
+            if stack:
+                # Only the step's own allocations count towards the enclosing step's peak
+                stack[-1].peak = max(stack[-1].peak, peak - self.snapshot_bytes)
+                tracemalloc.reset_peak()
+            else:
+                tracker._release()
+        return False
+
+
+class MemoryTracker:
+    """Per-route, per-step allocation diffs; does nothing unless enabled."""
+
+    def __init__(self, enabled, sample_rate=None, frames=None, max_lines=None):
+        self.enabled = enabled
+        self.sample_rate = sample_rate if sample_rate is not None else env_number("MEMORY_SAMPLE_RATE", 0.01)
+        self.max_lines = max_lines or env_number("MEMORY_MAX_LINES", 200, int)
+        self.filters = [tracemalloc.Filter(False, filename) for filename in IGNORED_FILES]
+        self._lock = threading.Lock()
+        self._measuring = False    # a request's outermost step is being measured
+        self._stats_lock = threading.Lock()
+        self._steps = {}    # (route, step) -> {"calls", "net_bytes", "peak_bytes", "max_peak_bytes", "lines"}
+        self.measured = 0
+        self.skipped_busy = 0
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(frames or env_number("MEMORY_TRACE_FRAMES", 1, int))
+
+    def begin(self, route):
+        """
+        Binds the current thread (or asyncio task) to a request of `route`, or unbinds it
+        for None, and decides whether to measure the request.
+        """
+        if self.enabled:
+            sampled = route is not None and random.random() < self.sample_rate
+            _request.set((route, []) if sampled else None)
+
+    def measure(self, step):
+        """Context manager measuring `step` of the current request."""
+        if not self.enabled or _request.get() is None:
+            return _NO_MEASUREMENT
+        return _Measurement(self, step)
+
+    def _claim(self):
+        """Makes the current request the one measured, unless another one is."""
+        with self._lock:
+            if self._measuring:
+                self.skipped_busy += 1
+                return False
+            self._measuring = True
+            return True
+
+    def _release(self):
+        with self._lock:
+            self._measuring = False
+
+    def _stack(self):
+        return _request.get()[1]
+
+    def _record(self, step, net_bytes, peak_bytes, diff=()):
+        key = (_request.get()[0], step)
+        with self._stats_lock:
+            entry = self._steps.get(key)
+            if entry is None:
+                entry = self._steps[key] = {"calls": 0, "net_bytes": 0, "peak_bytes": 0, "max_peak_bytes": 0,
+                                            "lines": {}}
+            entry["calls"] += 1
+            entry["net_bytes"] += net_bytes
+            entry["peak_bytes"] += peak_bytes
+            entry["max_peak_bytes"] = max(entry["max_peak_bytes"], peak_bytes)
+            lines = entry["lines"]
+            for stat in diff:
+                if stat.size_diff > 0:
+                    frame = stat.traceback[0]
+                    line = f"{_short_path(frame.filename)}:{frame.lineno}"
+                    totals = lines.setdefault(line, [0, 0])
+                    totals[0] += stat.size_diff
+                    totals[1] += stat.count_diff
+            if len(lines) > self.max_lines:
+                kept = sorted(lines.items(), key=lambda item: -item[1][0])[:self.max_lines]
+                entry["lines"] = dict(kept)
+            self.measured += 1
+
+    def snapshot(self, top=10):
+        routes = {}
+        with self._stats_lock:
+            for (route, step), entry in sorted(self._steps.items()):
+                calls = entry["calls"]
+                lines = sorted(entry["lines"].items(), key=lambda item: -item[1][0])[:top]
+                routes.setdefault(route, {})[step] = {
+                    "calls": calls,
+                    "avg_net_bytes": round(entry["net_bytes"] / calls),
+                    "avg_peak_bytes": round(entry["peak_bytes"] / calls),
+                    "max_peak_bytes": entry["max_peak_bytes"],
+                    "top_lines": [{"line": line, "avg_bytes": round(size / calls), "avg_blocks": round(count / calls, 1)}
+                                  for line, (size, count) in lines],
+                }
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "measured": self.measured,
+            "skipped_busy": self.skipped_busy,
+            "routes": routes,
+        }
+
+
+def deep_sizeof(value, _seen=None):
+    """Approximate bytes held by a JSON-like value (dicts, lists, tuples, strings, numbers)."""
+    seen = _seen if _seen is not None else set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_sizeof(item, seen) for item in value)
+    return size
+
+
+def process_memory(top=10):
+    """RSS, peak RSS and Python heap figures of this process."""
+    report = {"rss_bytes": None, "peak_rss_bytes": None}
+    try:
+        with open("/proc/self/statm") as f:
+            report["rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        report["peak_rss_bytes"] = peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+
+    heap = {"allocated_blocks": sys.getallocatedblocks(), "tracing": tracemalloc.is_tracing()}
+    if tracemalloc.is_tracing():
+        heap["traced_bytes"], heap["traced_peak_bytes"] = tracemalloc.get_traced_memory()
+        heap["tracemalloc_overhead_bytes"] = tracemalloc.get_tracemalloc_memory()
+        stats = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, f) for f in IGNORED_FILES])
+        heap["top_lines"] = [{"line": f"{_short_path(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                              "bytes": stat.size, "blocks": stat.count}
+                             for stat in stats.statistics("lineno")[:top]]
+    report["python_heap"] = heap
+    return report
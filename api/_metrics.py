@@ -0,0 +1,193 @@
+"""
+Prometheus metrics in the text exposition format.
+
+Recording never takes a lock: every thread records into its own shard of the
+registry, and a scrape adds the shards up. Shards of threads that have exited are
+folded into one retired shard on the next scrape, so thread-per-request servers do
+not accumulate them. Values that other components already count (cache hits, retries,
+breaker state) are read through callbacks at scrape time instead of being counted twice.
+"""
+import threading
+from bisect import bisect_left
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# Default upper bounds (seconds) of latency histogram buckets; +Inf is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Shard:
+    """One thread's values: metric name -> {label values: number or [buckets, sum, count]}."""
+
+    __slots__ = ("thread", "values")
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.values = {}
+
+
+class _Metric:
+    __slots__ = ("registry", "name", "kind", "help", "labelnames", "buckets")
+
+    def __init__(self, registry, name, kind, help, labelnames, buckets=None):
+        self.registry = registry
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+
+
+class Counter(_Metric):
+    def inc(self, *labels, amount=1):
+        values = self.registry._values(self.name)
+        values[labels] = values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """Up/down gauge; the value is the sum of all increments and decrements."""
+
+    def inc(self, *labels, amount=1):
+        values = self.registry._values(self.name)
+        values[labels] = values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    def observe(self, value, *labels):
+        values = self.registry._values(self.name)
+        entry = values.get(labels)
+        if entry is None:
+            entry = values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        # Buckets are upper bounds, the last one +Inf
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+
+class MetricsRegistry:
+    """Defines metrics, records them per thread and renders them for a scrape."""
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard(None)
+        self._metrics = []
+        self._callbacks = []
+
+    def _values(self, name):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+        values = shard.values.get(name)
+        if values is None:
+            values = shard.values[name] = {}
+        return values
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(self, self.prefix + name, COUNTER, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Gauge(self, self.prefix + name, GAUGE, help, labelnames))
+
+    def histogram(self, name, help, buckets, labelnames=()):
+        buckets = tuple(sorted(buckets))
+        if buckets[-1] != float("inf"):
+            buckets += (float("inf"),)
+        return self._add(Histogram(self, self.prefix + name, HISTOGRAM, help, labelnames, buckets))
+
+    def callback(self, name, kind, help, fn, labelnames=()):
+        """A counter or gauge read at scrape time: fn() returns {label values tuple: value}."""
+        self._callbacks.append((_Metric(self, self.prefix + name, kind, help, labelnames), fn))
+
+    def _collect(self):
+        """{metric name: {labels: value}}, summed over all shards."""
+        with self._lock:
+            live = []
+            for shard in self._shards:
+                if shard.thread.is_alive():
+                    live.append(shard)
+                else:
+                    # The thread is gone and cannot write to its shard any more
+                    _merge(self._retired.values, shard.values)
+            self._shards = live
+            totals = {}
+            _merge(totals, self._retired.values)
+        for shard in live:
+            # Copying a dict is atomic under the GIL, so this needs no lock on the writer side
+            _merge(totals, dict(shard.values))
+        return totals
+
+    def render(self):
+        totals = self._collect()
+        lines = []
+        for metric in self._metrics:
+            _render(lines, metric, totals.get(metric.name, {}))
+        for metric, fn in self._callbacks:
+            _render(lines, metric, fn())
+        return "\n".join(lines) + "\n"
+
+
+def _merge(into, values):
+    for name, series in values.items():
+        target = into.setdefault(name, {})
+        for labels, value in dict(series).items():
+            if isinstance(value, list):
+                entry = target.get(labels)
+                if entry is None:
+                    entry = target[labels] = [[0] * len(value[0]), 0.0, 0]
+                entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+                entry[1] += value[1]
+                entry[2] += value[2]
+            else:
+                target[labels] = target.get(labels, 0) + value
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _render(lines, metric, series):
+    lines.append(f"# HELP {metric.name} {metric.help}")
+    lines.append(f"# TYPE {metric.name} {metric.kind}")
+    if not series and not metric.labelnames and metric.kind != HISTOGRAM:
+        series = {(): 0}
+    for labels, value in sorted(series.items()):
+        if metric.kind != HISTOGRAM:
+            lines.append(f"{metric.name}{_labels(metric.labelnames, labels)} {_number(value)}")
+            continue
+        counts, total, count = value
+        cumulative = 0
+        for bound, bucket_count in zip(metric.buckets, counts):
+            cumulative += bucket_count
+            le = f'le="{_number(bound)}"'
+            lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, labels, le)} {cumulative}")
+        lines.append(f"{metric.name}_sum{_labels(metric.labelnames, labels)} {_number(total)}")
+        lines.append(f"{metric.name}_count{_labels(metric.labelnames, labels)} {count}")
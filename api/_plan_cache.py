@@ -0,0 +1,324 @@
+"""
+Multi-tier cache for generated plans.
+
+Tier 1 is an in-process LRU bounded by both entry TTL and total payload bytes.
+Tier 2 is an optional on-disk store (one JSON file per key) that survives process
+restarts and is shared by every worker on the same machine. It is bounded by total file
+bytes: writes prune expired files and, over the budget, the least recently read ones.
+
+Entries past their TTL are kept for a further grace period and reported as STALE, so
+the caller can fall back to them if regenerating the plan fails.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from _config import env_number
+
+log = logging.getLogger("metraplan.plan_cache")
+
+
+HIT = "HIT"
+MISS = "MISS"
+STALE = "STALE"
+
+DEFAULT_TTL = 3600.0
+DEFAULT_STALE_TTL = 86400.0
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_DISK_MAX_BYTES = 256 * 1024 * 1024
+
+# The disk tier is also swept for expired files every this many writes
+DISK_PRUNE_INTERVAL = 100
+
+
+def _stable_hash(value):
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def make_cache_key(goal_text, prompt_template, model, response_schema, generation_config):
+    """Builds a key that changes whenever anything influencing the LLM output changes."""
+    return _stable_hash({
+        "goal": goal_text,
+        "prompt": prompt_template,
+        "model": model,
+        "schema": _stable_hash(response_schema),
+        "config": _stable_hash(generation_config),
+    })
+
+
+class _Entry:
+    __slots__ = ("value", "size", "stored_at", "label")
+
+    def __init__(self, value, size, stored_at, label=None):
+        self.value = value
+        self.size = size
+        self.stored_at = stored_at
+        self.label = label
+
+
+class MemoryTier:
+    """LRU with TTL and byte-size-aware eviction."""
+
+    def __init__(self, max_bytes, ttl, stale_ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, now):
+        """Returns (value, status, stored_at)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, MISS, None
+        age = now - entry.stored_at
+        if age > self.ttl + self.stale_ttl:
+            self._remove(key)
+            return None, MISS, None
+        self._entries.move_to_end(key)
+        return entry.value, (HIT if age <= self.ttl else STALE), entry.stored_at
+
+    def set(self, key, value, size, stored_at, label=None):
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _Entry(value, size, stored_at, label)
+        self.bytes += size
+        while self.bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+
+    def entries(self):
+        return self._entries.values()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskTier:
+    """
+    One JSON file per key under `directory`; writes are atomic renames. A file's mtime
+    is its entry's stored_at and its atime the last read, so pruning needs no file reads.
+    """
+
+    def __init__(self, directory, ttl, stale_ttl, max_bytes):
+        self.directory = directory
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        # Estimated from the first prune on, which the first write triggers
+        self._bytes = None
+        self._writes_since_prune = 0
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key, now):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None, None, None
+        stored_at = record.get("stored_at", 0)
+        if now - stored_at > self.ttl + self.stale_ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None, None, None
+        try:
+            os.utime(path, (now, stored_at))
+        except OSError:
+            pass
+        return record.get("value"), stored_at, record.get("label")
+
+    def set(self, key, value, stored_at, label=None):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"stored_at": stored_at, "label": label, "value": value}, f, separators=(",", ":"))
+                size = f.tell()
+            os.utime(tmp_path, (stored_at, stored_at))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warning("Could not write plan cache file", extra={"path": path, "error": str(e)})
+            return
+        with self._lock:
+            self._writes_since_prune += 1
+            if self._bytes is not None:
+                self._bytes += size
+            due = (self._bytes is None or self._bytes > self.max_bytes
+                   or self._writes_since_prune >= DISK_PRUNE_INTERVAL)
+        if due:
+            self.prune(stored_at)
+
+    def prune(self, now):
+        """
+        Removes expired files, then the least recently read ones until the tier is back
+        under 90% of max_bytes. Other workers may write meanwhile, so this re-counts
+        the directory instead of trusting the running estimate.
+        """
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            files = []
+            with os.scandir(self.directory) as it:
+                for item in it:
+                    try:
+                        stat = item.stat()
+                    except OSError:
+                        continue
+                    if item.name.endswith(".tmp"):
+                        # Left behind by a worker that died mid-write
+                        if now - stat.st_mtime > 60:
+                            self._remove(item.path)
+                        continue
+                    if not item.name.endswith(".json"):
+                        continue
+                    if now - stat.st_mtime > self.ttl + self.stale_ttl:
+                        self._remove(item.path)
+                    else:
+                        files.append((stat.st_atime, stat.st_size, item.path))
+            total = sum(size for _, size, _ in files)
+            if total > self.max_bytes:
+                files.sort()
+                for _, size, path in files:
+                    if total <= self.max_bytes * 0.9:
+                        break
+                    if self._remove(path):
+                        total -= size
+                        self.evictions += 1
+            with self._lock:
+                self._bytes = total
+                self._writes_since_prune = 0
+        except OSError as e:
+            log.warning("Could not prune plan cache directory", extra={"path": self.directory, "error": str(e)})
+        finally:
+            self._prune_lock.release()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+class PlanCache:
+    """Thread-safe facade over the memory and (optional) disk tiers."""
+
+    def __init__(self, max_bytes=None, ttl=None, stale_ttl=None, directory=None, disk_max_bytes=None):
+        self.ttl = ttl if ttl is not None else env_number("PLAN_CACHE_TTL", DEFAULT_TTL)
+        self.stale_ttl = stale_ttl if stale_ttl is not None else env_number("PLAN_CACHE_STALE_TTL", DEFAULT_STALE_TTL)
+        max_bytes = max_bytes if max_bytes is not None else env_number("PLAN_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES, int)
+        directory = directory if directory is not None else os.getenv("PLAN_CACHE_DIR")
+        disk_max_bytes = (disk_max_bytes if disk_max_bytes is not None
+                          else env_number("PLAN_CACHE_DISK_MAX_BYTES", DEFAULT_DISK_MAX_BYTES, int))
+
+        self.enabled = self.ttl > 0
+        self._lock = threading.Lock()
+        self.memory = MemoryTier(max_bytes, self.ttl, self.stale_ttl)
+        self.disk = DiskTier(directory, self.ttl, self.stale_ttl, disk_max_bytes) if directory and self.enabled else None
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.disk_hits = 0
+
+    def get(self, key):
+        """Returns (plan, status) where status is HIT, STALE or MISS."""
+        if not self.enabled:
+            return None, MISS
+        now = time.time()
+        with self._lock:
+            value, status, memory_stored_at = self.memory.get(key, now)
+
+        # A stale entry may have been regenerated by another worker sharing the disk tier
+        if status != HIT and self.disk is not None:
+            disk_value, stored_at, label = self.disk.get(key, now)
+            if disk_value is not None and (memory_stored_at is None or stored_at > memory_stored_at):
+                value = disk_value
+                status = HIT if now - stored_at <= self.ttl else STALE
+                with self._lock:
+                    self.disk_hits += 1
+                    self.memory.set(key, value, _payload_size(value), stored_at, label)
+
+        with self._lock:
+            if status == HIT:
+                self.hits += 1
+            elif status == STALE:
+                self.stale += 1
+            else:
+                self.misses += 1
+        return value, status
+
+    def set(self, key, plan, label=None):
+        """Stores a plan; `label` (e.g. the canonical goal) makes it findable by nearest()."""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            self.memory.set(key, plan, _payload_size(plan), now, label)
+        if self.disk is not None:
+            self.disk.set(key, plan, now, label)
+
+    def nearest(self, label, similarity, min_score):
+        """
+        Returns (plan, label, score) for the in-memory entry whose label is most similar
+        to `label` according to similarity(a, b), or None if nothing reaches min_score.
+        This is a linear scan, meant for rare degraded-mode lookups only.
+        """
+        with self._lock:
+            candidates = [(entry.label, entry.value) for entry in self.memory.entries() if entry.label]
+        best = None
+        for candidate_label, value in candidates:
+            score = similarity(label, candidate_label)
+            if score >= min_score and (best is None or score > best[2]):
+                best = (value, candidate_label, score)
+        return best
+
+    def object_bytes(self, sizeof):
+        """Memory the in-memory tier's plans take as Python objects, measured with sizeof(plan)."""
+        with self._lock:
+            plans = [entry.value for entry in self.memory.entries()]
+        return sum(sizeof(plan) for plan in plans)
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "disk_hits": self.disk_hits,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self.memory),
+                "bytes": self.memory.bytes,
+                "max_bytes": self.memory.max_bytes,
+                "evictions": self.memory.evictions,
+                "disk_enabled": self.disk is not None,
+                "disk_evictions": self.disk.evictions if self.disk is not None else 0,
+            }
+
+
+def _payload_size(value):
+    return len(json.dumps(value, separators=(",", ":")).encode("utf-8"))
@@ -0,0 +1,136 @@
+"""
+On-demand cProfile of single requests.
+
+A request is profiled when it carries a valid signed X-Profile header (see _admin)
+or is picked by PROFILE_SAMPLE_RATE. Its view function then runs under cProfile and
+the resulting stats are kept in a small in-memory store for the admin endpoint to
+serve as a text report or a pstats file. Profiles are keyed by a random profile ID
+generated here, not by the client-supplied request ID, so one request cannot overwrite
+or read another's profile by reusing its X-Request-ID. Only one request is
+profiled at a time; others that ask meanwhile run normally.
+
+Only the request's own thread is profiled, and for streamed responses only the
+view itself (not the body sent afterwards). Each serverless instance keeps its own
+store, so fetch a profile from the instance that served the request.
+"""
+import cProfile
+import io
+import marshal
+import pstats
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from _config import env_number
+
+SIGNED = "signed"
+SAMPLED = "sampled"
+
+
+class ProfileStore:
+    """The most recent profiles, oldest evicted first."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def add(self, entry):
+        """Stores a profile and returns its new profile ID."""
+        profile_id = secrets.token_hex(8)
+        with self._lock:
+            self._entries[profile_id] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._entries.get(profile_id)
+
+    def stats_bytes(self):
+        with self._lock:
+            return sum(len(entry["stats"]) for entry in self._entries.values())
+
+    def list(self):
+        with self._lock:
+            entries = list(self._entries.items())
+        return [{"profile_id": profile_id, **{k: v for k, v in entry.items() if k != "stats"}}
+                for profile_id, entry in reversed(entries)]
+
+
+class RequestProfiler:
+    """Decides which requests to profile, profiles them and keeps the results."""
+
+    def __init__(self, sample_rate=None, max_stored=None):
+        self.sample_rate = sample_rate if sample_rate is not None else env_number("PROFILE_SAMPLE_RATE", 0.0)
+        self.store = ProfileStore(max_stored or env_number("PROFILE_MAX_STORED", 20, int))
+        # cProfile cannot always run in two threads at once, so one request at a time
+        self._busy = threading.Lock()
+        self.profiled = 0
+        self.skipped_busy = 0
+
+    def trigger(self, signed):
+        """SIGNED or SAMPLED if this request should be profiled, else None."""
+        if signed:
+            return SIGNED
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return SAMPLED
+        return None
+
+    def run(self, fn, request_id, endpoint, trigger):
+        """
+        Calls fn() under cProfile (unless another profile is running) and stores the stats.
+        Returns fn's result and the profile ID, None if the request was not profiled.
+        """
+        if not self._busy.acquire(blocking=False):
+            self.skipped_busy += 1
+            return fn(), None
+        try:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            try:
+                result = profiler.runcall(fn)
+            finally:
+                duration = time.perf_counter() - started
+                profiler.create_stats()
+                self.profiled += 1
+                profile_id = self.store.add({
+                    "request_id": request_id,
+                    "endpoint": endpoint,
+                    "trigger": trigger,
+                    "created": round(time.time(), 3),
+                    "duration_ms": round(duration * 1000, 3),
+                    "stats": marshal.dumps(profiler.stats),
+                })
+        finally:
+            self._busy.release()
+        return result, profile_id
+
+    def snapshot(self):
+        return {
+            "sample_rate": self.sample_rate,
+            "profiled": self.profiled,
+            "skipped_busy": self.skipped_busy,
+            "stored": len(self.store.list()),
+        }
+
+
+def pstats_report(stats_bytes, sort="cumulative", limit=40):
+    """Text report of the `limit` costliest functions, like `python -m pstats`."""
+    stream = io.StringIO()
+    stats = pstats.Stats(_LoadedStats(marshal.loads(stats_bytes)), stream=stream)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+class _LoadedStats:
+    """Lets pstats.Stats load stats that were kept in memory instead of a file."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
@@ -0,0 +1,140 @@
+"""
+requests-based upstream transport (the default).
+
+A shared urllib3 connection pool keeps TCP+TLS connections to the Gemini API alive
+across requests and warm Vercel invocations, resolving through the transport's DNS
+cache and counting every request and new socket.
+"""
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util import connection as urllib3_connection
+
+from _config import env_number
+from _timing import stage_span
+from _transport import (DEFAULT_CONNECT_TIMEOUT, DEFAULT_DNS_TTL, DEFAULT_POOL_SIZE, DEFAULT_READ_TIMEOUT,
+                        DNSCache, TransportErrors, TransportStats)
+
+
+REQUESTS_ERRORS = TransportErrors(
+    HTTPError=requests.exceptions.HTTPError,
+    ConnectionError=requests.exceptions.ConnectionError,
+    Timeout=requests.exceptions.Timeout,
+    SSLError=requests.exceptions.SSLError,
+    ProtocolError=requests.exceptions.ChunkedEncodingError,
+)
+
+
+class _CountingConnectionMixin:
+    """Connects through the transport's DNS cache, counts every new socket and times the setup."""
+
+    transport_stats = None
+    dns_cache = None
+
+    def connect(self):
+        # DNS, TCP and (for HTTPS) the TLS handshake
+        with stage_span("connect"):
+            super().connect()
+
+    def _new_conn(self):
+        self.transport_stats.incr("new_connections")
+        if self.dns_cache is None or self.dns_cache.ttl <= 0:
+            return super()._new_conn()
+        try:
+            address = self.dns_cache.resolve(self._dns_host, self.port)
+            return urllib3_connection.create_connection(
+                address,
+                self.timeout,
+                source_address=self.source_address,
+                socket_options=self.socket_options,
+            )
+        except OSError:
+            # The cached address may be stale; fall back to a fresh lookup and let
+            # urllib3 translate any failure into its usual exception types.
+            self.dns_cache.invalidate(self._dns_host, self.port)
+            return super()._new_conn()
+
+
+class _CountingPoolMixin:
+    transport_stats = None
+
+    def _make_request(self, *args, **kwargs):
+        self.transport_stats.incr("requests")
+        return super()._make_request(*args, **kwargs)
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools count requests and use the DNS cache."""
+
+    def __init__(self, stats, dns_cache, pool_size, **kwargs):
+        attrs = {"transport_stats": stats, "dns_cache": dns_cache}
+        http_conn = type("CountingHTTPConnection", (_CountingConnectionMixin, HTTPConnection), attrs)
+        https_conn = type("CountingHTTPSConnection", (_CountingConnectionMixin, HTTPSConnection), attrs)
+        self._pool_classes = {
+            "http": type("CountingHTTPConnectionPool", (_CountingPoolMixin, HTTPConnectionPool),
+                         {"transport_stats": stats, "ConnectionCls": http_conn}),
+            "https": type("CountingHTTPSConnectionPool", (_CountingPoolMixin, HTTPSConnectionPool),
+                          {"transport_stats": stats, "ConnectionCls": https_conn}),
+        }
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        # TCP keep-alive stops idle pooled sockets from being silently dropped by NAT.
+        socket_options = list(HTTPConnection.default_socket_options)
+        socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30))
+        kwargs.setdefault("socket_options", socket_options)
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self._pool_classes
+
+
+class RequestsTransport:
+    """
+    Thread-safe pooled transport for upstream Gemini calls, built on requests.
+
+    The urllib3 connection pool lives in one shared adapter; each thread gets its own
+    lightweight requests.Session mounted on that adapter, since Session state itself is
+    not guaranteed to be thread-safe.
+    """
+
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None, dns_ttl=None):
+        self.pool_size = pool_size or env_number("GEMINI_POOL_SIZE", DEFAULT_POOL_SIZE, int)
+        self.connect_timeout = connect_timeout or env_number("GEMINI_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)
+        self.read_timeout = read_timeout or env_number("GEMINI_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)
+        if dns_ttl is None:
+            dns_ttl = env_number("GEMINI_DNS_TTL", DEFAULT_DNS_TTL)
+
+        self.errors = REQUESTS_ERRORS
+        self.stats = TransportStats()
+        self.dns_cache = DNSCache(dns_ttl, self.stats)
+        self.adapter = PooledAdapter(self.stats, self.dns_cache, self.pool_size)
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+            self._local.session = session
+        return session
+
+    def post(self, url, json=None, headers=None, timeout=None, stream=False):
+        """Sends a POST over a pooled connection; timeout defaults to (connect, read)."""
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        return self._session().post(url, json=json, headers=headers, timeout=timeout, stream=stream)
+
+    def snapshot(self):
+        stats = self.stats.snapshot()
+        stats["implementation"] = "requests"
+        stats["pool_size"] = self.pool_size
+        return stats
+
+    def close(self):
+        self.adapter.close()
@@ -0,0 +1,154 @@
+"""
+Retry policy for upstream Gemini calls.
+
+Errors are classified as retryable (429/5xx, connection resets, timeouts) or fatal.
+Retryable failures are retried with decorrelated-jitter backoff, never sooner than
+the upstream's Retry-After, and never past the overall request deadline.
+"""
+import logging
+import random
+import threading
+import time
+
+from _config import env_number
+
+log = logging.getLogger("metraplan.retry")
+
+
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+# Upper bounds (seconds) of the per-attempt latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+
+def is_retryable_status(status):
+    return status in RETRYABLE_STATUSES
+
+
+class RetryStats:
+    """Thread-safe attempt, retry and latency counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.successes = 0
+        self.retries = 0
+        self.fatal_errors = 0
+        self.exhausted = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+
+    def record_attempt(self, latency, ok):
+        with self._lock:
+            self.attempts += 1
+            if ok:
+                self.successes += 1
+            self.latency_sum += latency
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    self.latency_buckets[i] += 1
+                    break
+
+    def incr(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "successes": self.successes,
+                "retries": self.retries,
+                "fatal_errors": self.fatal_errors,
+                "exhausted": self.exhausted,
+                "attempt_latency_avg": round(self.latency_sum / self.attempts, 4) if self.attempts else 0.0,
+                "attempt_latency_buckets": {
+                    ("+Inf" if bound == float("inf") else str(bound)): count
+                    for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets)
+                },
+            }
+
+
+class RetryPolicy:
+    """
+    Runs an attempt function until it succeeds, fails fatally, runs out of attempts
+    or would overrun the deadline.
+
+    `classify(error)` returns (retryable, retry_after_seconds_or_None).
+    """
+
+    def __init__(self, classify, max_attempts=None, base_delay=None, max_delay=None, deadline=None):
+        self.classify = classify
+        self.max_attempts = max_attempts or env_number("GEMINI_MAX_ATTEMPTS", 4, int)
+        self.base_delay = base_delay or env_number("GEMINI_RETRY_BASE_DELAY", 0.5)
+        self.max_delay = max_delay or env_number("GEMINI_RETRY_MAX_DELAY", 8.0)
+        self.deadline = deadline or env_number("GEMINI_REQUEST_DEADLINE", 60.0)
+        self.stats = RetryStats()
+
+    def new_deadline(self):
+        """Absolute time.monotonic() deadline for a request starting now."""
+        return time.monotonic() + self.deadline
+
+    def next_delay(self, previous_delay):
+        """Decorrelated jitter: uniform between the base delay and 3x the previous delay."""
+        return min(self.max_delay, random.uniform(self.base_delay, previous_delay * 3))
+
+    def _backoff(self, error, attempt, delay, deadline):
+        """Returns the delay before the next attempt, or None to give up and re-raise."""
+        retryable, retry_after = self.classify(error)
+        if not retryable:
+            self.stats.incr("fatal_errors")
+            return None
+        if attempt >= self.max_attempts:
+            self.stats.incr("exhausted")
+            return None
+        delay = self.next_delay(delay)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if time.monotonic() + delay >= deadline:
+            self.stats.incr("exhausted")
+            return None
+        self.stats.incr("retries")
+        return delay
+
+    def call(self, attempt_fn, deadline=None):
+        """Calls attempt_fn(deadline) with retries and returns its result."""
+        deadline = deadline or self.new_deadline()
+        delay = self.base_delay
+        for attempt in range(1, self.max_attempts + 1):
+            start = time.monotonic()
+            try:
+                result = attempt_fn(deadline)
+            except Exception as error:
+                self.stats.record_attempt(time.monotonic() - start, ok=False)
+                delay = self._backoff(error, attempt, delay, deadline)
+                if delay is None:
+                    raise
+                log.warning("Upstream attempt failed; retrying",
+                            extra={"attempt": attempt, "error": str(error), "retry_in": round(delay, 2)})
+                time.sleep(delay)
+            else:
+                self.stats.record_attempt(time.monotonic() - start, ok=True)
+                return result
+
+    async def call_async(self, attempt_fn, deadline=None):
+        """asyncio form of call(); attempt_fn(deadline) must return an awaitable."""
+        import asyncio
+
+        deadline = deadline or self.new_deadline()
+        delay = self.base_delay
+        for attempt in range(1, self.max_attempts + 1):
+            start = time.monotonic()
+            try:
+                result = await attempt_fn(deadline)
+            except Exception as error:
+                self.stats.record_attempt(time.monotonic() - start, ok=False)
+                delay = self._backoff(error, attempt, delay, deadline)
+                if delay is None:
+                    raise
+                log.warning("Upstream attempt failed; retrying",
+                            extra={"attempt": attempt, "error": repr(error), "retry_in": round(delay, 2)})
+                await asyncio.sleep(delay)
+            else:
+                self.stats.record_attempt(time.monotonic() - start, ok=True)
+                return result
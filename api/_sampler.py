@@ -0,0 +1,199 @@
+"""
+Continuous sampling profiler for all threads of the process.
+
+A background thread wakes PROFILER_HZ times a second and walks sys._current_frames().
+Each thread's stack is weighted by the CPU time that thread used since the previous
+sample, read from its own CPU clock. Threads that are only waiting (on a lock, a
+socket or the log queue) therefore add nothing, and the result shows where CPU time
+goes rather than where threads sit. Platforms without per-thread CPU clocks fall
+back to counting samples.
+
+Stacks are kept in collapsed form ("thread;file:function;... weight"), ready for
+flamegraph.pl or speedscope, in a ring of time slots covering PROFILER_WINDOW
+seconds. Each slot holds at most PROFILER_MAX_STACKS distinct stacks, and the rest
+are folded into one "[other]" entry, so memory stays bounded. The sampler measures
+its own CPU time and lowers its rate whenever that goes above PROFILER_MAX_OVERHEAD
+percent of one core.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+from _config import env_number
+
+OTHER_STACKS = "[other]"
+
+_THREAD_NUMBER = re.compile(r"[-_ ]?\d+$|\(.*\)$")
+
+
+def _thread_group(name):
+    """'plan-batch_3' -> 'plan-batch', 'Thread-7 (process_request_thread)' -> 'Thread', so pools share stacks."""
+    return _THREAD_NUMBER.sub("", _THREAD_NUMBER.sub("", name).strip()) or name
+
+
+class SamplingProfiler:
+    """Samples every thread's stack on a timer and keeps CPU-weighted collapsed stacks."""
+
+    def __init__(self, hz=None, window=None, slots=None, max_stacks=None, max_depth=None, max_overhead=None):
+        self.hz = hz if hz is not None else env_number("PROFILER_HZ", 11.0)
+        self.window = window or env_number("PROFILER_WINDOW", 300.0)
+        self.slot_count = slots or env_number("PROFILER_SLOTS", 10, int)
+        self.max_stacks = max_stacks or env_number("PROFILER_MAX_STACKS", 2000, int)
+        self.max_depth = max_depth or env_number("PROFILER_MAX_DEPTH", 64, int)
+        self.max_overhead = (max_overhead or env_number("PROFILER_MAX_OVERHEAD", 1.0)) / 100.0
+        self.slot_seconds = self.window / self.slot_count
+        self.base_interval = 1.0 / self.hz if self.hz > 0 else None
+        self.interval = self.base_interval
+
+        self._lock = threading.Lock()
+        self._slots = deque(maxlen=self.slot_count)     # (start, {stack: weight})
+        self._labels = {}       # id(code object) -> ("file:function", code object)
+        self._thread_names = {}
+        self._cpu_clocks = {}   # thread ident -> CPU clock id
+        self._cpu_seen = {}     # thread ident -> CPU seconds at the previous sample
+        self._per_thread_cpu = hasattr(time, "pthread_getcpuclockid")
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.samples = 0
+        self.idle_samples = 0
+        self.overhead = 0.0
+
+    @property
+    def enabled(self):
+        return self.base_interval is not None
+
+    def start(self):
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        check_at = time.monotonic() + 5.0
+        spent, wall_start = 0.0, time.monotonic()
+        while not self._stop.wait(self.interval):
+            cpu_start = time.thread_time()
+            self._sample(own)
+            spent += time.thread_time() - cpu_start
+
+            now = time.monotonic()
+            if now >= check_at:
+                # Share of one core the sampler itself used over the last few seconds
+                self.overhead = spent / (now - wall_start)
+                if self.overhead > self.max_overhead:
+                    self.interval = min(1.0, self.interval * 2)
+                elif self.overhead < self.max_overhead / 4 and self.interval > self.base_interval:
+                    self.interval = max(self.base_interval, self.interval / 2)
+                spent, wall_start, check_at = 0.0, now, now + 5.0
+
+    def _cpu_delta(self, ident):
+        """CPU seconds the thread used since the previous sample; None on its first sample."""
+        clock = self._cpu_clocks.get(ident)
+        try:
+            if clock is None:
+                clock = self._cpu_clocks[ident] = time.pthread_getcpuclockid(ident)
+            cpu = time.clock_gettime(clock)
+        except (OSError, OverflowError):
+            return None
+        previous = self._cpu_seen.get(ident)
+        self._cpu_seen[ident] = cpu
+        return None if previous is None else cpu - previous
+
+    def _thread_name(self, ident):
+        name = self._thread_names.get(ident)
+        if name is None:
+            self._thread_names = {thread.ident: _thread_group(thread.name) for thread in threading.enumerate()}
+            name = self._thread_names.get(ident, "unknown")
+        return name
+
+    def _collapse(self, ident, frame):
+        labels = [self._thread_name(ident)]
+        cache = self._labels
+        for _ in range(self.max_depth):
+            if frame is None:
+                break
+            code = frame.f_code
+            # Keyed by id(): hashing a code object hashes its contents; the value keeps
+            # the code object alive so its id cannot be reused
+            entry = cache.get(id(code))
+            if entry is None:
+                name = getattr(code, "co_qualname", code.co_name)
+                entry = cache[id(code)] = (f"{os.path.basename(code.co_filename)}:{name}", code)
+            labels.append(entry[0])
+            frame = frame.f_back
+        labels[1:] = labels[:0:-1]
+        return ";".join(labels)
+
+    def _sample(self, own):
+        frames = sys._current_frames()
+        stacks = []
+        for ident, frame in frames.items():
+            if ident == own:
+                continue
+            if self._per_thread_cpu:
+                cpu = self._cpu_delta(ident)
+                if not cpu:
+                    self.idle_samples += 1
+                    continue
+                weight = max(1, round(cpu * 1e6))   # microseconds of CPU
+            else:
+                weight = 1
+            stacks.append((self._collapse(ident, frame), weight))
+        self.samples += len(frames) - 1
+        if len(self._cpu_seen) > len(frames):
+            # Forget threads that have exited
+            self._cpu_seen = {ident: cpu for ident, cpu in self._cpu_seen.items() if ident in frames}
+            self._cpu_clocks = {ident: clock for ident, clock in self._cpu_clocks.items() if ident in frames}
+            self._thread_names = {}
+        del frames, frame
+
+        now = time.monotonic()
+        with self._lock:
+            if not self._slots or now - self._slots[-1][0] >= self.slot_seconds:
+                self._slots.append((now, {}))
+            slot = self._slots[-1][1]
+            for stack, weight in stacks:
+                if stack not in slot and len(slot) >= self.max_stacks:
+                    stack = OTHER_STACKS
+                slot[stack] = slot.get(stack, 0) + weight
+
+    def collapsed(self, seconds=None):
+        """Collapsed stacks of the last `seconds` (default: the whole window), heaviest first."""
+        since = time.monotonic() - (seconds or self.window)
+        totals = {}
+        with self._lock:
+            for start, slot in self._slots:
+                if start + self.slot_seconds >= since:
+                    for stack, weight in slot.items():
+                        totals[stack] = totals.get(stack, 0) + weight
+        return "".join(f"{stack} {weight}\n" for stack, weight in sorted(totals.items(), key=lambda item: -item[1]))
+
+    def stored_bytes(self):
+        """Approximate memory held by the stored stacks."""
+        with self._lock:
+            return sum(sys.getsizeof(slot) + sum(sys.getsizeof(stack) for stack in slot) for _, slot in self._slots)
+
+    def snapshot(self):
+        with self._lock:
+            stacks = sum(len(slot) for _, slot in self._slots)
+        return {
+            "enabled": self.enabled,
+            "running": self._thread is not None,
+            "hz": round(1.0 / self.interval, 2) if self.interval else 0,
+            "weight": "cpu_us" if self._per_thread_cpu else "samples",
+            "samples": self.samples,
+            "idle_samples": self.idle_samples,
+            "stored_stacks": stacks,
+            "overhead_percent": round(self.overhead * 100, 3),
+        }
@@ -0,0 +1,168 @@
+"""
+Quota-aware scheduling of upstream Gemini calls.
+
+Gemini enforces requests-per-minute (RPM) and tokens-per-minute (TPM) limits. Each
+call reserves one request and its estimated token cost from two token buckets. When
+the buckets are short, the caller waits its turn instead of triggering a 429, and is
+only turned away (UpstreamBusy) if that wait would exceed the queue deadline.
+
+Limits are tracked per process, so they should be set to each instance's share of
+the project quota.
+"""
+import math
+import threading
+import time
+
+from _config import env_number
+
+
+DEFAULT_RPM = 1000
+DEFAULT_TPM = 1000000
+DEFAULT_QUEUE_TIMEOUT = 10.0
+DEFAULT_OUTPUT_TOKENS = 1500
+CHARS_PER_TOKEN = 4
+
+
+class UpstreamBusy(Exception):
+    """Raised when a call cannot be scheduled within the queue deadline."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Upstream quota exhausted; retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        """Retry-After header value: whole seconds, rounded up."""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `capacity` tokens per minute.
+
+    The level may go negative: that is a reservation by callers that are waiting
+    for their turn, which keeps the queue first-come first-served.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` more tokens could be taken, given current reservations."""
+        deficit = amount - self.level
+        return deficit / self.rate if deficit > 0 else 0.0
+
+
+def estimate_tokens(prompt, expected_output_tokens=DEFAULT_OUTPUT_TOKENS):
+    """Rough token cost of a call: ~4 characters per prompt token plus the expected output."""
+    return len(prompt) // CHARS_PER_TOKEN + 1 + expected_output_tokens
+
+
+class UpstreamScheduler:
+    """Schedules calls against RPM and TPM budgets; a limit of 0 disables that bucket."""
+
+    def __init__(self, rpm=None, tpm=None, queue_timeout=None, expected_output_tokens=None):
+        rpm = rpm if rpm is not None else env_number("GEMINI_RPM", DEFAULT_RPM)
+        tpm = tpm if tpm is not None else env_number("GEMINI_TPM", DEFAULT_TPM)
+        self.queue_timeout = queue_timeout if queue_timeout is not None else env_number("GEMINI_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT)
+        self.expected_output_tokens = (expected_output_tokens if expected_output_tokens is not None
+                                       else env_number("GEMINI_EXPECTED_OUTPUT_TOKENS", DEFAULT_OUTPUT_TOKENS, int))
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+
+        self.scheduled = 0
+        self.queued = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+
+    def estimate(self, prompt):
+        return estimate_tokens(prompt, self.expected_output_tokens)
+
+    def reserve(self, token_cost, deadline=None):
+        """
+        Reserves one request and `token_cost` tokens and returns how long the caller
+        must wait before sending. Raises UpstreamBusy if that wait would end after
+        the queue deadline (or the caller's own `deadline`, a time.monotonic() value).
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._blocked_until - now)
+            for bucket, amount in ((self.requests, 1), (self.tokens, token_cost)):
+                if bucket is not None:
+                    bucket.refill(now)
+                    # A single call larger than the whole budget would never fit; cap it
+                    wait = max(wait, bucket.wait_time(min(amount, bucket.capacity)))
+
+            limit = self.queue_timeout
+            if deadline is not None:
+                limit = min(limit, deadline - now)
+            if wait > limit:
+                self.rejected += 1
+                raise UpstreamBusy(wait)
+
+            if self.requests is not None:
+                self.requests.level -= 1
+            if self.tokens is not None:
+                self.tokens.level -= min(token_cost, self.tokens.capacity)
+            self.scheduled += 1
+            if wait > 0:
+                self.queued += 1
+                self.total_wait += wait
+            return wait
+
+    def acquire(self, token_cost, deadline=None):
+        """Blocking form of reserve(): sleeps until the call may be sent."""
+        wait = self.reserve(token_cost, deadline)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, token_cost, deadline=None):
+        """asyncio form of reserve()."""
+        import asyncio
+
+        wait = self.reserve(token_cost, deadline)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """Corrects the token bucket once the real usage of a call is known."""
+        if self.tokens is None or actual_tokens is None:
+            return
+        with self._lock:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + estimated_tokens - actual_tokens)
+
+    def release(self, token_cost):
+        """Returns the tokens reserved for a call that failed without producing any output."""
+        self.settle(token_cost, 0)
+
+    def backoff(self, seconds):
+        """Holds back every new call for `seconds`, e.g. after the upstream returned 429."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            for bucket in (self.requests, self.tokens):
+                if bucket is not None:
+                    bucket.refill(now)
+            return {
+                "rpm_limit": self.requests.capacity if self.requests else None,
+                "tpm_limit": self.tokens.capacity if self.tokens else None,
+                "requests_available": round(self.requests.level, 2) if self.requests else None,
+                "tokens_available": round(self.tokens.level) if self.tokens else None,
+                "scheduled": self.scheduled,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "total_wait_seconds": round(self.total_wait, 3),
+                "blocked_for_seconds": round(max(0.0, self._blocked_until - now), 3),
+            }
@@ -0,0 +1,143 @@
+"""
+Single-flight coalescing of concurrent identical calls.
+
+The first caller for a key (the leader) runs the function; callers that arrive while
+it is still running wait for the leader's result instead of repeating the work.
+"""
+import threading
+
+
+class SingleFlightTimeout(Exception):
+    """Raised when a coalesced caller gives up waiting for the leader."""
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicates in-flight calls by key."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key, fn, timeout=None):
+        """
+        Runs fn() once per key at a time and returns (result, shared).
+        `shared` is True when the result came from another caller's run.
+        Followers wait at most `timeout` seconds; the leader's exceptions propagate to all.
+        """
+        call, leader = self.begin(key)
+        if not leader:
+            return self.wait(call, timeout), True
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result)
+        return result, False
+
+    def begin(self, key):
+        """
+        (call, leader) for a caller that produces its result itself, e.g. while streaming
+        it: the leader must end the call with finish(), followers pass it to wait().
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                return call, True
+            call.waiters += 1
+            self.coalesced += 1
+            return call, False
+
+    def wait(self, call, timeout=None):
+        """The leader's result, or its exception; raises SingleFlightTimeout after `timeout` seconds."""
+        if not call.done.wait(timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for an identical in-flight request")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def finish(self, key, call, result=None, error=None):
+        """Hands the leader's result (or exception) to its followers; later calls do nothing."""
+        with self._lock:
+            if call.done.is_set():
+                return
+            call.result = result
+            call.error = error
+            del self._calls[key]
+            call.done.set()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+                "in_flight": len(self._calls),
+            }
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight for coroutines on one event loop."""
+
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    async def do(self, key, coro_fn, timeout=None):
+        """Awaits coro_fn() once per key at a time and returns (result, shared)."""
+        import asyncio
+
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                # shield() so one follower timing out does not cancel the shared call
+                return await asyncio.wait_for(asyncio.shield(future), timeout), True
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for an identical in-flight request")
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self.leaders += 1
+        try:
+            result = await coro_fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody was waiting for it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
+
+    def snapshot(self):
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+            "in_flight": len(self._calls),
+        }
@@ -0,0 +1,95 @@
+"""
+Incremental parsing for streamed plan generation.
+
+Gemini's streamGenerateContent (with alt=sse) sends the JSON array text in arbitrary
+fragments. JSONArrayStreamParser consumes those fragments and hands back each element
+of the top-level array as soon as it is complete, holding at most one element's text.
+"""
+import json
+
+
+class JSONArrayStreamParser:
+    """Yields the elements of a streamed top-level JSON array one at a time."""
+
+    def __init__(self):
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self.finished = False
+
+    def feed(self, text):
+        """Consumes the next fragment and returns the list of elements it completed."""
+        elements = []
+        for char in text:
+            if self.finished:
+                break
+            if not self._started:
+                if char == "[":
+                    self._started = True
+                    self._depth = 1
+                elif not char.isspace():
+                    raise ValueError(f"Expected a JSON array, found {char!r}")
+                continue
+
+            if self._in_string:
+                self._buffer.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if self._depth == 1:
+                # Between elements: skip separators, stop at the closing bracket
+                if char == "]":
+                    self._flush(elements)
+                    self._depth = 0
+                    self.finished = True
+                    continue
+                if char == ",":
+                    self._flush(elements)
+                    continue
+                if char.isspace() and not self._buffer:
+                    continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "[{":
+                self._depth += 1
+            elif char in "]}":
+                self._depth -= 1
+            self._buffer.append(char)
+
+            if self._depth == 1 and char in "]}":
+                self._flush(elements)
+        return elements
+
+    def _flush(self, elements):
+        text = "".join(self._buffer).strip()
+        self._buffer = []
+        if text:
+            elements.append(json.loads(text))
+
+
+def iter_sse_texts(lines, usage=None):
+    """
+    Extracts the generated text fragments from Gemini SSE lines.
+    Each `data:` line carries a GenerateContentResponse chunk. If a `usage` dict is
+    given, it is updated with each chunk's (running) usageMetadata.
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.startswith("data:"):
+            continue
+        chunk = json.loads(line[5:].strip())
+        if usage is not None and chunk.get("usageMetadata"):
+            usage.update(chunk["usageMetadata"])
+        for candidate in chunk.get("candidates", [])[:1]:
+            for part in candidate.get("content", {}).get("parts", []):
+                if part.get("text"):
+                    yield part["text"]
@@ -0,0 +1,161 @@
+"""
+Per-request stage timing.
+
+A RequestTimer adds up how long each stage of a request took: parsing the body, the
+cache lookup, waiting for quota, connecting to the upstream, waiting for its first
+byte, downloading and decoding its answer, jsonify. The timer is bound to the thread
+(or asyncio task) handling the request, so code deep in the call stack records into it
+through `stage_span()` and `add_stage()` without it being passed around; with no timer
+bound nothing is timed.
+Upstream attempts run on the hedging pool are not broken down, only counted in the
+enclosing stage.
+
+Every response reports its stages in a Server-Timing header, and finished timers feed
+per-endpoint StageHistograms. When the request is traced, each stage is also a span
+(see _tracing); on threads without a timer, such as the hedging pool, only the span
+is recorded.
+"""
+import contextvars
+import threading
+import time
+
+from _tracing import child_span, record_span
+
+# Upper bounds (milliseconds) of the per-stage histogram buckets
+STAGE_BUCKETS_MS = (0.1, 0.5, 1.0, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0, 2500.0, 5000.0, 10000.0,
+                    30000.0, float("inf"))
+
+_timer = contextvars.ContextVar("request_timer", default=None)
+
+
+class RequestTimer:
+    """Seconds spent per stage of one request, in the order the stages first ran."""
+
+    __slots__ = ("started", "stages")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        """Server-Timing header value, durations in milliseconds."""
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+class _Span:
+    __slots__ = ("timer", "stage", "trace", "started")
+
+    def __init__(self, timer, stage, trace):
+        self.timer = timer
+        self.stage = stage
+        self.trace = trace
+
+    def __enter__(self):
+        if self.trace is not None:
+            self.trace.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.add(self.stage, time.perf_counter() - self.started)
+        if self.trace is not None:
+            self.trace.__exit__(*exc_info)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def start_request():
+    """Binds a fresh timer to the current thread (or asyncio task) and returns it."""
+    timer = RequestTimer()
+    _timer.set(timer)
+    return timer
+
+
+def finish_request():
+    """Unbinds and returns the current thread's timer (None if there is none)."""
+    timer = _timer.get()
+    _timer.set(None)
+    return timer
+
+
+def stage_span(stage):
+    """Context manager adding the time spent inside it to `stage` of the current request."""
+    timer = _timer.get()
+    trace = child_span(stage)
+    if timer is None:
+        return _NO_SPAN if trace is None else trace
+    return _Span(timer, stage, trace)
+
+
+def add_stage(stage, seconds):
+    """Adds `seconds` to `stage` of the current request."""
+    timer = _timer.get()
+    if timer is not None:
+        timer.add(stage, seconds)
+    record_span(stage, seconds)
+
+
+def stage_seconds(stage):
+    """Time recorded so far for `stage` of the current request."""
+    timer = _timer.get()
+    return 0.0 if timer is None else timer.stages.get(stage, 0.0)
+
+
+class StageHistograms:
+    """Thread-safe per-endpoint, per-stage latency histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}   # (endpoint, stage) -> [count, sum_ms, max_ms, bucket counts]
+
+    def record(self, endpoint, timer, total):
+        samples = [(stage, seconds * 1000) for stage, seconds in timer.stages.items()]
+        samples.append(("total", total * 1000))
+        with self._lock:
+            for stage, ms in samples:
+                entry = self._stages.get((endpoint, stage))
+                if entry is None:
+                    entry = self._stages[(endpoint, stage)] = [0, 0.0, 0.0, [0] * len(STAGE_BUCKETS_MS)]
+                entry[0] += 1
+                entry[1] += ms
+                entry[2] = max(entry[2], ms)
+                for i, bound in enumerate(STAGE_BUCKETS_MS):
+                    if ms <= bound:
+                        entry[3][i] += 1
+                        break
+
+    def snapshot(self):
+        with self._lock:
+            entries = [(key, entry[0], entry[1], entry[2], list(entry[3])) for key, entry in self._stages.items()]
+        endpoints = {}
+        for (endpoint, stage), count, sum_ms, max_ms, buckets in entries:
+            endpoints.setdefault(endpoint, {})[stage] = {
+                "count": count,
+                "avg_ms": round(sum_ms / count, 3),
+                "max_ms": round(max_ms, 3),
+                "buckets_ms": {
+                    ("+Inf" if bound == float("inf") else str(bound)): bucket_count
+                    for bound, bucket_count in zip(STAGE_BUCKETS_MS, buckets)
+                },
+            }
+        return endpoints
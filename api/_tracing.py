@@ -0,0 +1,338 @@
+"""
+Minimal distributed tracing: W3C trace context, spans and a batched exporter.
+
+Each sampled request gets a server span. Its parent is the caller's `traceparent`
+header when there is one, so the browser's request, the Flask handler and every
+Gemini attempt share one trace ID. Spans are bound to the current thread, or asyncio
+task on the ASGI path. Code deeper down opens child spans through `child_span()`
+without a span being passed around, and `bind_context()` carries the current span
+over to a pool thread. Stage timings (see _timing) open a child span per stage.
+
+Tracing is off unless TRACE_EXPORTER is `jsonl` (spans appended to TRACE_FILE) or
+`otlp` (OTLP/HTTP JSON posted to TRACE_OTLP_ENDPOINT). TRACE_SAMPLE_RATE of the
+requests are traced, plus every request whose caller already sampled it. Ended spans
+go onto a bounded queue that a background thread exports in batches. When the queue
+is full, spans are dropped and counted instead of slowing requests down. Unsampled
+requests cost one ContextVar lookup per stage.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+from _config import env_number
+
+log = logging.getLogger("metraplan.tracing")
+
+
+# OTLP span kinds
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+_TRACEPARENT = re.compile(r"([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?")
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+def parse_traceparent(value):
+    """(trace_id, parent_span_id, sampled) from a W3C traceparent header, or None if it is invalid."""
+    match = _TRACEPARENT.fullmatch(value.strip().lower()) if value else None
+    if match is None:
+        return None
+    version, trace_id, parent_id, flags, rest = match.groups()
+    if version == "ff" or (version == "00" and rest) or trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+def _random_id(bits):
+    return f"{random.getrandbits(bits) or 1:0{bits // 4}x}"
+
+
+class Span:
+    """One timed operation; entering it makes it the current span of the thread."""
+
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "error", "_previous")
+
+    def __init__(self, tracer, trace_id, parent_id, name, kind=INTERNAL, attributes=None, start_ns=None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = _random_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+        self._previous = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, end_ns=None):
+        if self.end_ns is None:
+            self.end_ns = end_ns or time.time_ns()
+            self.tracer._export(self)
+
+    def __enter__(self):
+        self._previous = _current.get()
+        _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.error is None:
+            self.error = exc_type.__name__
+        self.end()
+        _current.set(self._previous)
+        self._previous = None
+        return False
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+def current_span():
+    """The current thread's span, or NO_SPAN (whose set() does nothing) if it is not traced."""
+    return _current.get() or NO_SPAN
+
+
+def child_span(name, kind=INTERNAL, **attributes):
+    """A child of the current span (enter it to time it), or None if the thread is not traced."""
+    parent = _current.get()
+    if parent is None:
+        return None
+    return Span(parent.tracer, parent.trace_id, parent.span_id, name, kind, attributes)
+
+
+def trace_span(name, kind=INTERNAL, **attributes):
+    """Like child_span(), but returns NO_SPAN instead of None, for use in `with` statements."""
+    return child_span(name, kind, **attributes) or NO_SPAN
+
+
+def record_span(name, seconds):
+    """Adds an already finished child span that took `seconds` and ended now."""
+    parent = _current.get()
+    if parent is not None:
+        end_ns = time.time_ns()
+        span = Span(parent.tracer, parent.trace_id, parent.span_id, name, start_ns=end_ns - int(seconds * 1e9))
+        span.end(end_ns)
+
+
+def bind_context(fn):
+    """Wraps fn so that, run on another thread, its spans are children of the current span."""
+    parent = _current.get()
+    if parent is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        previous = _current.get()
+        _current.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.set(previous)
+    return bound
+
+
+class JSONLExporter:
+    """Appends one JSON object per span to a file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, spans):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans))
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPExporter:
+    """Posts spans to an OTLP/HTTP collector in its JSON encoding."""
+
+    def __init__(self, url, service_name, timeout=5.0):
+        self.url = url
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def export(self, spans):
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "metraplan"}, "spans": [{
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                "name": span.name,
+                "kind": span.kind,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+                # STATUS_CODE_ERROR
+                **({"status": {"code": 2, "message": span.error}} if span.error else {}),
+            } for span in spans]}],
+        }]}
+        import urllib.request
+
+        request = urllib.request.Request(self.url, data=json.dumps(body).encode("utf-8"), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def exporter_from_env():
+    """The exporter TRACE_EXPORTER asks for, or None if tracing is off."""
+    kind = os.getenv("TRACE_EXPORTER", "").strip().lower()
+    if kind == "jsonl":
+        import tempfile
+
+        return JSONLExporter(os.getenv("TRACE_FILE") or os.path.join(tempfile.gettempdir(), "metraplan-traces.jsonl"))
+    if kind == "otlp":
+        return OTLPExporter(os.getenv("TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces"),
+                            os.getenv("TRACE_SERVICE_NAME", "metraplan"))
+    if kind:
+        log.warning("Ignoring unknown trace exporter", extra={"exporter": kind})
+    return None
+
+
+class Tracer:
+    """Starts request spans and exports ended spans in batches from a background thread."""
+
+    _STOP = object()
+
+    def __init__(self, exporter=None, sample_rate=None, queue_size=None, batch_size=None, flush_interval=None):
+        self.exporter = exporter if exporter is not None else exporter_from_env()
+        self.enabled = self.exporter is not None
+        self.sample_rate = sample_rate if sample_rate is not None else env_number("TRACE_SAMPLE_RATE", 0.1)
+        self.batch_size = batch_size or env_number("TRACE_BATCH_SIZE", 256, int)
+        self.flush_interval = flush_interval or env_number("TRACE_FLUSH_INTERVAL", 2.0)
+        self.queue = queue.Queue(queue_size or env_number("TRACE_QUEUE_SIZE", 2048, int))
+        self.sampled = 0
+        self.exported = 0
+        self.dropped = 0
+        self.export_errors = 0
+        self._thread = None
+        if self.enabled:
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def start_request(self, name, traceparent=None, attributes=None):
+        """
+        Starts and binds the server span of a request if it is sampled. A caller's
+        sampling decision is kept; otherwise TRACE_SAMPLE_RATE applies.
+        """
+        _current.set(None)
+        if not self.enabled:
+            return None
+        parent = parse_traceparent(traceparent)
+        if parent is not None and parent[2]:
+            sampled = True
+        else:
+            sampled = random.random() < self.sample_rate
+        if not sampled:
+            return None
+        trace_id, parent_id = (parent[0], parent[1]) if parent is not None else (_random_id(128), None)
+        self.sampled += 1
+        span = Span(self, trace_id, parent_id, name, SERVER, attributes)
+        _current.set(span)
+        return span
+
+    def finish_request(self, error=None):
+        """Ends and unbinds the current request's server span."""
+        span = _current.get()
+        _current.set(None)
+        if span is not None:
+            if error is not None and span.error is None:
+                span.error = type(error).__name__
+            span.end()
+
+    def _export(self, span):
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    span = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if span is self._STOP:
+                    stopping = True
+                    break
+                batch.append(span)
+            if batch:
+                try:
+                    self.exporter.export(batch)
+                    self.exported += len(batch)
+                except Exception as e:
+                    self.export_errors += 1
+                    self.dropped += len(batch)
+                    log.warning("Could not export spans", extra={"spans": len(batch), "error": str(e)})
+
+    def stop(self):
+        """Exports what is still queued; called at exit."""
+        if self._thread is not None:
+            self.queue.put(self._STOP)
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def snapshot(self):
+        return {
+            "enabled": self.enabled,
+            "exporter": type(self.exporter).__name__ if self.exporter else None,
+            "sample_rate": self.sample_rate,
+            "sampled_requests": self.sampled,
+            "queued": self.queue.qsize(),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "export_errors": self.export_errors,
+        }
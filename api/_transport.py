@@ -0,0 +1,134 @@
+"""
+Pooled, persistent HTTP transport for the Gemini API.
+
+A single module-scoped transport is shared by every Flask worker thread and survives
+warm Vercel invocations, so repeated plans reuse the same TCP+TLS connections instead
+of paying a fresh handshake to generativelanguage.googleapis.com on every request.
+
+Two implementations are available, chosen at startup with GEMINI_TRANSPORT:
+"requests" (the default, _requests_transport) and "http.client"
+(_httpclient_transport), a stdlib-only transport that avoids importing the requests
+stack. GEMINI_CASSETTE_MODE wraps the transport to record upstream traffic, or replaces
+it to replay recorded traffic (see _cassette). All of them provide:
+
+    post(url, json=None, headers=None, timeout=None, stream=False) -> response
+    errors            TransportErrors: the exception types the transport raises
+    connect_timeout, read_timeout, snapshot(), close()
+
+and responses with the subset of the requests.Response API the app uses:
+status_code, headers (case-insensitive), ok, content, text, json(),
+raise_for_status(), iter_lines(chunk_size=None) and close().
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+
+log = logging.getLogger("metraplan.transport")
+
+
+# HTTPError carries the failed response; SSLError must be checked before ConnectionError,
+# which it may subclass; ProtocolError covers truncated or malformed responses.
+TransportErrors = namedtuple("TransportErrors", "HTTPError ConnectionError Timeout SSLError ProtocolError")
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 60.0
+DEFAULT_DNS_TTL = 300.0
+
+
+class TransportStats:
+    """Thread-safe counters for requests sent and connections opened."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.dns_lookups = 0
+        self.dns_cache_hits = 0
+
+    def incr(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                # Every request that did not need a new socket was served from the pool.
+                "pool_hits": max(self.requests - self.new_connections, 0),
+                "dns_lookups": self.dns_lookups,
+                "dns_cache_hits": self.dns_cache_hits,
+            }
+
+
+class DNSCache:
+    """Caches getaddrinfo() results for a fixed TTL."""
+
+    def __init__(self, ttl, stats):
+        self.ttl = ttl
+        self._stats = stats
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def resolve(self, host, port):
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._stats.incr("dns_cache_hits")
+                return entry[1]
+
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        self._stats.incr("dns_lookups")
+        address = infos[0][4][:2]
+        with self._lock:
+            self._entries[key] = (now + self.ttl, address)
+        return address
+
+    def invalidate(self, host, port):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+def _create_transport(name):
+    cassette_mode = os.getenv("GEMINI_CASSETTE_MODE", "").strip().lower()
+    if cassette_mode in ("record", "replay"):
+        from _cassette import cassette_transport
+        return cassette_transport(cassette_mode, lambda: _create_network_transport(name))
+    if cassette_mode:
+        log.warning("Unknown GEMINI_CASSETTE_MODE; not recording", extra={"mode": cassette_mode})
+    return _create_network_transport(name)
+
+
+def _create_network_transport(name):
+    if name == "http.client":
+        from _httpclient_transport import HTTPClientTransport
+        return HTTPClientTransport()
+    if name != "requests":
+        log.warning("Unknown GEMINI_TRANSPORT; using requests", extra={"transport": name})
+    from _requests_transport import RequestsTransport
+    return RequestsTransport()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """Returns the process-wide transport, creating it on first use."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = _create_transport(os.getenv("GEMINI_TRANSPORT", "requests").strip().lower())
+    return _transport
+
+
+def current_transport():
+    """The process-wide transport, or None if no upstream call has created it yet."""
+    return _transport
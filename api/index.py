@@ -1,19 +1,62 @@
 
 import os
-import requests
+import sys
+import functools
 import json
-from flask import Flask, request, jsonify, send_from_directory
-from dotenv import load_dotenv
+import logging
+import threading
+import time
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
 
-# Load environment variables from .env file for local development
-load_dotenv()
+# Make the helper modules next to this file importable both locally and on Vercel
+basedir = os.path.abspath(os.path.dirname(__file__))
+if basedir not in sys.path:
+    sys.path.insert(0, basedir)
+
+from _admin import ADMIN_TOKEN, is_admin, verify_signature
+from _breaker import CLOSED, CircuitBreaker, CircuitOpen
+from _canonical import canonicalize_goal
+from _config import env_number
+from _fallback import goal_similarity, local_fallback_plan, LOCAL_TEMPLATE, NEAREST_CACHE
+from _hedge import Hedger
+from _log import LogPipeline, get_request_id, new_request_id, set_request_id
+from _memory import MemoryTracker, deep_sizeof, process_memory
+from _metrics import COUNTER, GAUGE, LATENCY_BUCKETS, MetricsRegistry
+from _plan_cache import PlanCache, HIT, MISS, STALE, make_cache_key
+from _retry import RetryPolicy, is_retryable_status
+from _sampler import SamplingProfiler
+from _scheduler import UpstreamBusy, UpstreamScheduler
+from _stream_parser import JSONArrayStreamParser, iter_sse_texts
+from _singleflight import SingleFlight, SingleFlightTimeout
+from _timing import StageHistograms, add_stage, finish_request, stage_seconds, stage_span, start_request
+from _tracing import CLIENT, Tracer, bind_context, current_span, trace_span
+from _transport import current_transport, get_transport
+
+# The upstream transport (with `requests` by default), dotenv, asyncio and
+# concurrent.futures are imported where they are first needed rather than here,
+# keeping them out of the serverless cold start; so is the cProfile-based request
+# profiler, which only exists with ADMIN_TOKEN. The helper modules follow the same
+# rule, which is why they import these inside functions. bench/bench_import.py checks
+# that none of them is imported at cold start.
+
+# Load environment variables from .env file for local development; Vercel has none
+if not os.getenv("VERCEL"):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# Structured JSON logs, written to stdout by a background thread
+log_pipeline = LogPipeline()
+log = logging.getLogger("metraplan.app")
 
 # Initialize the Flask application
 app = Flask(__name__)
 
 # Enable CORS. This is necessary for local testing and doesn't harm the Vercel deployment.
-CORS(app)
+# Diagnostic response headers are exposed so cross-origin clients can read them too;
+# the ASGI entry point sends the same list.
+EXPOSE_HEADERS = ["X-Plan-Cache", "X-Plan-Degraded", "Retry-After", "Server-Timing", "X-Request-ID", "X-Profile-ID"]
+CORS(app, expose_headers=EXPOSE_HEADERS)
 
 # --- LLM Integration ---
 # (The prompt is simplified as the schema now handles the strict output requirement)
@@ -21,91 +64,860 @@ DEFAULT_PROMPT_TEMPLATE = """
 You are a world-class project manager AI. Your task is to break down a user's goal into a detailed project plan. Analyze the following goal and decompose it into a series of actionable tasks. For each task, provide a concise name, a brief description, a list of dependencies (using the 'id' of other tasks), and an estimated timeline. The user's goal is: '{goal_text}'.
 """
 
-def generate_plan_with_llm(goal_text, prompt_template=None):
+GEMINI_MODEL = "gemini-2.5-flash-preview-05-20"
+
+# Overridable so the app can be pointed at a local stand-in for offline testing
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com").rstrip("/")
+
+# The desired JSON structure for the model
+RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "id": {"type": "integer", "description": "Unique integer ID for the task, starting from 1"},
+            "taskName": {"type": "string", "description": "A short, clear name for the task"},
+            "description": {"type": "string", "description": "A one-sentence description of what needs to be done"},
+            "dependencies": {"type": "array", "items": {"type": "integer"}, "description": "Array of integer IDs of tasks that must be completed first"},
+            "timeline": {"type": "string", "description": "A suggested duration or deadline, e.g., 'Day 1-2' or 'By Oct 15'"}
+        },
+        "required": ["id", "taskName", "description", "dependencies", "timeline"]
+    }
+}
+
+# JSON Mode: 'generationConfig' is the correct field name instead of 'config'
+GENERATION_CONFIG = {
+    "responseMimeType": "application/json",
+    "responseSchema": RESPONSE_SCHEMA
+}
+
+# Shared across requests (and warm serverless invocations) of this process
+plan_cache = PlanCache()
+
+# Concurrent requests for the same plan share a single upstream call
+inflight_plans = SingleFlight()
+PLAN_COALESCE_TIMEOUT = env_number("PLAN_COALESCE_TIMEOUT", 90.0)
+
+# Keeps upstream calls within the Gemini RPM/TPM quota by queueing them briefly
+upstream_scheduler = UpstreamScheduler()
+
+# Retries transient upstream failures with jittered backoff within a request deadline
+retry_policy = RetryPolicy(lambda error: classify_upstream_error(error))
+
+# Opt-in (GEMINI_HEDGE=1): duplicates upstream calls slower than the recent p90
+hedger = Hedger()
+
+# Fails fast (and serves degraded plans) while the upstream is down or very slow
+circuit_breaker = CircuitBreaker()
+FALLBACK_MIN_SIMILARITY = env_number("PLAN_FALLBACK_SIMILARITY", 0.5)
+
+# Where each request's time went, per stage; SERVER_TIMING=0 keeps it out of the response headers
+stage_histograms = StageHistograms()
+SERVER_TIMING = bool(env_number("SERVER_TIMING", 1, int))
+
+# Sampled request traces, linked to the caller's traceparent; off unless TRACE_EXPORTER is set
+tracer = Tracer()
+
+# Opt-in cProfile of single requests (needs ADMIN_TOKEN); without it nothing is wrapped
+if ADMIN_TOKEN:
+    from _profiler import RequestProfiler, pstats_report
+    request_profiler = RequestProfiler()
+else:
+    request_profiler = None
+
+# Always-on CPU sampling of all threads (needs ADMIN_TOKEN to be served; PROFILER_HZ=0 turns it off)
+sampling_profiler = SamplingProfiler().start() if ADMIN_TOKEN else None
+
+# tracemalloc diffs around plan generation, JSON decoding and jsonify (MEMORY_TRACKING=1, needs ADMIN_TOKEN)
+memory_tracker = MemoryTracker(enabled=ADMIN_TOKEN is not None and bool(env_number("MEMORY_TRACKING", 0, int)))
+
+# Prometheus metrics served by /api/metrics; recording them takes no lock
+metrics = MetricsRegistry(prefix="metraplan_")
+http_requests = metrics.counter("http_requests_total", "HTTP requests by endpoint and status code",
+                                ("endpoint", "status"))
+http_request_duration = metrics.histogram("http_request_duration_seconds",
+                                          "Time until the response headers were sent, by endpoint",
+                                          LATENCY_BUCKETS, ("endpoint",))
+http_requests_in_flight = metrics.gauge("http_requests_in_flight", "Requests being handled")
+upstream_duration = metrics.histogram("upstream_request_duration_seconds",
+                                      "Gemini API attempts by method and HTTP status ('error' if there was no answer)",
+                                      LATENCY_BUCKETS, ("method", "status"))
+upstream_in_flight = metrics.gauge("upstream_requests_in_flight", "Gemini API attempts in progress")
+upstream_rate_limited = metrics.counter("upstream_rate_limited_total", "Gemini API attempts answered with 429")
+llm_tokens = metrics.counter("llm_tokens_total", "Tokens used according to Gemini's usageMetadata, by kind",
+                             ("kind",))
+llm_failures = metrics.counter("llm_failures_total", "Plan generations that failed, by reason", ("reason",))
+metrics.callback("plan_cache_lookups_total", COUNTER, "Plan cache lookups by result", lambda: {
+    (HIT,): plan_cache.hits, (MISS,): plan_cache.misses, (STALE,): plan_cache.stale}, ("result",))
+metrics.callback("plan_cache_hit_ratio", GAUGE, "Share of plan cache lookups that were fresh hits",
+                 lambda: {(): plan_cache.snapshot()["hit_ratio"]})
+metrics.callback("upstream_retries_total", COUNTER, "Gemini API attempts that were retries",
+                 lambda: {(): retry_policy.stats.retries})
+metrics.callback("upstream_queue_rejected_total", COUNTER, "Requests refused because the quota queue was full",
+                 lambda: {(): upstream_scheduler.rejected})
+metrics.callback("log_records_dropped_total", COUNTER, "Log records dropped because the log queue was full",
+                 lambda: {(): log_pipeline.handler.dropped})
+metrics.callback("log_records_suppressed_total", COUNTER, "Repeated warnings and errors left out by log sampling",
+                 lambda: {(): log_pipeline.sampler.suppressed})
+metrics.callback("circuit_breaker_open", GAUGE, "1 while the upstream circuit breaker is open or half-open",
+                 lambda: {(): int(circuit_breaker.state != CLOSED)})
+
+# usageMetadata field -> llm_tokens_total kind
+TOKEN_USAGE_FIELDS = {"promptTokenCount": "prompt", "candidatesTokenCount": "output",
+                      "thoughtsTokenCount": "thoughts", "totalTokenCount": "total"}
+
+# Batch requests fan out to the LLM through one bounded pool shared by all batches
+BATCH_MAX_GOALS = env_number("BATCH_MAX_GOALS", 500, int)
+BATCH_MAX_WORKERS = env_number("BATCH_MAX_WORKERS", 8, int)
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+def get_batch_executor():
     """
-    Calls the Gemini API with a specific prompt and JSON Mode to break down a goal into a JSON plan.
+    The thread pool shared by all batch requests, created by the first one.
     """
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("Error: GEMINI_API_KEY is not set.")
-        return None
+    global _batch_executor
+    if _batch_executor is None:
+        with _batch_executor_lock:
+            if _batch_executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="plan-batch")
+    return _batch_executor
+
+def gemini_api_url(method, api_key):
+    """
+    Builds the Gemini REST URL for a model method such as 'generateContent'.
+    """
+    url = f"{GEMINI_API_BASE}/v1beta/models/{GEMINI_MODEL}:{method}?key={api_key}"
+    if method == "streamGenerateContent":
+        # Server-sent events instead of one long JSON array of chunks
+        url += "&alt=sse"
+    return url
 
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={api_key}"
-    
+def build_gemini_payload(goal_text, prompt_template=None):
+    """
+    Builds the request body: the prompt plus JSON Mode with the plan schema.
+    """
     prompt = (prompt_template or DEFAULT_PROMPT_TEMPLATE).format(goal_text=goal_text)
-    
-    # 1. Define the desired JSON structure for the model
-    response_schema = {
-        "type": "array",
-        "items": {
-            "type": "object",
-            "properties": {
-                "id": {"type": "integer", "description": "Unique integer ID for the task, starting from 1"},
-                "taskName": {"type": "string", "description": "A short, clear name for the task"},
-                "description": {"type": "string", "description": "A one-sentence description of what needs to be done"},
-                "dependencies": {"type": "array", "items": {"type": "integer"}, "description": "Array of integer IDs of tasks that must be completed first"},
-                "timeline": {"type": "string", "description": "A suggested duration or deadline, e.g., 'Day 1-2' or 'By Oct 15'"}
-            },
-            "required": ["id", "taskName", "description", "dependencies", "timeline"]
-        }
-    }
-    
-    # 2. Configure the payload to use JSON Mode and the schema
-    #    FIX: 'generationConfig' is the correct field name instead of 'config'
-    payload = {
+    return {
         "contents": [{"parts": [{"text": prompt}]}],
-        "generationConfig": {
-            "responseMimeType": "application/json",
-            "responseSchema": response_schema
-        }
+        "generationConfig": GENERATION_CONFIG
     }
 
+def extract_plan(response_json):
+    """
+    Pulls the plan out of a generateContent response, or returns None if there is no candidate.
+    """
+    if 'candidates' in response_json and len(response_json['candidates']) > 0:
+        # Parsing logic is simple as JSON Mode guarantees a clean JSON string
+        json_text = response_json['candidates'][0]['content']['parts'][0]['text']
+        return json.loads(json_text)
+    llm_failures.inc("no_candidates")
+    log.error("Gemini response did not contain any candidates")
+    return None
+
+def retry_after_seconds(header_value, default=5.0):
+    """
+    Parses a Retry-After header given in seconds; HTTP-date values fall back to the default.
+    """
+    try:
+        return max(0.0, float(header_value))
+    except (TypeError, ValueError):
+        return default
+
+def classify_upstream_error(error):
+    """
+    Retry classification for upstream failures: (retryable, retry_after_seconds_or_None).
+    Throttling, 5xx responses, timeouts and dropped connections are worth another attempt.
+    """
+    errors = get_transport().errors
+    if isinstance(error, errors.HTTPError):
+        response = error.response
+        return is_retryable_status(response.status_code), retry_after_seconds(response.headers.get('Retry-After'), None)
+    if isinstance(error, errors.SSLError):
+        return False, None
+    if isinstance(error, (errors.ConnectionError, errors.Timeout, errors.ProtocolError)):
+        return True, None
+    return False, None
+
+def estimate_payload_tokens(payload):
+    """
+    Tokens reserved against the TPM budget for one call with this payload.
+    """
+    return upstream_scheduler.estimate(payload["contents"][0]["parts"][0]["text"])
+
+def record_token_usage(usage, estimated_tokens):
+    """
+    Counts the tokens of a call's usageMetadata and corrects its TPM reservation.
+    """
+    for field, kind in TOKEN_USAGE_FIELDS.items():
+        if usage.get(field):
+            llm_tokens.inc(kind, amount=usage[field])
+    upstream_scheduler.settle(estimated_tokens, usage.get('totalTokenCount'))
+
+def post_to_gemini(api_url, payload, deadline, stream=False):
+    """
+    One upstream attempt: waits for quota, POSTs over the pooled transport and raises
+    for HTTP errors. The read timeout never extends past the request deadline.
+    """
+    # Waits for RPM/TPM budget; raises UpstreamBusy if that would take too long
+    estimated_tokens = estimate_payload_tokens(payload)
+    with stage_span("queue"):
+        upstream_scheduler.acquire(estimated_tokens, deadline)
+
+    transport = get_transport()
+    read_timeout = max(0.1, min(transport.read_timeout, deadline - time.monotonic()))
     headers = {'Content-Type': 'application/json'}
 
+    method = "streamGenerateContent" if stream else "generateContent"
+    status = "error"
+    upstream_in_flight.inc()
+    # Pooled keep-alive transport: reuses TCP+TLS connections across requests.
+    # The body is always streamed so waiting for the first byte and downloading the rest
+    # are timed separately; connecting is timed by the transport.
+    connect_before = stage_seconds("connect")
+    started = time.perf_counter()
     try:
-        response = requests.post(api_url, headers=headers, json=payload, timeout=60)
+        response = transport.post(api_url, headers=headers, json=payload, stream=True,
+                                  timeout=(transport.connect_timeout, read_timeout))
+        add_stage("ttfb", time.perf_counter() - started - (stage_seconds("connect") - connect_before))
+        status = str(response.status_code)
+        if response.status_code == 429:
+            upstream_rate_limited.inc()
+            upstream_scheduler.backoff(retry_after_seconds(response.headers.get('Retry-After')))
+        if not response.ok:
+            # Read the (small) error body now so it can still be logged and the connection reused
+            _ = response.content
         response.raise_for_status()
-        response_json = response.json()
+        if stream:
+            return response
 
-        if 'candidates' in response_json and len(response_json['candidates']) > 0:
-            # Parsing logic is simple as JSON Mode guarantees a clean JSON string
-            json_text = response_json['candidates'][0]['content']['parts'][0]['text']
-            plan = json.loads(json_text)
-            return plan
-        else:
-            print("API response did not contain any valid candidates.")
+        with stage_span("download"):
+            _ = response.content
+        with memory_tracker.measure("decode_response"), stage_span("decode"):
+            response_json = response.json()
+    except Exception:
+        upstream_scheduler.release(estimated_tokens)
+        raise
+    finally:
+        upstream_in_flight.dec()
+        upstream_duration.observe(time.perf_counter() - started, method, status)
+        current_span().set("upstream.status", status)
+
+    record_token_usage(response_json.get('usageMetadata', {}), estimated_tokens)
+    return response_json
+
+def is_upstream_failure(error):
+    """
+    Circuit breaker classification: True if the error points at an unhealthy upstream,
+    False if the upstream answered sensibly, None if it says nothing either way.
+    """
+    if isinstance(error, (UpstreamBusy, CircuitOpen)):
+        return None
+    if isinstance(error, get_transport().errors.HTTPError):
+        status = error.response.status_code
+        if status == 429:
             return None
-    except requests.exceptions.HTTPError as http_err:
-        print(f"HTTP error occurred: {http_err}")
-        # Print the response text for better debugging
-        print(f"API Response Text: {response.text}")
+        return status >= 500
+    return True
+
+def call_gemini(api_url, payload, deadline, stream=False):
+    """
+    post_to_gemini traced as one upstream attempt.
+    """
+    with trace_span("gemini.attempt", CLIENT, stream=stream):
+        return post_to_gemini(api_url, payload, deadline, stream)
+
+def call_gemini_with_retries(attempt):
+    """
+    Runs attempt(deadline) with retries behind the circuit breaker. The breaker records
+    one outcome per logical call, once the retries are over, so a single failing
+    request does not count as several failures.
+    """
+    return circuit_breaker.call(lambda: retry_policy.call(attempt), is_upstream_failure)
+
+def log_upstream_http_error(http_err):
+    """
+    Logs a failed upstream call with its status and (truncated) response body.
+    """
+    log.error("Gemini request failed", extra={"status": http_err.response.status_code, "error": str(http_err),
+                                              "response": http_err.response.text})
+
+def raise_if_throttled(status, retry_after_header):
+    """
+    Still throttled once the retries ran out: raises UpstreamBusy so the client gets
+    a 503 with the upstream's Retry-After instead of a generic 500.
+    """
+    if status == 429:
+        raise UpstreamBusy(retry_after_seconds(retry_after_header))
+
+def generate_plan_with_llm(goal_text, prompt_template=None):
+    """
+    Calls the Gemini API with a specific prompt and JSON Mode to break down a goal into a JSON plan.
+    Transient upstream failures are retried within the request deadline, and slow
+    attempts may be hedged with a duplicate request.
+    """
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        llm_failures.inc("missing_api_key")
+        log.error("GEMINI_API_KEY is not set")
+        return None
+
+    api_url = gemini_api_url("generateContent", api_key)
+    payload = build_gemini_payload(goal_text, prompt_template)
+    errors = get_transport().errors
+
+    try:
+        with stage_span("upstream"):
+            response_json = call_gemini_with_retries(
+                lambda deadline: hedger.call(bind_context(lambda: call_gemini(api_url, payload, deadline))))
+        with memory_tracker.measure("decode_plan"), stage_span("decode"):
+            return extract_plan(response_json)
+    except (UpstreamBusy, CircuitOpen):
+        raise
+    except errors.HTTPError as http_err:
+        llm_failures.inc(f"http_{http_err.response.status_code}")
+        log_upstream_http_error(http_err)
+        raise_if_throttled(http_err.response.status_code, http_err.response.headers.get('Retry-After'))
         return None
     except json.JSONDecodeError as json_err:
-        print(f"Failed to decode JSON from API response: {json_err}")
+        llm_failures.inc("invalid_json")
+        log.error("Gemini returned a plan that is not valid JSON", extra={"error": str(json_err)})
+        return None
+    except Exception as e:
+        llm_failures.inc(type(e).__name__)
+        log.error("Unexpected error while generating a plan", exc_info=True)
+        return None
+
+def stream_plan_with_llm(goal_text, prompt_template=None):
+    """
+    Calls Gemini's streamGenerateContent and returns a generator that yields each task
+    as soon as its JSON object is complete, or None if the upstream call could not be started.
+    Opening the stream is retried like a regular call; once tasks flow it is not.
+    """
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        llm_failures.inc("missing_api_key")
+        log.error("GEMINI_API_KEY is not set")
+        return None
+
+    api_url = gemini_api_url("streamGenerateContent", api_key)
+    payload = build_gemini_payload(goal_text, prompt_template)
+    errors = get_transport().errors
+
+    try:
+        response = call_gemini_with_retries(lambda deadline: call_gemini(api_url, payload, deadline, stream=True))
+    except (UpstreamBusy, CircuitOpen):
+        raise
+    except errors.HTTPError as http_err:
+        llm_failures.inc(f"http_{http_err.response.status_code}")
+        log_upstream_http_error(http_err)
+        raise_if_throttled(http_err.response.status_code, http_err.response.headers.get('Retry-After'))
         return None
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+        llm_failures.inc(type(e).__name__)
+        log.error("Unexpected error while opening a plan stream", exc_info=True)
         return None
 
+    def tasks():
+        parser = JSONArrayStreamParser()
+        usage = {}
+        try:
+            # chunk_size=None hands over each network chunk as soon as it arrives
+            for text in iter_sse_texts(response.iter_lines(chunk_size=None), usage):
+                yield from parser.feed(text)
+            if not parser.finished:
+                raise ValueError("Upstream stream ended before the plan was complete")
+        finally:
+            response.close()
+            # The usage arrives with the last chunks, so only a complete stream settles exactly
+            record_token_usage(usage, estimate_payload_tokens(payload))
+
+    return tasks()
+
+def plan_cache_key(goal_text, prompt_template=None):
+    """
+    Cache key covering everything that influences the generated plan.
+    The goal is canonicalized first so trivially different phrasings share one entry.
+    """
+    return make_cache_key(canonicalize_goal(goal_text), prompt_template or DEFAULT_PROMPT_TEMPLATE, GEMINI_MODEL,
+                          RESPONSE_SCHEMA, GENERATION_CONFIG)
+
+def generate_plan_cached(goal_text, prompt_template=None):
+    """
+    Serves the plan from the plan cache when possible, otherwise calls the LLM.
+    Returns a (plan, cache_status) tuple; see regenerate_plan for the miss path.
+    """
+    with stage_span("cache"):
+        key = plan_cache_key(goal_text, prompt_template)
+        cached_plan, status = plan_cache.get(key)
+    if cached_plan is not None and status != STALE:
+        return cached_plan, status
+    return regenerate_plan(key, goal_text, prompt_template, stale_plan=cached_plan)
+
+def regenerate_plan(key, goal_text, prompt_template=None, stale_plan=None):
+    """
+    Calls the LLM for a plan that missed the cache and stores the result.
+    Identical concurrent misses are coalesced so only one of them calls the LLM.
+    Returns a (plan, cache_status) tuple; the stale plan is only used if regeneration fails.
+    Raises SingleFlightTimeout if a coalesced request waits longer than PLAN_COALESCE_TIMEOUT,
+    and UpstreamBusy or CircuitOpen if the upstream cannot be called and there is no stale
+    plan to serve.
+    """
+    def generate():
+        with memory_tracker.measure("generate"):
+            plan = generate_plan_with_llm(goal_text, prompt_template)
+        if plan:
+            plan_cache.set(key, plan, label=canonicalize_goal(goal_text))
+        return plan
+
+    started = time.perf_counter()
+    try:
+        plan, shared = inflight_plans.do(key, generate, timeout=PLAN_COALESCE_TIMEOUT)
+        if shared:
+            # Time spent waiting for an identical request's upstream call
+            add_stage("coalesce", time.perf_counter() - started)
+    except (UpstreamBusy, CircuitOpen):
+        if stale_plan is None:
+            raise
+        return stale_plan, STALE
+    if plan:
+        return plan, MISS
+    if stale_plan is not None:
+        return stale_plan, STALE
+    return None, MISS
+
+def open_plan_stream(key, goal_text):
+    """
+    Tasks of a plan that missed the cache, as (tasks, call). The first request for the key
+    streams them from the LLM and gets its single-flight call, which it must finish with
+    the complete plan (None if the stream broke off). Identical requests arriving
+    meanwhile, streamed or not, wait for that plan and replay it; their call is None.
+    tasks is None if the upstream call failed. Raises like regenerate_plan.
+    """
+    call, leader = inflight_plans.begin(key)
+    if not leader:
+        started = time.perf_counter()
+        plan = inflight_plans.wait(call, PLAN_COALESCE_TIMEOUT)
+        add_stage("coalesce", time.perf_counter() - started)
+        return (iter(plan) if plan else None), None
+    try:
+        tasks = stream_plan_with_llm(goal_text)
+    except BaseException as e:
+        inflight_plans.finish(key, call, error=e)
+        raise
+    if tasks is None:
+        inflight_plans.finish(key, call, None)
+        return None, None
+    return tasks, call
+
+def degraded_plan(goal_text):
+    """
+    Plan served while the upstream circuit is open: the cached plan of the most similar
+    goal if there is one, otherwise a generic locally built plan. Returns (plan, source).
+    """
+    nearest = plan_cache.nearest(canonicalize_goal(goal_text), goal_similarity, FALLBACK_MIN_SIMILARITY)
+    if nearest is not None:
+        return nearest[0], NEAREST_CACHE
+    return local_fallback_plan(goal_text), LOCAL_TEMPLATE
+
+def degraded_response(goal_text):
+    """
+    200 with a degraded plan, flagged through the X-Plan-Degraded header.
+    """
+    plan, source = degraded_plan(goal_text)
+    response = jsonify(plan)
+    response.headers['X-Plan-Degraded'] = source
+    return response
+
+def busy_response(busy):
+    """
+    503 telling the client when the upstream quota will have room again.
+    """
+    response = jsonify({"error": "The planner is busy right now. Please try again shortly."})
+    response.status_code = 503
+    response.headers['Retry-After'] = busy.retry_after_header
+    return response
+
+def request_started(method, route, endpoint, headers):
+    """
+    Starts a request's telemetry: its request ID, stage timer, memory tracking and
+    trace span. Shared by the Flask hooks below and the ASGI entry point; `headers`
+    is any mapping whose get() takes lower-case header names.
+    """
+    http_requests_in_flight.inc()
+    # Vercel tags every invocation with x-vercel-id; a client's own X-Request-ID wins
+    set_request_id(new_request_id(headers.get('x-request-id') or headers.get('x-vercel-id')))
+    start_request()
+    memory_tracker.begin(endpoint)
+    tracer.start_request(f"{method} {route}", headers.get('traceparent'),
+                         {"http.method": method, "http.route": route, "request_id": get_request_id()})
+
+def request_answered(endpoint, status):
+    """
+    Records the metrics and stage histograms of a request whose response is about to
+    be sent, and returns the telemetry headers to add to it. For streamed responses
+    the duration is the time until the headers are sent.
+    """
+    timer = finish_request()
+    headers = {'X-Request-ID': get_request_id()}
+    http_requests.inc(endpoint, str(status))
+    current_span().set("http.status_code", status)
+    if timer is not None:
+        total = timer.elapsed()
+        http_request_duration.observe(total, endpoint)
+        stage_histograms.record(endpoint, timer, total)
+        if SERVER_TIMING:
+            headers['Server-Timing'] = timer.server_timing(total)
+    return headers
+
+def request_finished(error=None):
+    """
+    Ends a request's telemetry once its response, including a streamed body, is sent.
+    """
+    http_requests_in_flight.dec()
+    set_request_id(None)
+    memory_tracker.begin(None)
+    tracer.finish_request(error)
+
+@app.before_request
+def start_request_telemetry():
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    request_started(request.method, route, request.endpoint, request.headers)
+
+@app.after_request
+def report_request_telemetry(response):
+    """
+    Adds the Server-Timing and X-Request-ID headers and records the request's metrics.
+    """
+    response.headers.update(request_answered(request.endpoint or "unmatched", response.status_code))
+    return response
+
+@app.teardown_request
+def end_request_telemetry(error=None):
+    # For streamed responses this runs once the body has been sent
+    request_finished(error)
+
 # --- API Endpoint (Works everywhere) ---
 @app.route('/api/generate-plan', methods=['POST'])
 def generate_plan_endpoint():
     """
     API endpoint to generate a project plan.
     """
-    data = request.get_json()
-    if not data or 'goal' not in data:
+    with stage_span("parse"):
+        data = request.get_json()
+    if not isinstance(data, dict) or not isinstance(data.get('goal'), str) or not data['goal'].strip():
         return jsonify({"error": "Missing 'goal' in request body"}), 400
 
-    plan = generate_plan_with_llm(data['goal'])
+    try:
+        plan, cache_status = generate_plan_cached(data['goal'])
+    except SingleFlightTimeout as e:
+        return jsonify({"error": str(e)}), 504
+    except UpstreamBusy as e:
+        return busy_response(e)
+    except CircuitOpen:
+        return degraded_response(data['goal'])
 
     if plan:
-        return jsonify(plan)
+        with memory_tracker.measure("jsonify"), stage_span("jsonify"):
+            response = jsonify(plan)
+        response.headers['X-Plan-Cache'] = cache_status
+        return response
     else:
         # The 500 status will correctly trigger the frontend error display
         return jsonify({"error": "Failed to generate plan from LLM. Check server logs for API errors or JSON parsing issues."}), 500
 
 
+def profiled(view):
+    """
+    Runs the view under cProfile when the request carries a signed X-Profile header
+    or is sampled; the profile can then be fetched by the X-Profile-ID it returns.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        trigger = request_profiler.trigger(verify_signature(request.headers.get('X-Profile')))
+        if trigger is None:
+            return view(*args, **kwargs)
+        result, profile_id = request_profiler.run(lambda: view(*args, **kwargs), get_request_id(),
+                                                  request.endpoint, trigger)
+        response = app.make_response(result)
+        if profile_id is not None:
+            response.headers['X-Profile-ID'] = profile_id
+        return response
+    return wrapper
+
+if request_profiler is not None:
+    app.view_functions['generate_plan_endpoint'] = profiled(generate_plan_endpoint)
+
+
+@app.route('/api/generate-plan/stream', methods=['POST'])
+def generate_plan_stream_endpoint():
+    """
+    Streams the plan one task at a time as NDJSON (default) or as server-sent events
+    (when the client accepts text/event-stream or passes ?format=sse). Identical
+    concurrent misses share one upstream stream (see open_plan_stream).
+    """
+    data = request.get_json()
+    if not isinstance(data, dict) or not isinstance(data.get('goal'), str) or not data['goal'].strip():
+        return jsonify({"error": "Missing 'goal' in request body"}), 400
+
+    use_sse = request.args.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+    goal = data['goal']
+    key = plan_cache_key(goal)
+
+    degraded_source = None
+    flight = None   # set while this request leads the upstream stream for the key
+    cached_plan, cache_status = plan_cache.get(key)
+    if cached_plan is not None and cache_status != STALE:
+        tasks = iter(cached_plan)
+    else:
+        try:
+            tasks, flight = open_plan_stream(key, goal)
+        except SingleFlightTimeout as e:
+            return jsonify({"error": str(e)}), 504
+        except UpstreamBusy as e:
+            if cached_plan is None:
+                return busy_response(e)
+            tasks = None
+        except CircuitOpen:
+            tasks = None
+            if cached_plan is None:
+                cached_plan, degraded_source = degraded_plan(goal)
+        if tasks is not None:
+            cache_status = MISS
+        elif cached_plan is not None:
+            tasks = iter(cached_plan)
+        else:
+            return jsonify({"error": "Failed to generate plan from LLM. Check server logs for API errors or JSON parsing issues."}), 500
+
+    def encode(event, item):
+        if use_sse:
+            return f"event: {event}\ndata: {json.dumps(item)}\n\n"
+        return json.dumps(item) + "\n"
+
+    def body():
+        plan = []
+        try:
+            for task in tasks:
+                plan.append(task)
+                yield encode("task", task)
+            if flight is not None and plan:
+                plan_cache.set(key, plan, label=canonicalize_goal(goal))
+                inflight_plans.finish(key, flight, plan)
+        except Exception as e:
+            # Headers are already sent, so the failure is reported in-band
+            log.warning("Plan stream interrupted", extra={"tasks_sent": len(plan), "error": str(e)})
+            yield encode("error", {"error": "The plan stream was interrupted. Please try again."})
+            return
+        finally:
+            if flight is not None:
+                # A stream that broke off leaves the followers to fall back as after a failed call
+                inflight_plans.finish(key, flight, None)
+        if use_sse:
+            yield encode("done", {"tasks": len(plan)})
+
+    response = Response(stream_with_context(body()), mimetype="text/event-stream" if use_sse else "application/x-ndjson")
+    if flight is not None:
+        # Releases the followers even if the body is never sent
+        response.call_on_close(lambda: inflight_plans.finish(key, flight, None))
+    if degraded_source:
+        response.headers['X-Plan-Degraded'] = degraded_source
+    else:
+        response.headers['X-Plan-Cache'] = cache_status
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/api/generate-plans', methods=['POST'])
+def generate_plans_batch_endpoint():
+    """
+    Batch endpoint: {"goals": [...]} in, one result per goal out, in input order.
+    Duplicate goals are generated once, cached plans are served immediately and the rest
+    fan out to the LLM through a bounded worker pool. With ?format=ndjson (or an
+    Accept: application/x-ndjson header) results are streamed in completion order instead.
+    """
+    data = request.get_json()
+    goals = data.get('goals') if isinstance(data, dict) else None
+    if not isinstance(goals, list) or not goals:
+        return jsonify({"error": "Missing 'goals' list in request body"}), 400
+    if len(goals) > BATCH_MAX_GOALS:
+        return jsonify({"error": f"Too many goals: at most {BATCH_MAX_GOALS} per request"}), 413
+
+    stream = request.args.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+
+    invalid = []        # (indexes, result) pairs for goals that were rejected
+    cached = {}         # cache key -> (indexes, result) for plans served from the cache
+    pending = {}        # cache key -> (indexes, goal, stale plan) for plans to generate
+    for i, goal in enumerate(goals):
+        if not isinstance(goal, str) or not goal.strip():
+            invalid.append(([i], {"status": "error", "error": "Goal must be a non-empty string"}))
+            continue
+        key = plan_cache_key(goal)
+        if key in cached:
+            cached[key][0].append(i)
+        elif key in pending:
+            pending[key][0].append(i)
+        else:
+            cached_plan, cache_status = plan_cache.get(key)
+            if cached_plan is not None and cache_status != STALE:
+                cached[key] = ([i], {"status": "ok", "cache": cache_status, "plan": cached_plan})
+            else:
+                pending[key] = ([i], goal, cached_plan)
+
+    request_id = get_request_id()
+    endpoint = request.endpoint
+
+    def generate(key, goal, stale_plan):
+        # Runs on the batch pool; its log records and memory steps belong to this request
+        set_request_id(request_id)
+        memory_tracker.begin(endpoint)
+        try:
+            plan, cache_status = regenerate_plan(key, goal, stale_plan=stale_plan)
+        except SingleFlightTimeout as e:
+            return {"status": "error", "error": str(e)}
+        except UpstreamBusy as e:
+            return {"status": "error", "error": str(e), "retry_after": e.retry_after_header}
+        except CircuitOpen:
+            plan, source = degraded_plan(goal)
+            return {"status": "ok", "degraded": source, "plan": plan}
+        if plan:
+            return {"status": "ok", "cache": cache_status, "plan": plan}
+        return {"status": "error", "error": "Failed to generate plan from LLM."}
+
+    from concurrent.futures import as_completed
+
+    futures = {
+        get_batch_executor().submit(bind_context(generate), key, goal, stale_plan): indexes
+        for key, (indexes, goal, stale_plan) in pending.items()
+    }
+
+    def completed():
+        yield from invalid
+        yield from cached.values()
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    if stream:
+        def body():
+            for indexes, result in completed():
+                for i in indexes:
+                    yield json.dumps({"index": i, "goal": goals[i], **result}) + "\n"
+        return Response(stream_with_context(body()), mimetype="application/x-ndjson",
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    results = [None] * len(goals)
+    for indexes, result in completed():
+        for i in indexes:
+            results[i] = {"goal": goals[i], **result}
+    with memory_tracker.measure("jsonify"):
+        return jsonify({"results": results})
+
+
+@app.route('/api/stats', methods=['GET'])
+def stats_endpoint():
+    """
+    Exposes internal counters (e.g. connection reuse) for diagnostics.
+    """
+    return jsonify({
+        # None until the first upstream call has created the transport
+        "transport": current_transport().snapshot() if current_transport() else None,
+        "plan_cache": plan_cache.snapshot(),
+        "single_flight": inflight_plans.snapshot(),
+        "scheduler": upstream_scheduler.snapshot(),
+        "retries": retry_policy.stats.snapshot(),
+        "hedging": hedger.snapshot(),
+        "circuit_breaker": circuit_breaker.snapshot(),
+        "stage_timings": stage_histograms.snapshot(),
+        "logging": log_pipeline.snapshot(),
+        "tracing": tracer.snapshot()
+    })
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Prometheus text exposition of request, upstream, cache and token metrics.
+    """
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# --- Admin endpoints, only when ADMIN_TOKEN is set ---
+def admin_only(view):
+    """
+    401 unless the request carries `Authorization: Bearer <ADMIN_TOKEN>`.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin(request.headers.get('Authorization')):
+            return jsonify({"error": "Unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+if ADMIN_TOKEN:
+    @app.route('/api/admin/profiles', methods=['GET'])
+    @admin_only
+    def list_profiles():
+        """
+        Stored request profiles of this instance, newest first.
+        """
+        return jsonify({"profiler": request_profiler.snapshot(), "profiles": request_profiler.store.list()})
+
+    @app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+    @admin_only
+    def get_profile(profile_id):
+        """
+        One profile as a text report (?sort=cumulative|tottime|calls, ?limit=40)
+        or, with ?format=pstats, as a file for `python -m pstats` or snakeviz.
+        """
+        entry = request_profiler.store.get(profile_id)
+        if entry is None:
+            return jsonify({"error": "No profile with this ID"}), 404
+        if request.args.get('format') == 'pstats':
+            return Response(entry["stats"], mimetype="application/octet-stream",
+                            headers={"Content-Disposition": f"attachment; filename={profile_id}.pstats"})
+        try:
+            report = pstats_report(entry["stats"], request.args.get('sort', 'cumulative'),
+                                   request.args.get('limit', 40, type=int))
+        except KeyError:
+            return jsonify({"error": "Unknown sort key"}), 400
+        return Response(report, mimetype="text/plain")
+
+    @app.route('/api/admin/cpu-profile', methods=['GET'])
+    @admin_only
+    def cpu_profile():
+        """
+        CPU time of all threads over the last ?seconds (default: the whole window) as
+        collapsed stacks for flamegraph.pl or speedscope; ?format=json for the sampler state.
+        """
+        if request.args.get('format') == 'json':
+            return jsonify(sampling_profiler.snapshot())
+        return Response(sampling_profiler.collapsed(request.args.get('seconds', type=float)), mimetype="text/plain")
+
+    @app.route('/api/admin/memory', methods=['GET'])
+    @admin_only
+    def memory_report():
+        """
+        RSS, Python heap and cache sizes of this instance and, with MEMORY_TRACKING=1,
+        the top allocating lines (?top=10) per route and step.
+        """
+        top = request.args.get('top', 10, type=int)
+        return jsonify({
+            **process_memory(top),
+            "caches": {
+                "plan_cache": {
+                    "entries": len(plan_cache.memory),
+                    "payload_bytes": plan_cache.memory.bytes,
+                    "object_bytes": plan_cache.object_bytes(deep_sizeof),
+                },
+                "request_profiles_bytes": request_profiler.store.stats_bytes(),
+                "cpu_profile_bytes": sampling_profiler.stored_bytes(),
+            },
+            "tracking": memory_tracker.snapshot(top),
+        })
+
+
 # --- Environment-Aware Routing ---
 # This block adds the root route ONLY when running locally (not on Vercel).
 # Vercel sets the 'VERCEL' environment variable, so we check for its absence.
@@ -0,0 +1,144 @@
+"""
+Concurrent-request capacity of the sync (WSGI) and async (ASGI) plan endpoints.
+
+Starts the local Gemini stub (bench/gemini_stub.py), fires N concurrent
+/api/generate-plan requests with distinct goals through each path and reports wall
+time, throughput and the peak number of upstream requests that were in flight at once.
+First it checks that the streamed routes work through the ASGI entry point's WSGI
+bridge, sent as chunked uploads without a Content-Length; it exits non-zero if not.
+
+    python bench/bench_async.py [--requests 200] [--threads 8] [--latency 0.5]
+
+--latency takes any stub latency spec, e.g. `lognormal:0.5,0.3`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(basedir, '..', 'api'))
+
+from gemini_stub import GeminiStub, StubConfig
+
+
+def run_sync(index, goals, threads):
+    client = index.app.test_client()
+
+    def call(goal):
+        return client.post('/api/generate-plan', json={"goal": goal}).status_code
+
+    # Each pool thread stands in for one WSGI worker thread
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(call, goals))
+
+
+def run_async(asgi, goals):
+    async def call(goal):
+        body = json.dumps({"goal": goal}).encode()
+        scope = {"type": "http", "method": "POST", "path": "/api/generate-plan", "headers": []}
+        messages = iter([{"type": "http.request", "body": body, "more_body": False}])
+        status = {}
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+
+        await asgi.app(scope, receive, send)
+        return status["code"]
+
+    async def main():
+        return await asyncio.gather(*(call(goal) for goal in goals))
+
+    return asyncio.run(main())
+
+
+async def asgi_request(asgi, method, path, body, query=b""):
+    """(status, response body) of one request through the ASGI app, uploaded in two chunks."""
+    scope = {"type": "http", "method": method, "path": path, "query_string": query,
+             "headers": [(b"content-type", b"application/json"), (b"transfer-encoding", b"chunked")]}
+    half = len(body) // 2
+    messages = iter([{"type": "http.request", "body": body[:half], "more_body": True},
+                     {"type": "http.request", "body": body[half:], "more_body": False}])
+    response = {"body": b""}
+
+    async def receive():
+        return next(messages)
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        else:
+            response["body"] += message.get("body", b"")
+
+    await asgi.app(scope, receive, send)
+    return response["status"], response["body"]
+
+
+def check_bridge(asgi, concurrency=8):
+    """
+    Streamed routes served through the WSGI bridge answer 200 with NDJSON lines. The
+    requests run concurrently, so their calls land on different executor threads.
+    """
+    checks = [
+        ("/api/generate-plan/stream", b"", lambda i: {"goal": f"bridge stream {i}"}),
+        ("/api/generate-plans", b"format=ndjson", lambda i: {"goals": [f"bridge batch {i}", f"bridge batch {i}b"]}),
+    ]
+
+    async def main():
+        return await asyncio.gather(*(asgi_request(asgi, "POST", path, json.dumps(payload(i)).encode(), query)
+                                      for path, query, payload in checks for i in range(concurrency)))
+
+    for (status, body), path in zip(asyncio.run(main()), [path for path, _, _ in checks for _ in range(concurrency)]):
+        if status != 200 or not body.strip() or any(not line.startswith(b"{") for line in body.splitlines()):
+            sys.exit(f"bridge check failed: {path} answered {status} with {body[:200]!r}")
+    print("bridge  streamed routes through the ASGI bridge: ok")
+
+
+def report(name, statuses, elapsed, stub):
+    ok = sum(1 for status in statuses if status == 200)
+    print(f"{name:<6} requests={len(statuses):<5} ok={ok:<5} wall={elapsed:7.2f}s "
+          f"throughput={len(statuses) / elapsed:8.1f} req/s  peak upstream concurrency={stub.peak_in_flight}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads for the sync path")
+    parser.add_argument('--latency', default="0.5", help="Stub upstream latency spec (seconds)")
+    args = parser.parse_args()
+
+    stub = GeminiStub(StubConfig(latency=args.latency, tasks=1)).start()
+
+    os.environ['GEMINI_API_BASE'] = stub.base_url
+    os.environ.setdefault('GEMINI_API_KEY', 'bench')
+    # Every request must reach the upstream for a capacity measurement
+    os.environ['PLAN_CACHE_TTL'] = '0'
+
+    import index
+    import _asgi
+
+    check_bridge(_asgi)
+    print(f"upstream latency {args.latency}s, {args.requests} concurrent requests, {args.threads} sync worker threads")
+
+    stub.reset()
+    start = time.perf_counter()
+    statuses = run_sync(index, [f"sync goal {i}" for i in range(args.requests)], args.threads)
+    report("sync", statuses, time.perf_counter() - start, stub)
+
+    stub.reset()
+    start = time.perf_counter()
+    statuses = run_async(_asgi, [f"async goal {i}" for i in range(args.requests)])
+    report("async", statuses, time.perf_counter() - start, stub)
+
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
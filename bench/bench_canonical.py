@@ -0,0 +1,81 @@
+"""
+Benchmark for goal canonicalization.
+
+Reads a JSONL corpus of goals ({"goal": "..."} per line) and reports how many
+distinct cache keys remain before and after canonicalization, plus the per-call cost.
+A line may add {"distinct_from": "..."}, a goal that means something else and must
+keep its own key; the run exits non-zero if such a pair is merged.
+
+    python bench/bench_canonical.py [--corpus bench/goal_corpus.jsonl] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(basedir, '..', 'api'))
+
+from _canonical import canonicalize_goal
+
+
+def load_goals(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line)['goal'] for line in f if line.strip()]
+
+
+def load_distinct_pairs(path):
+    with open(path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [(record['goal'], record['distinct_from']) for record in records if 'distinct_from' in record]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus', default=os.path.join(basedir, 'goal_corpus.jsonl'))
+    parser.add_argument('--repeat', type=int, default=20, help="Passes over the corpus for timing")
+    parser.add_argument('--show-groups', action='store_true', help="Print every merged group")
+    args = parser.parse_args()
+
+    goals = load_goals(args.corpus)
+
+    groups = {}
+    for goal in goals:
+        groups.setdefault(canonicalize_goal(goal), set()).add(goal)
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for goal in goals:
+            canonicalize_goal(goal)
+    elapsed = time.perf_counter() - start
+    calls = args.repeat * len(goals)
+
+    raw_keys = len(set(goals))
+    canonical_keys = len(groups)
+    print(f"corpus:           {args.corpus}")
+    print(f"goals:            {len(goals)}")
+    print(f"raw keys:         {raw_keys}")
+    print(f"canonical keys:   {canonical_keys}")
+    print(f"merged keys:      {raw_keys - canonical_keys} ({(raw_keys - canonical_keys) / raw_keys:.1%} of raw keys)")
+    print(f"cost per call:    {elapsed / calls * 1e6:.2f} us ({calls} calls)")
+
+    merged_pairs = [(goal, other) for goal, other in load_distinct_pairs(args.corpus)
+                    if canonicalize_goal(goal) == canonicalize_goal(other)]
+    print(f"distinct pairs:   {len(load_distinct_pairs(args.corpus))}, merged: {len(merged_pairs)}")
+    for goal, other in merged_pairs:
+        print(f"    {goal!r} and {other!r} share the key {canonicalize_goal(goal)!r}")
+
+    if args.show_groups:
+        for canonical, members in sorted(groups.items()):
+            if len(members) > 1:
+                print(f"\n{canonical!r}")
+                for member in sorted(members):
+                    print(f"    {member!r}")
+
+    if merged_pairs:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
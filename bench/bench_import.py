@@ -0,0 +1,98 @@
+"""
+Cold-start import time of the Vercel function.
+
+Imports api/index.py in fresh interpreters under `python -X importtime`, as a Vercel
+cold start would (VERCEL=1), and reports the median cumulative import time, the
+modules that cost the most, and any module that should be lazily loaded but was
+imported at cold start. Exits non-zero if the median exceeds the budget or a lazy
+module was imported.
+
+    python bench/bench_import.py [--runs 7] [--budget-ms 300] [--top 15]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+api_dir = os.path.join(basedir, '..', 'api')
+
+# Only needed once a request reaches the upstream, the async entry point or a batch,
+# or (the request profiler) with ADMIN_TOKEN set
+LAZY_MODULES = ("requests", "urllib3", "charset_normalizer", "idna", "dotenv", "asyncio",
+                "concurrent.futures", "_requests_transport", "_httpclient_transport",
+                "_profiler", "cProfile", "pstats")
+
+
+def import_profile(vercel):
+    """[(self_us, cumulative_us, depth, module)] for one cold `import index`."""
+    env = dict(os.environ)
+    # The admin-only modules load eagerly with it; measure the default deployment
+    env.pop('ADMIN_TOKEN', None)
+    if vercel:
+        env['VERCEL'] = '1'
+    else:
+        env.pop('VERCEL', None)
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import index'],
+                               cwd=api_dir, env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return rows
+
+
+def index_subtree(rows):
+    """Rows imported (directly or not) by `import index`, which is reported last."""
+    for i in range(len(rows) - 1, -1, -1):
+        if rows[i][3] == 'index' and rows[i][2] == 0:
+            start = i
+            while start > 0 and rows[start - 1][2] > 0:
+                start -= 1
+            return rows[start:i + 1]
+    raise RuntimeError("index was not imported")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--budget-ms', type=float, default=300.0, help="Maximum median cold import time of index")
+    parser.add_argument('--top', type=int, default=15, help="Modules to list by cumulative time")
+    parser.add_argument('--local', action='store_true', help="Profile a local start (VERCEL unset, loads .env)")
+    args = parser.parse_args()
+
+    # The first run also writes bytecode caches; a deployed bundle ships with them
+    import_profile(not args.local)
+    profiles = [index_subtree(import_profile(not args.local)) for _ in range(args.runs)]
+
+    totals = [profile[-1][1] / 1000.0 for profile in profiles]
+    median_total = statistics.median(totals)
+    typical = min(profiles, key=lambda profile: abs(profile[-1][1] / 1000.0 - median_total))
+
+    print(f"cold import of index ({'local' if args.local else 'VERCEL=1'}), {args.runs} runs")
+    print(f"median {median_total:8.1f} ms   min {min(totals):8.1f} ms   max {max(totals):8.1f} ms   budget {args.budget_ms:.0f} ms")
+    print()
+    print(f"{'cumulative':>12} {'self':>10}  module (run closest to the median)")
+    direct = [row for row in typical if row[2] == 1]
+    for self_us, cumulative_us, _, name in sorted(direct, key=lambda row: -row[1])[:args.top]:
+        print(f"{cumulative_us / 1000.0:9.1f} ms {self_us / 1000.0:7.1f} ms  {name}")
+
+    imported = {row[3] for row in typical}
+    eager = [name for name in LAZY_MODULES if name in imported and not (args.local and name == 'dotenv')]
+    failed = False
+    if eager:
+        print(f"\nimported at cold start but should be lazy: {', '.join(eager)}")
+        failed = True
+    if median_total > args.budget_ms:
+        print(f"\nmedian cold import {median_total:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
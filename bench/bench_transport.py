@@ -0,0 +1,103 @@
+"""
+Upstream transport comparison: requests vs. http.client.
+
+For each transport, in fresh interpreters: the time to import it, resident memory
+after the import and after the calls, and the wall and CPU time per POST against
+the local Gemini stub (which runs in this process, so the CPU measured is the
+transport's own).
+
+    python bench/bench_transport.py [--calls 500] [--runs 3] [--tasks 8] [--gzip]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+api_dir = os.path.join(basedir, '..', 'api')
+
+from gemini_stub import GeminiStub, StubConfig
+
+TRANSPORTS = {
+    "requests": ("_requests_transport", "RequestsTransport"),
+    "http.client": ("_httpclient_transport", "HTTPClientTransport"),
+}
+
+# Runs in the child interpreter; prints one JSON line of measurements
+CHILD = r"""
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+
+def rss_kib():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+rss_start = rss_kib()
+start = time.perf_counter()
+module = __import__(sys.argv[2])
+import_ms = (time.perf_counter() - start) * 1000
+rss_import = rss_kib()
+
+transport = getattr(module, sys.argv[3])()
+url, calls = sys.argv[4], int(sys.argv[5])
+payload = {"contents": [{"parts": [{"text": "Launch a new productivity app"}]}]}
+for _ in range(20):
+    transport.post(url, json=payload).json()
+
+wall, cpu = time.perf_counter(), time.process_time()
+for _ in range(calls):
+    response = transport.post(url, json=payload)
+    response.raise_for_status()
+    response.json()
+wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+print(json.dumps({
+    "import_ms": import_ms,
+    "rss_import_kib": rss_import - rss_start,
+    "rss_total_kib": rss_kib(),
+    "wall_us": wall / calls * 1e6,
+    "cpu_us": cpu / calls * 1e6,
+    "new_connections": transport.snapshot()["new_connections"],
+}))
+"""
+
+
+def measure(name, url, calls):
+    module, cls = TRANSPORTS[name]
+    completed = subprocess.run([sys.executable, '-c', CHILD, api_dir, module, cls, url, str(calls)],
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=500, help="Timed POSTs per run")
+    parser.add_argument('--runs', type=int, default=3, help="Fresh interpreters per transport (medians are shown)")
+    parser.add_argument('--tasks', type=int, default=8, help="Tasks in the stub's plan (response size)")
+    parser.add_argument('--gzip', action='store_true', help="Have the stub gzip its responses")
+    args = parser.parse_args()
+
+    stub = GeminiStub(StubConfig(latency="0", tasks=args.tasks, gzip=args.gzip)).start()
+    url = f"{stub.base_url}/v1beta/models/bench:generateContent?key=bench"
+
+    print(f"{args.calls} POSTs per run, {args.runs} runs, {args.tasks}-task plans{', gzip' if args.gzip else ''}")
+    print(f"{'transport':<12} {'import':>10} {'RSS import':>11} {'RSS total':>10} {'wall/call':>10} "
+          f"{'CPU/call':>10} {'conns':>6}")
+    for name in TRANSPORTS:
+        runs = [measure(name, url, args.calls) for _ in range(args.runs)]
+
+        def median(field):
+            return statistics.median(run[field] for run in runs)
+
+        print(f"{name:<12} {median('import_ms'):7.1f} ms {median('rss_import_kib') / 1024:7.1f} MiB "
+              f"{median('rss_total_kib') / 1024:6.1f} MiB {median('wall_us'):7.0f} us {median('cpu_us'):7.0f} us "
+              f"{median('new_connections'):6.0f}")
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+"""
+Trimmed deployment bundle for the Vercel function.
+
+Installs requirements.txt into build/vendor (or takes an existing tree with --vendor)
+and copies api/ and those dependencies (`_vendor`) into a staging directory. It then
+traces which vendored modules the app really imports while serving every endpoint,
+including its admin, error and fallback paths (against the local Gemini stub, once per
+upstream transport), drops every vendored package, console script and type-stub file
+that was not used (except KEEP_PACKAGES and --keep), and precompiles the rest to
+bytecode. Vercel's filesystem is read-only, so without shipped bytecode every cold
+start compiles each imported module again.
+
+Reports bundle size and cold-start import time before and after:
+
+    python bench/build_bundle.py [--vendor DIR] [--keep PACKAGE] [--out build/bundle] [--runs 5]
+
+Bytecode is compiled for the running interpreter, which must match the deployment's
+Python version. The bundle is not deployed automatically: `vercel deploy` builds the
+function from api/ and requirements.txt as before (see the README for a prebuilt deploy).
+"""
+import argparse
+import compileall
+import json
+import os
+import py_compile
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.normpath(os.path.join(basedir, '..'))
+api_dir = os.path.join(root_dir, 'api')
+
+# Never needed by the function at runtime
+DROP_ALWAYS = ("bin", "__pycache__")
+DROP_SUFFIXES = (".pyi", ".exe", ".c", ".h", ".pyx")
+DROP_NAMES = ("py.typed",)
+
+# Vendored packages kept even if the trace does not import them: they are loaded lazily on
+# paths that depend on runtime data the trace cannot reproduce (requests and urllib3
+# import idna only for non-ASCII hostnames, e.g. a custom GEMINI_API_BASE). --keep adds more.
+KEEP_PACKAGES = ("idna",)
+
+# Runs in a fresh `python -S` interpreter with only the bundle and the stdlib on sys.path;
+# prints the vendored files that were imported. Besides the regular endpoints it goes
+# through the admin endpoints, request validation, upstream errors and retries, a
+# throttled upstream, and degraded plans from the open circuit breaker, so packages only
+# imported on those paths are kept too.
+TRACE = r"""
+import json, os, sys
+bundle_api, vendor, bench = sys.argv[1:4]
+sys.path[:0] = [bundle_api, vendor]
+sys.path.append(bench)
+
+from gemini_stub import GeminiStub, StubConfig
+stub = GeminiStub(StubConfig(latency="0", tasks=5, chunk_delay="0", retry_after=0)).start()
+os.environ.update(GEMINI_API_BASE=stub.base_url, GEMINI_API_KEY="trace", VERCEL="1", ADMIN_TOKEN="trace",
+                  PROFILE_SAMPLE_RATE="1", GEMINI_MAX_ATTEMPTS="2",
+                  GEMINI_RETRY_BASE_DELAY="0", GEMINI_RETRY_MAX_DELAY="0", GEMINI_BREAKER_MIN_CALLS="2")
+
+import index
+# Unhandled exceptions (such as an ImportError from a dropped package) propagate instead of
+# becoming 500 responses
+index.app.testing = True
+client = index.app.test_client()
+admin = {"Authorization": "Bearer trace"}
+checks = [
+    client.get('/api/stats'),
+    client.get('/api/metrics'),
+    client.post('/api/generate-plan', json={"goal": "trace a plan"}),
+    client.post('/api/generate-plan', json={"goal": "trace a plan"}),
+    client.post('/api/generate-plan/stream', json={"goal": "trace a stream"}),
+    client.post('/api/generate-plans', json={"goals": ["trace a batch", "trace a plan"]}),
+    client.options('/api/generate-plan', headers={"Origin": "https://example.com",
+                                                  "Access-Control-Request-Method": "POST"}),
+    client.get('/api/admin/profiles', headers=admin),
+    client.get('/api/admin/cpu-profile', headers=admin),
+    client.get('/api/admin/cpu-profile?format=json', headers=admin),
+    client.get('/api/admin/memory', headers=admin),
+]
+profile_id = checks[2].headers.get('X-Profile-ID')
+checks += [client.get(f'/api/admin/profiles/{profile_id}', headers=admin),
+           client.get(f'/api/admin/profiles/{profile_id}?format=pstats', headers=admin)]
+failed = [r.status_code for r in checks if r.status_code >= 400]
+if failed:
+    sys.exit(f"trace requests failed with {failed}")
+
+# Error paths only have to complete; their status codes are the errors themselves
+client.post('/api/generate-plan', data="not json", content_type='application/json')
+client.get('/api/admin/memory')
+client.get('/api/unknown')
+stub.config.rate_limit_rate = 1.0
+client.post('/api/generate-plan', json={"goal": "trace a throttled plan"})
+client.post('/api/generate-plan/stream', json={"goal": "trace a throttled stream"})
+stub.config.rate_limit_rate, stub.config.error_rate, stub.config.error_status = 0.0, 1.0, 500
+for i in range(3):
+    client.post('/api/generate-plan', json={"goal": f"trace a failing plan {i}"})
+client.post('/api/generate-plan/stream', json={"goal": "trace a failing stream"})
+client.post('/api/generate-plans', json={"goals": ["trace a failing batch"]})
+# By now the breaker is open and plans are degraded
+client.post('/api/generate-plan', json={"goal": "trace a plan again"})
+
+vendor = os.path.realpath(vendor)
+used = sorted({os.path.realpath(m.__file__) for m in list(sys.modules.values())
+               if getattr(m, '__file__', None) and os.path.realpath(m.__file__).startswith(vendor + os.sep)})
+print(json.dumps(used))
+"""
+
+# Cold `import index` in a fresh interpreter, without writing bytecode (as on Vercel)
+COLD_IMPORT = r"""
+import sys, time
+sys.path[:0] = sys.argv[1:3]
+start = time.perf_counter()
+import index
+print((time.perf_counter() - start) * 1000)
+"""
+
+
+def install_vendor(target):
+    """Fresh `pip install -r requirements.txt --target` into target, as Vercel's build does."""
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    completed = subprocess.run([sys.executable, '-m', 'pip', 'install', '--quiet', '--disable-pip-version-check',
+                                '-r', os.path.join(root_dir, 'requirements.txt'), '--target', target])
+    if completed.returncode != 0:
+        sys.exit("Installing requirements.txt failed; pass an existing tree with --vendor DIR")
+    return target
+
+
+def _distribution_name(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def missing_requirements(vendor):
+    """Distributions named in requirements.txt that have no dist-info in the vendored tree."""
+    with open(os.path.join(root_dir, 'requirements.txt'), 'rb') as f:
+        raw = f.read()
+    # The file is saved as UTF-16 with a byte order mark
+    text = raw.decode('utf-16' if raw.startswith((b'\xff\xfe', b'\xfe\xff')) else 'utf-8-sig')
+    required = {_distribution_name(re.split(r'[\s<>=!~;\[]', line.strip(), 1)[0])
+                for line in text.splitlines() if line.strip() and not line.strip().startswith('#')}
+    installed = {_distribution_name(name[:-len('.dist-info')].rsplit('-', 1)[0])
+                 for name in os.listdir(vendor) if name.endswith('.dist-info')}
+    return sorted(required - installed)
+
+
+def display(path):
+    relative = os.path.relpath(path, root_dir)
+    return path if relative.startswith('..') else relative
+
+
+def tree_size(path):
+    """(files, bytes, of which bytecode bytes) under path."""
+    files, size, bytecode = 0, 0, 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            files += 1
+            file_size = os.path.getsize(os.path.join(dirpath, name))
+            size += file_size
+            bytecode += file_size if name.endswith('.pyc') else 0
+    return files, size, bytecode
+
+
+def stage(vendor, out):
+    """Fresh copy of api/*.py and the vendored tree, without any bytecode."""
+    if os.path.exists(out):
+        shutil.rmtree(out)
+    bundle_api = os.path.join(out, 'api')
+    os.makedirs(bundle_api)
+    for name in sorted(os.listdir(api_dir)):
+        if name.endswith('.py'):
+            shutil.copy2(os.path.join(api_dir, name), bundle_api)
+    bundle_vendor = os.path.join(bundle_api, '_vendor')
+    shutil.copytree(vendor, bundle_vendor, ignore=shutil.ignore_patterns('__pycache__'))
+    return bundle_api, bundle_vendor
+
+
+def run_python(code, *args, env=None):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1', **(env or {}))
+    env.pop('PYTHONPATH', None)
+    completed = subprocess.run([sys.executable, '-S', '-c', code, *args], capture_output=True, text=True, env=env)
+    if completed.returncode != 0:
+        detail = completed.stderr.strip().splitlines()[-1:] or ["(no output)"]
+        raise RuntimeError(detail[0])
+    return completed.stdout.strip().splitlines()[-1]
+
+
+def trace(bundle_api, bundle_vendor):
+    """Vendored files imported while serving requests with each upstream transport."""
+    used = set()
+    for transport in ("requests", "http.client"):
+        try:
+            output = run_python(TRACE, bundle_api, bundle_vendor, basedir, env={"GEMINI_TRANSPORT": transport})
+        except RuntimeError as e:
+            sys.exit(f"Tracing with GEMINI_TRANSPORT={transport} failed: {e}")
+        used.update(json.loads(output))
+    return used
+
+
+def dist_info_owners(bundle_vendor):
+    """
+    {dist-info directory: top-level names it installed}, from each RECORD. A dist-info
+    whose RECORD lists Python files that are gone was left behind by an older install
+    the package was since upgraded over; it maps to no names, so it is dropped.
+    """
+    owners = {}
+    for name in os.listdir(bundle_vendor):
+        if not name.endswith('.dist-info'):
+            continue
+        tops, stale = set(), False
+        record = os.path.join(bundle_vendor, name, 'RECORD')
+        if os.path.exists(record):
+            with open(record, encoding='utf-8') as f:
+                for line in f:
+                    path = line.split(',', 1)[0]
+                    top = path.split('/', 1)[0]
+                    if not top or top.endswith('.dist-info') or top == '..':
+                        continue
+                    tops.add(top[:-3] if top.endswith('.py') else top)
+                    if path.endswith('.py') and not os.path.exists(os.path.join(bundle_vendor, path)):
+                        stale = True
+        owners[name] = set() if stale else tops
+    return owners
+
+
+def trim(bundle_vendor, used_files, keep=()):
+    """
+    Removes top-level packages that were neither traced nor listed in `keep`, their
+    dist-info, scripts and type stubs; returns what went.
+    """
+    real_vendor = os.path.realpath(bundle_vendor)
+    used_tops = {os.path.relpath(path, real_vendor).split(os.sep, 1)[0] for path in used_files}
+    used_tops = {top[:-3] if top.endswith('.py') else top for top in used_tops} | set(keep)
+
+    dropped = []
+    owners = dist_info_owners(bundle_vendor)
+    for name in sorted(os.listdir(bundle_vendor)):
+        path = os.path.join(bundle_vendor, name)
+        top = name[:-3] if name.endswith('.py') else name
+        if name in owners:
+            keep = bool(owners[name] & used_tops)
+        else:
+            keep = top in used_tops and name not in DROP_ALWAYS
+        if not keep:
+            dropped.append(name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    for dirpath, _, filenames in os.walk(bundle_vendor):
+        for name in filenames:
+            if name.endswith(DROP_SUFFIXES) or name in DROP_NAMES:
+                os.remove(os.path.join(dirpath, name))
+    return dropped
+
+
+def precompile(bundle_api, used_files):
+    """
+    Bytecode for api/*.py and the vendored modules the trace imported. Modules only
+    reached on rarer paths are still shipped, just compiled when first imported.
+    """
+    real_vendor = os.path.realpath(os.path.join(bundle_api, '_vendor'))
+    sources = [os.path.join(bundle_api, name) for name in os.listdir(bundle_api) if name.endswith('.py')]
+    sources += [path for path in used_files if path.startswith(real_vendor + os.sep) and os.path.exists(path)]
+    for path in sorted(sources):
+        # Hash-based pycs stay valid when deployment resets file modification times
+        if not compileall.compile_file(path, quiet=1,
+                                       invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH):
+            sys.exit(f"Bytecode compilation failed for {path}")
+    return len(sources)
+
+
+def cold_start_ms(bundle_api, bundle_vendor, runs):
+    return statistics.median(float(run_python(COLD_IMPORT, bundle_api, bundle_vendor, env={"VERCEL": "1"}))
+                             for _ in range(runs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--vendor', help="Vendored dependencies (default: requirements.txt installed into build/vendor)")
+    parser.add_argument('--keep', action='append', default=[], metavar='PACKAGE',
+                        help="Vendored top-level package to keep even if the trace does not import it (repeatable)")
+    parser.add_argument('--out', default=os.path.join(root_dir, 'build', 'bundle'))
+    parser.add_argument('--runs', type=int, default=5, help="Cold starts timed before and after (median)")
+    args = parser.parse_args()
+
+    vendor = os.path.abspath(args.vendor or install_vendor(os.path.join(root_dir, 'build', 'vendor')))
+    missing = missing_requirements(vendor)
+    if missing:
+        sys.exit(f"{display(vendor)} lacks {', '.join(missing)} from requirements.txt; "
+                 "leave out --vendor to install a fresh tree")
+    bundle_api, bundle_vendor = stage(vendor, os.path.abspath(args.out))
+
+    # Tracing first also checks that the vendored tree is complete
+    used = trace(bundle_api, bundle_vendor)
+    files_before, size_before, _ = tree_size(bundle_api)
+    cold_before = cold_start_ms(bundle_api, bundle_vendor, args.runs)
+
+    keep = KEEP_PACKAGES + tuple(args.keep)
+    dropped = trim(bundle_vendor, used, keep)
+    compiled = precompile(bundle_api, used)
+    # The trimmed bundle must still serve every traced path
+    trace(bundle_api, bundle_vendor)
+
+    files_after, size_after, bytecode_after = tree_size(bundle_api)
+    cold_after = cold_start_ms(bundle_api, bundle_vendor, args.runs)
+
+    print(f"vendored tree   {display(vendor)}")
+    print(f"traced imports  {len(used)} vendored modules")
+    print(f"kept untraced   {', '.join(keep)}")
+    print(f"dropped         {', '.join(dropped) or 'nothing'}")
+    print(f"bytecode        {compiled} modules, {sys.implementation.cache_tag} (deploy with the same Python version)")
+    print()
+    print(f"{'':<12} {'files':>7} {'size':>10} {'cold import':>12}")
+    print(f"{'before':<12} {files_before:7d} {size_before / 1024 / 1024:7.2f} MiB {cold_before:9.1f} ms")
+    print(f"{'after':<12} {files_after:7d} {size_after / 1024 / 1024:7.2f} MiB {cold_after:9.1f} ms"
+          f"   ({bytecode_after / 1024 / 1024:.2f} MiB of it bytecode)")
+    print()
+    print(f"bundle written to {display(bundle_api)}")
+
+
+if __name__ == '__main__':
+    main()
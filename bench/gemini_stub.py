@@ -0,0 +1,313 @@
+"""
+Local stand-in for the Gemini API, for offline load and latency testing.
+
+Implements `generateContent` and `streamGenerateContent` (SSE with `alt=sse`, a JSON
+array of chunks otherwise) under /v1beta/models/<model>:<method> with the same response
+envelope as Gemini (`candidates[0].content.parts[0].text` plus `usageMetadata`).
+Latency, error and 429 injection, streaming chunk pacing, gzip encoding and the size of
+the returned plan are all configurable. Point the app at it with GEMINI_API_BASE:
+
+    python bench/gemini_stub.py --port 8089 --latency lognormal:0.8,0.4 --rate-limit-rate 0.02
+    GEMINI_API_BASE=http://127.0.0.1:8089 GEMINI_API_KEY=stub python api/index.py
+
+Latency specs: a fixed number of seconds (`0.5`), `uniform:LOW,HIGH`,
+`normal:MEAN,STDDEV`, `lognormal:MEDIAN,SIGMA` or `exp:MEAN`.
+
+GET /stub/stats returns request counters; POST /stub/reset clears them.
+"""
+import argparse
+import functools
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+_PATH_RE = re.compile(r"^/v1beta/models/(?P<model>[^/:]+):(?P<method>generateContent|streamGenerateContent)$")
+
+_TASK_VERBS = ("Research", "Draft", "Review", "Build", "Test", "Launch", "Measure", "Refine")
+_TASK_OBJECTS = ("requirements", "budget", "prototype", "schedule", "marketing plan", "feedback", "release", "metrics")
+
+
+def parse_latency(spec):
+    """Turns a latency spec into a zero-argument sampler returning seconds."""
+    spec = str(spec).strip()
+    if ":" not in spec:
+        value = float(spec)
+        return lambda: value
+    kind, _, args = spec.partition(":")
+    params = [float(p) for p in args.split(",")]
+    kind = kind.lower()
+    if kind == "uniform":
+        low, high = params
+        return lambda: random.uniform(low, high)
+    if kind == "normal":
+        mean, stddev = params
+        return lambda: max(0.0, random.gauss(mean, stddev))
+    if kind == "lognormal":
+        median, sigma = params
+        mu = math.log(median)
+        return lambda: random.lognormvariate(mu, sigma)
+    if kind in ("exp", "exponential"):
+        mean, = params
+        return lambda: random.expovariate(1.0 / mean)
+    raise ValueError(f"Unknown latency distribution: {spec!r}")
+
+
+@functools.lru_cache(maxsize=8)
+def synthesize_plan_text(tasks):
+    """JSON text of a well-formed plan with `tasks` tasks, each depending on up to two earlier ones."""
+    plan = []
+    for i in range(1, tasks + 1):
+        verb = _TASK_VERBS[i % len(_TASK_VERBS)]
+        obj = _TASK_OBJECTS[(i // len(_TASK_VERBS)) % len(_TASK_OBJECTS)]
+        plan.append({
+            "id": i,
+            "taskName": f"{verb} the {obj} ({i})",
+            "description": f"{verb} the {obj} and record the outcome for the next step.",
+            "dependencies": [d for d in (i - 1, i // 2) if 0 < d < i][:2],
+            "timeline": f"Day {1 + i // 3}",
+        })
+    return json.dumps(plan)
+
+
+class StubConfig:
+    """Behaviour of the stub; attributes may be changed while it is serving."""
+
+    def __init__(self, latency="0.5", error_rate=0.0, error_status=503, rate_limit_rate=0.0, retry_after=1,
+                 tasks=8, plan_file=None, chunk_size=64, chunk_delay="0.02", gzip=False):
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.chunk_size = max(1, chunk_size)
+        self.chunk_delay = parse_latency(chunk_delay)
+        # Gzip-encode responses for clients that send Accept-Encoding: gzip
+        self.gzip = gzip
+        if plan_file:
+            with open(plan_file, encoding="utf-8") as f:
+                self.plan_text = json.dumps(json.load(f))
+        else:
+            self.plan_text = synthesize_plan_text(tasks)
+
+
+class GeminiStub(ThreadingHTTPServer):
+    """Threaded HTTP server; `port=0` picks a free port (see `base_url`)."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), GeminiStubHandler)
+        self.config = config or StubConfig()
+        self.lock = threading.Lock()
+        self.reset()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serves from a daemon thread and returns self."""
+        threading.Thread(target=self.serve_forever, name="gemini-stub", daemon=True).start()
+        return self
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.in_flight = 0
+            self.peak_in_flight = 0
+            self.statuses = {}
+
+    def _enter(self):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _exit(self, status):
+        with self.lock:
+            self.in_flight -= 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            }
+
+
+class GeminiStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; with Nagle on, the client's delayed
+    # ACK would add ~40ms to every keep-alive response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if urlsplit(self.path).path == "/stub/stats":
+            self._send_json(200, self.server.snapshot())
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if url.path == "/stub/reset":
+            self.server.reset()
+            return self._send_json(200, {"reset": True})
+
+        match = _PATH_RE.match(url.path)
+        if not match:
+            return self._send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+        server = self.server
+        config = server.config
+        server._enter()
+        status = 200
+        try:
+            time.sleep(config.latency())
+            roll = random.random()
+            if roll < config.rate_limit_rate:
+                status = 429
+                return self._send_json(429, _error_body(429, "RESOURCE_EXHAUSTED", "Quota exceeded (stub)."),
+                                       [("Retry-After", str(config.retry_after))])
+            if roll < config.rate_limit_rate + config.error_rate:
+                status = config.error_status
+                return self._send_json(status, _error_body(status, "UNAVAILABLE", "Injected failure (stub)."))
+
+            prompt = _prompt_text(body)
+            if match.group("method") == "generateContent":
+                self._send_json(200, _response_chunk(config.plan_text, prompt, finished=True))
+            else:
+                sse = parse_qs(url.query).get("alt") == ["sse"]
+                self._stream(config, prompt, sse)
+        except (BrokenPipeError, ConnectionResetError):
+            status = 499
+        finally:
+            server._exit(status)
+
+    def _gzip_encoder(self):
+        """A gzip compressor if responses should be compressed for this client, else None."""
+        if self.server.config.gzip and "gzip" in self.headers.get("Accept-Encoding", ""):
+            return zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        return None
+
+    def _stream(self, config, prompt, sse):
+        text = config.plan_text
+        pieces = [text[i:i + config.chunk_size] for i in range(0, len(text), config.chunk_size)] or [""]
+        self._encoder = self._gzip_encoder()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if sse else "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        if self._encoder:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        if not sse:
+            self._write_chunk(b"[")
+        for n, piece in enumerate(pieces):
+            if n:
+                time.sleep(config.chunk_delay())
+            finished = n == len(pieces) - 1
+            data = json.dumps(_response_chunk(piece, prompt, finished, usage_text=text if finished else None))
+            if sse:
+                self._write_chunk(f"data: {data}\r\n\r\n".encode())
+            else:
+                self._write_chunk(((",\n" if n else "") + data).encode())
+        if not sse:
+            self._write_chunk(b"]")
+        if self._encoder:
+            self._write_chunk(b"", final=True)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data, final=False):
+        if self._encoder:
+            # Sync-flush so every chunk can be decoded as soon as it arrives
+            data = self._encoder.compress(data) + self._encoder.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        encoder = self._gzip_encoder()
+        if encoder:
+            body = encoder.compress(body) + encoder.flush()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if encoder:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _prompt_text(body):
+    try:
+        return json.loads(body)["contents"][0]["parts"][0]["text"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return ""
+
+
+def _response_chunk(text, prompt, finished, usage_text=None):
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    chunk = {"candidates": [candidate], "modelVersion": "gemini-stub"}
+    if finished:
+        candidate["finishReason"] = "STOP"
+        prompt_tokens = len(prompt) // 4
+        output_tokens = len(usage_text if usage_text is not None else text) // 4
+        chunk["usageMetadata"] = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        }
+    return chunk
+
+
+def _error_body(code, status, message):
+    return {"error": {"code": code, "message": message, "status": status}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="0.5", help="Time before the response (or first chunk) is sent")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failed with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--tasks", type=int, default=8, help="Tasks in the synthesized plan")
+    parser.add_argument("--plan-file", help="Serve this canned plan (a JSON array) instead")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Characters of plan text per streamed chunk")
+    parser.add_argument("--chunk-delay", default="0.02", help="Latency spec of the pause between streamed chunks")
+    parser.add_argument("--gzip", action="store_true", help="Gzip responses when the client accepts it")
+    args = parser.parse_args()
+
+    config = StubConfig(latency=args.latency, error_rate=args.error_rate, error_status=args.error_status,
+                        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after, tasks=args.tasks,
+                        plan_file=args.plan_file, chunk_size=args.chunk_size, chunk_delay=args.chunk_delay,
+                        gzip=args.gzip)
+    stub = GeminiStub(config, args.host, args.port)
+    print(f"Gemini stub listening; run the app with GEMINI_API_BASE={stub.base_url}")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+HDR-style latency histogram.
+
+Values (integer microseconds) are recorded into log-linear buckets whose width is
+bounded relative to the value, so any percentile is exact to the configured number of
+significant figures whatever the range, and the memory used stays small. The output
+mimics HdrHistogram's percentile distribution so runs can be diffed or plotted with
+the usual tools.
+"""
+import math
+
+
+class Histogram:
+    """Sparse log-linear histogram of non-negative integer values."""
+
+    def __init__(self, significant_figures=3):
+        # Values below 2**sub_bucket_bits are stored exactly; above that the low bits are dropped
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_figures))
+        self.counts = {}
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    def _bucket(self, value):
+        shift = max(0, value.bit_length() - self.sub_bucket_bits)
+        return (value >> shift) << shift, shift
+
+    def record(self, value, count=1):
+        value = max(0, int(value))
+        low, _ = self._bucket(value)
+        self.counts[low] = self.counts.get(low, 0) + count
+        self.total += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for low, count in other.counts.items():
+            self.counts[low] = self.counts.get(low, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _highest_equivalent(self, low):
+        _, shift = self._bucket(low)
+        return min(self.max, low + (1 << shift) - 1)
+
+    def value_at(self, percentile):
+        """Smallest recorded value (to histogram precision) at or above the percentile."""
+        if not self.total:
+            return 0
+        target = max(1, math.ceil(percentile / 100.0 * self.total))
+        seen = 0
+        for low in sorted(self.counts):
+            seen += self.counts[low]
+            if seen >= target:
+                return self._highest_equivalent(low)
+        return self.max
+
+    def mean(self):
+        return self.sum / self.total if self.total else 0.0
+
+    def percentile_distribution(self, scale=1000.0, ticks_per_half_distance=5):
+        """
+        Lines of HdrHistogram's classic output: value (divided by `scale`), percentile,
+        cumulative count and 1/(1-percentile), iterating ever finer towards the tail.
+        """
+        lines = [f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} {'1/(1-Percentile)':>16}", ""]
+        if not self.total:
+            return lines
+        points = []
+        percentile = 0.0
+        half_distance = 50.0
+        # Stop once a tick would be finer than a single recorded value
+        while half_distance * 2 >= 100.0 / self.total:
+            for _ in range(ticks_per_half_distance):
+                points.append(percentile)
+                percentile += half_distance / ticks_per_half_distance
+            half_distance /= 2
+        points.append(100.0)
+
+        ordered = sorted(self.counts)
+        seen, i = 0, 0
+        for percentile in points:
+            target = max(1, math.ceil(percentile / 100.0 * self.total))
+            while seen < target and i < len(ordered):
+                seen += self.counts[ordered[i]]
+                i += 1
+            value = self._highest_equivalent(ordered[i - 1]) if i else self.min
+            inverse = f"{1 / (1 - percentile / 100.0):16.2f}" if percentile < 100.0 else f"{'inf':>16}"
+            lines.append(f"{value / scale:12.3f} {percentile / 100.0:14.12f} {seen:10d} {inverse}")
+        lines.append("")
+        lines.append(f"#[Mean    = {self.mean() / scale:12.3f}, Max        = {self.max / scale:12.3f}]")
+        lines.append(f"#[Min     = {(self.min or 0) / scale:12.3f}, TotalCount = {self.total:12d}]")
+        return lines
@@ -0,0 +1,227 @@
+"""
+Open-loop HTTP load generator for the plan API.
+
+Replays goals from a JSONL corpus at a fixed arrival rate against a running app, mixing
+cache hits (goals whose plans were generated during a warm-up pass) with misses (unique
+variants of corpus goals), and reports throughput, HDR-style latency histograms and an
+error breakdown. Latency is measured from each request's scheduled send time, so a
+server that falls behind is charged for the queueing it causes (no coordinated omission).
+
+Without --url, the Gemini stub (bench/gemini_stub.py) and the Flask app are started
+in-process on free ports; with --url, point the app's GEMINI_API_BASE at a stub yourself.
+
+    python bench/loadgen.py [--rate 50] [--duration 30] [--hit-ratio 0.5] [--url http://127.0.0.1:5000]
+
+Results are also written to bench_output.txt in a stable, diff-able layout.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(basedir, '..', 'api'))
+
+from histogram import Histogram
+
+
+def load_goals(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line)['goal'] for line in f if line.strip()]
+
+
+def start_local_app(stub_latency, stub_tasks):
+    """Starts the stub and the Flask app in this process; returns the app's base URL."""
+    from gemini_stub import GeminiStub, StubConfig
+    from werkzeug.serving import make_server
+
+    stub = GeminiStub(StubConfig(latency=stub_latency, tasks=stub_tasks)).start()
+    os.environ['GEMINI_API_BASE'] = stub.base_url
+    os.environ.setdefault('GEMINI_API_KEY', 'bench')
+    # Measure the app, not this instance's share of the real Gemini quota
+    os.environ.setdefault('GEMINI_RPM', '0')
+    os.environ.setdefault('GEMINI_TPM', '0')
+
+    import index
+    # Per-request access logs would dominate the run's CPU time
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, index.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="plan-app", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+class Client:
+    """One keep-alive connection per worker thread."""
+
+    def __init__(self, base_url, endpoint, timeout):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == 'https' else 80)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.path = url.path.rstrip('/') + endpoint
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def post(self, goal):
+        """Returns (status, X-Plan-Cache or X-Plan-Degraded value)."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+        body = json.dumps({"goal": goal})
+        try:
+            connection.request('POST', self.path, body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+        except Exception:
+            connection.close()
+            self._local.connection = None
+            raise
+        degraded = response.getheader('X-Plan-Degraded')
+        return response.status, f"DEGRADED:{degraded}" if degraded else response.getheader('X-Plan-Cache', '-')
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = Histogram()
+        self.by_cache = {}
+        self.statuses = {}
+        self.errors = {}
+        self.sent = 0
+
+    def record(self, latency_us, status, cache, error=None):
+        with self._lock:
+            self.sent += 1
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+                return
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.latency.record(latency_us)
+            if status == 200:
+                self.by_cache.setdefault(cache, Histogram()).record(latency_us)
+
+
+def build_schedule(goals, count, hit_ratio, seed):
+    """(is_hit, goal) for every request; hits reuse corpus goals, misses are unique variants."""
+    rng = random.Random(seed)
+    schedule = []
+    for n in range(count):
+        if rng.random() < hit_ratio:
+            schedule.append((True, rng.choice(goals)))
+        else:
+            schedule.append((False, f"{rng.choice(goals)} variant {seed}-{n}"))
+    return schedule
+
+
+def warm_up(client, goals, workers):
+    """Generates every corpus plan once so replayed corpus goals are cache hits."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        statuses = list(pool.map(lambda goal: client.post(goal)[0], goals))
+    return sum(1 for status in statuses if status == 200)
+
+
+def run(client, schedule, rate, workers):
+    results = Results()
+    interval = 1.0 / rate
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="loadgen")
+
+    def send(scheduled_at, goal):
+        try:
+            status, cache = client.post(goal)
+        except Exception as e:
+            results.record(0, None, None, error=type(e).__name__)
+            return
+        results.record((time.perf_counter() - scheduled_at) * 1e6, status, cache)
+
+    start = time.perf_counter()
+    for n, (_, goal) in enumerate(schedule):
+        scheduled_at = start + n * interval
+        delay = scheduled_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        pool.submit(send, scheduled_at, goal)
+    pool.shutdown(wait=True)
+    return results, time.perf_counter() - start
+
+
+def format_report(args, results, elapsed, hits_planned):
+    """Report lines; everything but the header is in a fixed order so runs diff cleanly."""
+    ok = results.statuses.get(200, 0)
+    lines = [
+        "# Plan API load test",
+        f"target        {args.url or 'in-process app + gemini stub'}{args.endpoint}",
+        f"rate          {args.rate:.1f} req/s for {args.duration:.0f}s ({results.sent} sent)",
+        f"hit_ratio     {args.hit_ratio:.2f} ({hits_planned} planned hits)",
+        f"workers       {args.workers}",
+        f"stub_latency  {args.stub_latency if not args.url else 'external'}",
+        "",
+        "## Throughput",
+        f"achieved_rate {results.sent / elapsed:10.1f} req/s",
+        f"ok_throughput {ok / elapsed:10.1f} req/s",
+        "",
+        "## Latency (ms, from scheduled send time)",
+    ]
+    for percentile in (50, 95, 99, 99.9):
+        lines.append(f"p{percentile:<5} {results.latency.value_at(percentile) / 1000.0:12.3f}")
+    lines.append(f"max    {results.latency.max / 1000.0:12.3f}")
+    lines.append("")
+    lines.append("## Latency by cache status (ms, 200 responses)")
+    for cache in sorted(results.by_cache):
+        hist = results.by_cache[cache]
+        lines.append(f"{cache:<24} n={hist.total:<7d} p50={hist.value_at(50) / 1000.0:10.3f} "
+                     f"p99={hist.value_at(99) / 1000.0:10.3f}")
+    lines.append("")
+    lines.append("## Responses")
+    for status in sorted(results.statuses):
+        lines.append(f"status_{status} {results.statuses[status]}")
+    for error in sorted(results.errors):
+        lines.append(f"error_{error} {results.errors[error]}")
+    lines.append("")
+    lines.append("## Latency distribution (ms)")
+    lines.extend(results.latency.percentile_distribution())
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help="Base URL of a running app (default: start one in-process)")
+    parser.add_argument('--endpoint', default='/api/generate-plan')
+    parser.add_argument('--corpus', default=os.path.join(basedir, 'goal_corpus.jsonl'))
+    parser.add_argument('--rate', type=float, default=50.0, help="Arrival rate (requests per second)")
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds of load")
+    parser.add_argument('--hit-ratio', type=float, default=0.5, help="Share of requests for already cached goals")
+    parser.add_argument('--workers', type=int, default=64, help="Max concurrent client connections")
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--stub-latency', default='lognormal:0.5,0.4', help="In-process stub latency spec")
+    parser.add_argument('--stub-tasks', type=int, default=8, help="Tasks per plan from the in-process stub")
+    parser.add_argument('--output', default=os.path.join(basedir, '..', 'bench_output.txt'))
+    args = parser.parse_args()
+
+    base_url = args.url or start_local_app(args.stub_latency, args.stub_tasks)
+    client = Client(base_url, args.endpoint, args.timeout)
+    goals = load_goals(args.corpus)
+
+    warmed = warm_up(client, goals, args.workers)
+    print(f"warm-up: {warmed}/{len(goals)} corpus plans generated")
+
+    schedule = build_schedule(goals, int(args.rate * args.duration), args.hit_ratio, args.seed)
+    results, elapsed = run(client, schedule, args.rate, args.workers)
+
+    lines = format_report(args, results, elapsed, sum(1 for is_hit, _ in schedule if is_hit))
+    report = "\n".join(lines) + "\n"
+    print(report)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write(report)
+    print(f"written to {os.path.normpath(args.output)}")
+
+
+if __name__ == '__main__':
+    main()
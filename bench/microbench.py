@@ -0,0 +1,165 @@
+"""
+In-process microbenchmarks of the per-request hot path.
+
+Times each CPU stage a plan request goes through, on plans of 10, 1k and 100k tasks:
+building the Gemini payload (including its JSON encoding for the wire) and cache key,
+the double JSON decode of a generateContent
+response (body, then the plan text in the first part), incremental parsing of a
+streamed plan, storing a plan in the cache, Flask `jsonify`, and a full cached request
+through the Werkzeug test client. The app itself does no plan validation or dependency
+graph work, so the size-dependent stages above are what scale with plan size.
+
+Each stage is timed over several runs and its median is compared with the stored
+baseline (bench/microbench_baseline.json); any stage slower than its baseline by more
+than the threshold fails the run. Baselines are machine-specific, so re-record them with
+--save-baseline on the machine you compare on, and whenever a change adds per-request
+work on purpose.
+
+    python bench/microbench.py [--only decode] [--repeat 9] [--threshold 0.25] [--save-baseline]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(basedir, '..', 'api'))
+
+os.environ.setdefault('GEMINI_API_KEY', 'bench')
+
+import index
+from _plan_cache import PlanCache
+from _stream_parser import JSONArrayStreamParser
+from gemini_stub import synthesize_plan_text
+
+BASELINE_PATH = os.path.join(basedir, 'microbench_baseline.json')
+PLAN_SIZES = (10, 1000, 100000)
+GOAL = "Launch a new productivity app in 3 months"
+
+
+def response_body(plan_text):
+    """A generateContent response as it comes off the wire."""
+    return json.dumps({"candidates": [{"content": {"parts": [{"text": plan_text}], "role": "model"}}],
+                       "usageMetadata": {"totalTokenCount": len(plan_text) // 4}}).encode()
+
+
+def stages():
+    """{name: zero-argument callable} for every benchmarked stage."""
+    benches = {
+        # Encoded like the transports do before sending it
+        "build_payload": lambda: json.dumps(index.build_gemini_payload(GOAL)).encode("utf-8"),
+        "plan_cache_key": lambda: index.plan_cache_key(GOAL),
+    }
+    client = index.app.test_client()
+    app_context = index.app.app_context()
+    app_context.push()
+
+    for size in PLAN_SIZES:
+        plan_text = synthesize_plan_text(size)
+        plan = json.loads(plan_text)
+        body = response_body(plan_text)
+        chunks = [plan_text[i:i + 1024] for i in range(0, len(plan_text), 1024)]
+
+        def stream_parse(chunks=chunks):
+            parser = JSONArrayStreamParser()
+            for chunk in chunks:
+                parser.feed(chunk)
+
+        cache = PlanCache(ttl=3600, max_bytes=1 << 34)
+        goal = f"microbench goal with {size} tasks"
+        index.plan_cache.set(index.plan_cache_key(goal), plan)
+
+        benches[f"decode/{size}"] = lambda body=body: index.extract_plan(json.loads(body))
+        benches[f"stream_parse/{size}"] = stream_parse
+        benches[f"cache_set/{size}"] = lambda plan=plan, cache=cache: cache.set("key", plan)
+        benches[f"jsonify/{size}"] = lambda plan=plan: index.jsonify(plan).get_data()
+        benches[f"endpoint_hit/{size}"] = lambda goal=goal: client.post('/api/generate-plan', json={"goal": goal}).get_data()
+    return benches
+
+
+def calibrate(fn, min_time):
+    """Loop count that makes one timing run of fn take at least min_time."""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return loops
+        loops *= 10 if elapsed < min_time / 10 else 2
+
+
+def measure(benches, min_time, repeat):
+    """
+    {name: median seconds per call} over `repeat` timing runs of each stage. The runs
+    go round-robin over the stages, so a stretch of machine noise costs every stage one
+    run, which the median discards, instead of spoiling all runs of a few stages.
+    """
+    loops = {name: calibrate(fn, min_time) for name, fn in benches.items()}
+    runs = {name: [] for name in benches}
+    for _ in range(repeat):
+        for name, fn in benches.items():
+            start = time.perf_counter()
+            for _ in range(loops[name]):
+                fn()
+            runs[name].append((time.perf_counter() - start) / loops[name])
+    return {name: statistics.median(times) for name, times in runs.items()}
+
+
+def format_seconds(seconds):
+    if seconds >= 1:
+        return f"{seconds:8.3f} s "
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:8.3f} ms"
+    return f"{seconds * 1e6:8.3f} us"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--only', help="Run only stages whose name contains this")
+    parser.add_argument('--min-time', type=float, default=0.2, help="Minimum seconds per timing run")
+    parser.add_argument('--repeat', type=int, default=9, help="Timing runs per stage (the median is kept)")
+    parser.add_argument('--threshold', type=float, help="Allowed slowdown vs. baseline (default: from the baseline file)")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="Record these results as the new baseline")
+    args = parser.parse_args()
+
+    baseline = {"threshold": 0.25, "stages": {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    threshold = args.threshold if args.threshold is not None else baseline.get("threshold", 0.25)
+
+    benches = {name: fn for name, fn in stages().items() if not args.only or args.only in name}
+    results = measure(benches, args.min_time, args.repeat)
+    regressions = []
+    print(f"{'stage':<24} {'per call':>11} {'baseline':>11} {'change':>8}")
+    for name, seconds in results.items():
+        base = baseline["stages"].get(name)
+        if base:
+            change = seconds / base - 1
+            flag = "  REGRESSION" if change > threshold else ""
+            if flag:
+                regressions.append(name)
+            print(f"{name:<24} {format_seconds(seconds)} {format_seconds(base)} {change:+7.1%}{flag}")
+        else:
+            print(f"{name:<24} {format_seconds(seconds)} {'-':>11}")
+
+    if args.save_baseline:
+        baseline["threshold"] = threshold
+        baseline["stages"].update({name: float(f"{seconds:.4g}") for name, seconds in results.items()})
+        baseline["stages"] = dict(sorted(baseline["stages"].items()))
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"baseline saved to {os.path.normpath(args.baseline)}")
+    elif regressions:
+        print(f"{len(regressions)} stage(s) slower than baseline by more than {threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Replays recorded Gemini traffic through the whole Flask stack, with no network.
+
+Reads a cassette written with GEMINI_CASSETTE_MODE=record, recovers each recorded
+request's goal from its prompt, and sends the requests to an in-process copy of the app
+at their recorded arrival times. Streamed requests go to the streaming endpoint. The app
+runs with GEMINI_CASSETTE_MODE=replay, so every upstream response comes from the
+cassette with its recorded timing. --speed scales the upstream timing and --arrival-speed
+the gaps between requests (0 sends them back to back):
+
+    GEMINI_CASSETTE_MODE=record GEMINI_CASSETTE=prod.cassette.jsonl python api/index.py
+    python bench/replay_cassette.py prod.cassette.jsonl [--speed 1] [--arrival-speed 1] [--workers 32]
+
+Settings of the app (plan cache, retries, ...) are taken from the environment as usual;
+set PLAN_CACHE_TTL=0 to send every request upstream as in the recording.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(basedir, '..', 'api'))
+
+from loadgen import Client, Results
+
+
+def load_requests(path, prompt_template):
+    """(arrival offset in seconds, goal, streamed) per recorded request, in arrival order."""
+    prefix, _, suffix = prompt_template.partition("{goal_text}")
+    recorded = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                prompt = record["request"]["contents"][0]["parts"][0]["text"]
+            except (ValueError, KeyError, IndexError, TypeError):
+                continue
+            if not (prompt.startswith(prefix) and prompt.endswith(suffix)):
+                # Made from another prompt template, e.g. by a future endpoint
+                continue
+            goal = prompt[len(prefix):len(prompt) - len(suffix)]
+            recorded.append((record["recorded_at"], goal, ":streamGenerateContent" in record["url"]))
+    recorded.sort()
+    # Retries and hedges are separate recordings of one request; the replayed app makes them itself
+    requests, seen = [], {}
+    for at, goal, streamed in recorded:
+        if (goal, streamed) in seen and at - seen[(goal, streamed)] < 60:
+            continue
+        seen[(goal, streamed)] = at
+        requests.append((at - recorded[0][0], goal, streamed))
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("cassette")
+    parser.add_argument("--speed", type=float, default=1.0, help="Upstream timing scale (2 = twice as fast, 0 = instant)")
+    parser.add_argument("--arrival-speed", type=float, default=1.0,
+                        help="Arrival gap scale (2 = twice the request rate, 0 = back to back)")
+    parser.add_argument("--workers", type=int, default=32, help="Concurrent client connections")
+    args = parser.parse_args()
+
+    os.environ.update(GEMINI_CASSETTE_MODE="replay", GEMINI_CASSETTE=args.cassette,
+                      GEMINI_CASSETTE_SPEED=str(args.speed))
+    os.environ.setdefault('GEMINI_API_KEY', 'replay')
+    # The recording already reflects the quota the original traffic ran under
+    os.environ.setdefault('GEMINI_RPM', '0')
+    os.environ.setdefault('GEMINI_TPM', '0')
+    import index
+    from werkzeug.serving import make_server
+
+    requests = load_requests(args.cassette, index.DEFAULT_PROMPT_TEMPLATE)
+    if not requests:
+        sys.exit(f"No replayable requests in {args.cassette}")
+    # Only the app is started; its upstream is the cassette
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, index.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="plan-app", daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    clients = {False: Client(base_url, '/api/generate-plan', 120),
+               True: Client(base_url, '/api/generate-plan/stream', 120)}
+    results = {False: Results(), True: Results()}
+    pool = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="replay")
+
+    def send(scheduled_at, goal, streamed):
+        try:
+            status, cache = clients[streamed].post(goal)
+        except Exception as e:
+            results[streamed].record(0, None, None, error=type(e).__name__)
+            return
+        results[streamed].record((time.perf_counter() - scheduled_at) * 1e6, status, cache)
+
+    start = time.perf_counter()
+    for offset, goal, streamed in requests:
+        scheduled_at = start + (offset / args.arrival_speed if args.arrival_speed > 0 else 0.0)
+        delay = scheduled_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        pool.submit(send, scheduled_at, goal, streamed)
+    pool.shutdown(wait=True)
+    elapsed = time.perf_counter() - start
+
+    print(f"replayed {len(requests)} requests from {args.cassette} in {elapsed:.2f}s "
+          f"(upstream speed {args.speed:g}, arrival speed {args.arrival_speed:g})")
+    for streamed, name in ((False, "generate-plan"), (True, "generate-plan/stream")):
+        result = results[streamed]
+        if not result.sent:
+            continue
+        latency = result.latency
+        statuses = " ".join(f"{status}={count}" for status, count in sorted(result.statuses.items()))
+        errors = " ".join(f"{error}={count}" for error, count in sorted(result.errors.items()))
+        print(f"{name:<22} n={result.sent:<6d} p50={latency.value_at(50) / 1000:9.2f} ms "
+              f"p99={latency.value_at(99) / 1000:9.2f} ms  {statuses} {errors}".rstrip())
+    print(f"cassette: {json.dumps(index.get_transport().snapshot()['cassette'])}")
+
+
+if __name__ == "__main__":
+    main()
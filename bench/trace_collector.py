@@ -0,0 +1,160 @@
+"""
+Local stand-in for an OTLP trace collector, and a viewer for the collected traces.
+
+Accepts OTLP/HTTP JSON on POST /v1/traces (what the app sends with TRACE_EXPORTER=otlp)
+and appends the spans to a JSONL file in the same format as TRACE_EXPORTER=jsonl.
+`--show` prints the traces of such a file as trees with their timings:
+
+    python bench/trace_collector.py --port 4318 --out traces.jsonl
+    TRACE_EXPORTER=otlp TRACE_SAMPLE_RATE=1 GEMINI_API_BASE=http://127.0.0.1:8089 python api/index.py
+    python bench/trace_collector.py --show traces.jsonl [--trace TRACE_ID] [--limit 5]
+
+GET /collector/stats returns how many batches and spans were received.
+"""
+import argparse
+import json
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _attribute_value(value):
+    for kind in ("stringValue", "boolValue", "doubleValue"):
+        if kind in value:
+            return value[kind]
+    if "intValue" in value:
+        return int(value["intValue"])
+    return None
+
+
+def flatten(body):
+    """The spans of an OTLP JSON export request, as flat dicts."""
+    spans = []
+    for resource_spans in body.get("resourceSpans", []):
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            for span in scope_spans.get("spans", []):
+                spans.append({
+                    "trace_id": span["traceId"],
+                    "span_id": span["spanId"],
+                    "parent_span_id": span.get("parentSpanId") or None,
+                    "name": span["name"],
+                    "kind": span.get("kind", 1),
+                    "start_time_unix_nano": int(span["startTimeUnixNano"]),
+                    "end_time_unix_nano": int(span["endTimeUnixNano"]),
+                    "attributes": {a["key"]: _attribute_value(a["value"]) for a in span.get("attributes", [])},
+                    "error": span.get("status", {}).get("message") if span.get("status", {}).get("code") == 2 else None,
+                })
+    return spans
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != "/v1/traces":
+            self.send_error(404)
+            return
+        try:
+            spans = flatten(json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0)))))
+        except (ValueError, KeyError) as e:
+            self.send_error(400, str(e))
+            return
+        self.server.write(spans)
+        self._send_json({})
+
+    def do_GET(self):
+        if self.path != "/collector/stats":
+            self.send_error(404)
+            return
+        self._send_json({"batches": self.server.batches, "spans": self.server.spans})
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TraceCollector(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, out, host="127.0.0.1", port=4318):
+        super().__init__((host, port), _Handler)
+        self.out = out
+        self.batches = 0
+        self.spans = 0
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/traces"
+
+    def write(self, spans):
+        with self._lock:
+            with open(self.out, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(span) + "\n" for span in spans))
+            self.batches += 1
+            self.spans += len(spans)
+
+
+def show(path, trace_id=None, limit=5):
+    """Prints the last `limit` traces (or one trace) of a span file as indented trees."""
+    traces = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                span = json.loads(line)
+                traces[span["trace_id"]].append(span)
+    if trace_id is not None:
+        selected = [trace_id] if trace_id in traces else []
+    else:
+        selected = sorted(traces, key=lambda t: min(s["start_time_unix_nano"] for s in traces[t]))[-limit:]
+    for tid in selected:
+        spans = traces[tid]
+        ids = {span["span_id"] for span in spans}
+        children = defaultdict(list)
+        for span in spans:
+            # Spans whose parent was not recorded here (e.g. the browser's) are roots
+            children[span["parent_span_id"] if span["parent_span_id"] in ids else None].append(span)
+        origin = min(span["start_time_unix_nano"] for span in spans)
+        print(f"trace {tid} ({len(spans)} spans)")
+
+        def walk(parent_id, depth):
+            for span in sorted(children[parent_id], key=lambda s: s["start_time_unix_nano"]):
+                start_ms = (span["start_time_unix_nano"] - origin) / 1e6
+                duration_ms = (span["end_time_unix_nano"] - span["start_time_unix_nano"]) / 1e6
+                details = " ".join(f"{k}={v}" for k, v in span["attributes"].items() if k != "request_id")
+                error = f" ERROR {span['error']}" if span.get("error") else ""
+                print(f"  {start_ms:9.2f} ms {duration_ms:9.2f} ms  {'  ' * depth}{span['name']} {details}{error}")
+                walk(span["span_id"], depth + 1)
+        walk(None, 0)
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--out", default="traces.jsonl", help="JSONL file the received spans are appended to")
+    parser.add_argument("--show", metavar="FILE", help="Print the traces of a span file instead of collecting")
+    parser.add_argument("--trace", help="With --show, print only this trace ID")
+    parser.add_argument("--limit", type=int, default=5, help="With --show, how many of the latest traces to print")
+    args = parser.parse_args()
+
+    if args.show:
+        show(args.show, args.trace, args.limit)
+        return
+    collector = TraceCollector(args.out, args.host, args.port)
+    print(f"Trace collector listening; run the app with TRACE_EXPORTER=otlp TRACE_OTLP_ENDPOINT={collector.endpoint}")
+    try:
+        collector.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()